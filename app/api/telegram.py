@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException, Request
+import hmac
+import os
+
+router = APIRouter(prefix="/telegram", tags=["telegram"])
+
+# URL pública de la ruta del webhook (ej: https://midominio/api/v1/telegram/webhook);
+# si está configurada, main.py levanta el bot en modo webhook en lugar de long polling
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+# Telegram la envía en cada update; los requests que no la traen se rechazan.
+# Vacía, main.py genera una al iniciar (el webhook no acepta updates sin secret)
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+
+@router.post("/webhook")
+async def telegram_webhook(request: Request):
+    """
+    Recibe un update de Telegram y lo procesa con el bot de la app
+    (mismo pipeline y cola que /upload/file).
+    """
+    secret = getattr(request.app.state, "telegram_webhook_secret", None) or TELEGRAM_WEBHOOK_SECRET
+    recibido = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not secret or not hmac.compare_digest(recibido.encode(), secret.encode()):
+        raise HTTPException(status_code=403, detail="Secret token inválido")
+
+    bot = getattr(request.app.state, "telegram_bot", None)
+    if bot is None:
+        raise HTTPException(status_code=503, detail="El bot de Telegram no está iniciado en modo webhook")
+
+    try:
+        datos = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Update inválido")
+
+    await bot.procesar_update(datos)
+    return {"ok": True}
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse
+import hashlib
 import os
 from pathlib import Path
 import uuid
 
-from orchestrator import procesar_imagen_telegram
+from app.jobs import ColaLlenaError, JobQueue
+from orchestrator import escribir_archivo, obtener_pipeline
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
@@ -11,36 +14,114 @@ router = APIRouter(prefix="/upload", tags=["upload"])
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-@router.post("/file")
-async def upload_file(file: UploadFile = File(...)):
+# Tamaño máximo por archivo y tamaño de cada bloque leído
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+# Los recibos se procesan como tareas asíncronas acotadas, sin bloquear el event loop;
+# los que esperan turno se guardan en disco para no retener su contenido en memoria
+jobs = JobQueue(
+    lambda file_path, contenido: obtener_pipeline().aprocesar(file_path, contenido),
+    a_disco=escribir_archivo,
+)
+
+class ArchivoDemasiadoGrandeError(Exception):
+    """El upload supera UPLOAD_MAX_BYTES."""
+
+async def leer_en_memoria(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES):
+    """
+    Lee el upload por bloques, calculando el SHA-256 al vuelo. El contenido
+    va directo a la extracción; el pipeline lo archiva en disco en segundo
+    plano. La memoria usada está acotada por max_bytes.
+    
+    Returns:
+        Tupla (contenido, sha256_hex)
+        
+    Raises:
+        ArchivoDemasiadoGrandeError: si se supera max_bytes
+    """
+    sha256 = hashlib.sha256()
+    contenido = bytearray()
+    while True:
+        bloque = await file.read(UPLOAD_CHUNK_BYTES)
+        if not bloque:
+            break
+        if len(contenido) + len(bloque) > max_bytes:
+            raise ArchivoDemasiadoGrandeError(
+                f"El archivo supera el máximo permitido de {max_bytes} bytes"
+            )
+        sha256.update(bloque)
+        contenido += bloque
+    return bytes(contenido), sha256.hexdigest()
+
+async def rechazar_uploads_grandes(request: Request, call_next):
+    """
+    Middleware: rechaza con 413 los uploads cuyo Content-Length ya excede el
+    máximo, antes de que se lea el cuerpo (se deja margen para el multipart).
+    Los envíos sin Content-Length se cortan igual en leer_en_memoria.
+    """
+    content_length = request.headers.get("content-length")
+    if (request.method == "POST" and request.url.path.endswith(f"{router.prefix}/file")
+            and content_length and content_length.isdigit()
+            and int(content_length) > UPLOAD_MAX_BYTES + 64 * 1024):
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"El archivo supera el máximo permitido de {UPLOAD_MAX_BYTES} bytes"}
+        )
+    return await call_next(request)
+
+@router.post("/file", status_code=202)
+async def upload_file(request: Request, file: UploadFile = File(...)):
     """
-    Recibe un archivo del frontend y lo guarda en la carpeta uploads
+    Recibe un archivo del frontend y lo encola para procesarlo desde memoria
+    (se archiva en la carpeta uploads en segundo plano). Responde de
+    inmediato con el id del trabajo.
     """
     try:
         # Generar nombre único para evitar conflictos
         file_extension = Path(file.filename).suffix
         unique_filename = f"{uuid.uuid4()}{file_extension}"
         file_path = UPLOAD_DIR / unique_filename
-        
-        # Leer contenido del archivo
-        content = await file.read()
-        
-        # Guardar archivo en la carpeta
-        with open(file_path, "wb") as f:
-            f.write(content)
 
-          # Procesar imagen automáticamente
-        processing_success = procesar_imagen_telegram(str(file_path))
+        # Leer el archivo en memoria, por bloques
+        contenido, sha256 = await leer_en_memoria(file)
+        file_size = len(contenido)
+
+        # Encolar el procesamiento del recibo
+        job = jobs.encolar(str(file_path), contenido, original_filename=file.filename, sha256=sha256)
 
         return {
             "message": "Archivo subido exitosamente",
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": str(request.url_for("get_job", job_id=job["id"])),
             "filename": unique_filename,
             "original_filename": file.filename,
-            "file_size": len(content),
-            "file_path": str(file_path),
-            "processing_status": "success" if processing_success else "error"
+            "file_size": file_size,
+            "sha256": sha256,
+            "file_path": str(file_path)
         }
-        
+
+    except ArchivoDemasiadoGrandeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ColaLlenaError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al subir archivo: {str(e)}")
 
+@router.get("/jobs")
+async def list_jobs(status: str = None, limit: int = 50):
+    """
+    Lista los trabajos más recientes (queued, running, done o error).
+    """
+    return {"jobs": jobs.listar(status, limit)}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Devuelve el estado de un trabajo y, si terminó, los datos extraídos.
+    """
+    job = jobs.obtener(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
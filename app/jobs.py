@@ -0,0 +1,135 @@
+"""
+Cola de trabajos en memoria para el endpoint de uploads.
+
+El endpoint guarda el archivo, encola el trabajo y responde al instante;
+los trabajos corren como tareas asyncio en el event loop de uvicorn, con
+un máximo de trabajos simultáneos. El estado de cada trabajo se consulta
+por id.
+
+Solo los trabajos que están ejecutándose conservan el archivo en memoria:
+los que esperan turno lo escriben en disco (ver a_disco), así el pico de
+memoria es UPLOAD_WORKERS x UPLOAD_MAX_BYTES y no UPLOAD_MAX_PENDIENTES x
+UPLOAD_MAX_BYTES.
+"""
+
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+ESTADO_EN_COLA = "queued"
+ESTADO_EJECUTANDO = "running"
+ESTADO_TERMINADO = "done"
+ESTADO_ERROR = "error"
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+UPLOAD_MAX_PENDIENTES = int(os.getenv("UPLOAD_MAX_PENDIENTES", "50"))
+UPLOAD_JOBS_HISTORIAL = int(os.getenv("UPLOAD_JOBS_HISTORIAL", "500"))
+
+
+class ColaLlenaError(Exception):
+    """Se alcanzó el máximo de trabajos pendientes."""
+
+
+class JobQueue:
+    """
+    Trabajos asíncronos acotados, con registro del estado de cada uno.
+
+    Debe usarse desde el event loop (los métodos no son thread-safe).
+    """
+
+    def __init__(self, procesar, max_workers: int = UPLOAD_WORKERS,
+                 max_pendientes: int = UPLOAD_MAX_PENDIENTES, historial: int = UPLOAD_JOBS_HISTORIAL,
+                 a_disco=None):
+        """
+        Args:
+            procesar: Corrutina que recibe la ruta del archivo y su contenido (bytes
+                o None si solo está en disco) y devuelve los datos extraídos o None
+            max_workers: Trabajos ejecutándose a la vez
+            max_pendientes: Trabajos en cola o ejecutándose antes de rechazar nuevos
+            historial: Trabajos terminados que se conservan para consultar
+            a_disco: Función (ruta, contenido) bloqueante que escribe el archivo
+                de un trabajo que tiene que esperar turno; después se procesa
+                desde disco. Sin ella el contenido espera en memoria
+        """
+        self.procesar = procesar
+        self.a_disco = a_disco
+        self.max_workers = max_workers
+        self.max_pendientes = max_pendientes
+        self.historial = historial
+        self._semaforo = None
+        self._tareas = set()
+        self._jobs = OrderedDict()
+        self._pendientes = 0
+
+    def encolar(self, file_path: str, contenido: bytes = None, **info) -> dict:
+        """
+        Registra un trabajo y lanza su tarea. El contenido, si se pasa, se
+        entrega a procesar pero no se guarda en el registro del trabajo.
+
+        Raises:
+            ColaLlenaError: si ya hay max_pendientes trabajos sin terminar
+        """
+        if self._pendientes >= self.max_pendientes:
+            raise ColaLlenaError("Demasiados archivos en proceso, intenta más tarde")
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.max_workers)
+
+        job = {
+            "id": str(uuid.uuid4()),
+            "status": ESTADO_EN_COLA,
+            "file_path": file_path,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "started_at": None,
+            "finished_at": None,
+            "data": None,
+            "error": None,
+            **info,
+        }
+        self._jobs[job["id"]] = job
+        self._pendientes += 1
+        self._recortar_historial()
+
+        tarea = asyncio.create_task(self._ejecutar(job["id"], contenido))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+        return dict(job)
+
+    def _recortar_historial(self):
+        terminados = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in (ESTADO_TERMINADO, ESTADO_ERROR)
+        ]
+        for job_id in terminados[:max(0, len(terminados) - self.historial)]:
+            del self._jobs[job_id]
+
+    async def _ejecutar(self, job_id: str, contenido: bytes = None):
+        job = self._jobs[job_id]
+        try:
+            if contenido is not None and self.a_disco and self._semaforo.locked():
+                # Sin turno libre: el archivo espera en disco y no en memoria
+                await asyncio.to_thread(self.a_disco, job["file_path"], contenido)
+                contenido = None
+            async with self._semaforo:
+                job.update(status=ESTADO_EJECUTANDO, started_at=datetime.now().isoformat(timespec="seconds"))
+                datos = await self.procesar(job["file_path"], contenido)
+            if datos:
+                job.update(status=ESTADO_TERMINADO, data=datos)
+            else:
+                job.update(status=ESTADO_ERROR, error="No se pudo procesar el recibo")
+        except Exception as e:
+            job.update(status=ESTADO_ERROR, error=str(e))
+        finally:
+            job["finished_at"] = datetime.now().isoformat(timespec="seconds")
+            self._pendientes -= 1
+
+    def obtener(self, job_id: str):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def listar(self, status: str = None, limite: int = 50):
+        """Trabajos más recientes primero, opcionalmente filtrados por estado."""
+        jobs = [dict(job) for job in reversed(self._jobs.values())
+                if status is None or job["status"] == status]
+        return jobs[:limite]
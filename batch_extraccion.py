@@ -0,0 +1,310 @@
+"""
+EXTRACCIÓN POR LOTES CON LA BATCH API DE OPENAI
+===============================================
+
+Para backfills y reprocesos nocturnos, donde no hace falta respuesta
+inmediata: las solicitudes (mismo prompt e imagen que leer_recibo) se
+escriben en un JSONL, se envían como un batch (la Batch API cuesta la mitad
+y no consume el rate limit interactivo), se espera el resultado y se
+fusiona en el store por custom_id (el SHA-256 de la imagen).
+
+Pasos:
+    python batch_extraccion.py preparar uploads docs/invoices --salida batch.jsonl
+    python batch_extraccion.py enviar batch.jsonl [batch.parte2.jsonl ...]
+    python batch_extraccion.py esperar BATCH_ID --salida resultados.jsonl
+    python batch_extraccion.py fusionar resultados.jsonl --manifest batch.jsonl.manifest.json
+
+Si las solicitudes superan los límites de un batch (BATCH_MAX_SOLICITUDES,
+BATCH_MAX_BYTES), "preparar" las reparte en varios archivos (batch.jsonl,
+batch.parte2.jsonl, ...) con un único manifest; cada parte se envía como un
+batch propio y sus resultados se fusionan por separado.
+
+O todo junto:
+    python batch_extraccion.py ejecutar uploads docs/invoices
+
+Para probar sin costo, OPENAI_BASE_URL puede apuntar a un servidor local que
+imite la API, y "fusionar" acepta cualquier archivo de resultados grabado.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+import invoice_reader
+from extraction_cache import clave_extraccion, hash_imagen, obtener_cache
+from ingestar import buscar_imagenes
+from invoice_store import obtener_store
+from invoices import sincronizar_pendientes
+from rate_limiter import CARRIL_BACKFILL, carril, obtener_limitador
+
+# Cargar variables de entorno
+load_dotenv()
+
+ENDPOINT_BATCH = "/v1/chat/completions"
+ESTADOS_FINALES = ("completed", "failed", "expired", "cancelled")
+# Límites de la Batch API por archivo de entrada (50.000 solicitudes, 200 MB)
+BATCH_MAX_SOLICITUDES = int(os.getenv("BATCH_MAX_SOLICITUDES", "50000"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+def ruta_parte(salida: str, numero: int) -> str:
+    """Archivo de la parte `numero` (la primera usa `salida` tal cual)."""
+    if numero == 1:
+        return salida
+    base, extension = os.path.splitext(salida)
+    return f"{base}.parte{numero}{extension}"
+
+
+def preparar_batch(rutas, salida: str, max_solicitudes: int = BATCH_MAX_SOLICITUDES,
+                   max_bytes: int = BATCH_MAX_BYTES):
+    """
+    Escribe el JSONL de solicitudes y un manifest custom_id -> imagen.
+    Omite imágenes ya presentes en el store y repetidas. Si se superan
+    max_solicitudes o max_bytes, sigue en otra parte (ver ruta_parte).
+
+    Returns:
+        Lista de archivos de solicitudes escritos (vacía si no hay imágenes nuevas)
+    """
+    store = obtener_store()
+    procesados = store.hashes_procesados()
+    manifest = {}
+    partes = []
+    f = None
+    solicitudes = tamano = 0
+
+    try:
+        for imagen in buscar_imagenes(rutas):
+            with open(imagen, "rb") as archivo:
+                imagen_bytes = archivo.read()
+            custom_id = hash_imagen(imagen_bytes)
+            if custom_id in procesados or custom_id in manifest:
+                continue
+            solicitud = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": ENDPOINT_BATCH,
+                "body": invoice_reader._solicitud_extraccion(imagen_bytes),
+            }
+            linea = (json.dumps(solicitud, ensure_ascii=False) + "\n").encode("utf-8")
+            if len(linea) > max_bytes:
+                print(f"{imagen} supera el tamaño máximo de un batch, se omite")
+                continue
+            if f is None or solicitudes >= max_solicitudes or tamano + len(linea) > max_bytes:
+                if f is not None:
+                    f.close()
+                partes.append(ruta_parte(salida, len(partes) + 1))
+                f = open(partes[-1], "wb")
+                solicitudes = tamano = 0
+            f.write(linea)
+            solicitudes += 1
+            tamano += len(linea)
+            manifest[custom_id] = imagen
+    finally:
+        if f is not None:
+            f.close()
+
+    with open(salida + ".manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    print(f"{len(manifest)} solicitudes escritas en {', '.join(partes) or salida}")
+    return partes
+
+
+def enviar_batch(archivo_jsonl: str):
+    """
+    Sube el JSONL y crea el batch.
+
+    Returns:
+        ID del batch
+    """
+    client = invoice_reader.obtener_cliente()
+    limitador = obtener_limitador("openai")
+
+    def subir():
+        # Se reabre en cada intento: un reintento con el archivo ya leído subiría un JSONL vacío
+        with open(archivo_jsonl, "rb") as f:
+            return client.files.create(file=f, purpose="batch")
+
+    archivo = limitador.ejecutar(subir)
+    batch = limitador.ejecutar(
+        client.batches.create,
+        input_file_id=archivo.id,
+        endpoint=ENDPOINT_BATCH,
+        completion_window="24h",
+        metadata={"origen": "batch_extraccion", "archivo": os.path.basename(archivo_jsonl)},
+    )
+    print(f"Batch creado: {batch.id} (estado: {batch.status})")
+    return batch.id
+
+
+def esperar_batch(batch_id: str, salida: str, intervalo: float = 60):
+    """
+    Consulta el batch hasta que termina y descarga los resultados.
+
+    Returns:
+        Ruta del archivo de resultados, o None si el batch no se completó
+    """
+    client = invoice_reader.obtener_cliente()
+    limitador = obtener_limitador("openai")
+    while True:
+        batch = limitador.ejecutar(client.batches.retrieve, batch_id)
+        conteo = batch.request_counts
+        if conteo:
+            print(f"Batch {batch_id}: {batch.status} - {conteo.completed}/{conteo.total} completadas, {conteo.failed} fallidas")
+        else:
+            print(f"Batch {batch_id}: {batch.status}")
+        if batch.status in ESTADOS_FINALES:
+            break
+        time.sleep(intervalo)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"El batch terminó sin resultados (estado: {batch.status})")
+        return None
+
+    contenido = limitador.ejecutar(client.files.content, batch.output_file_id)
+    with open(salida, "wb") as f:
+        f.write(contenido.read())
+    print(f"Resultados descargados en {salida}")
+    return salida
+
+
+def fusionar_resultados(archivo_resultados: str, manifest_path: str):
+    """
+    Convierte cada respuesta del batch en un invoice y los agrega al store
+    en una sola escritura. Los custom_id que ya están en el store se omiten,
+    así que fusionar dos veces el mismo archivo no duplica registros.
+
+    Returns:
+        Tupla (agregados, errores)
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    store = obtener_store()
+    procesados = store.hashes_procesados()
+    cache = obtener_cache()
+    nuevos = []
+    errores = 0
+
+    with open(archivo_resultados, "r", encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            resultado = json.loads(linea)
+            custom_id = resultado.get("custom_id")
+            if custom_id in procesados:
+                continue
+            respuesta = resultado.get("response") or {}
+            if resultado.get("error") or respuesta.get("status_code") != 200:
+                print(f"Error en {manifest.get(custom_id, custom_id)}: {resultado.get('error') or respuesta.get('status_code')}")
+                errores += 1
+                continue
+            try:
+                contenido = (respuesta["body"]["choices"][0]["message"]["content"] or "").strip()
+                try:
+                    datos = invoice_reader._interpretar_respuesta(contenido)
+                except json.JSONDecodeError:
+                    datos = invoice_reader.reparar_respuesta(contenido)
+            except Exception as e:
+                # Incluye errores de la API al reparar: esta línea falla, el resto se fusiona igual
+                print(f"Respuesta inválida para {manifest.get(custom_id, custom_id)}: {e}")
+                errores += 1
+                continue
+
+            datos = invoice_reader._completar_datos(datos, manifest.get(custom_id, ""), custom_id)
+            if cache:
+                # Se cachea con el id, como en leer_recibo: si la imagen vuelve a llegar apunta al mismo registro
+                cache.put(clave_extraccion(custom_id, invoice_reader.VERSION_EXTRACCION), dict(datos))
+            nuevos.append(datos)
+            procesados.add(custom_id)
+
+    if nuevos:
+        store.append_many(nuevos)
+    print(f"Fusión completada: {len(nuevos)} registros agregados, {errores} errores")
+    return len(nuevos), errores
+
+
+def _sincronizar():
+    sheet_id = os.getenv("GOOGLE_SHEET_ID")
+    if not sheet_id:
+        print("GOOGLE_SHEET_ID no configurado, se omite la sincronización")
+        return True
+    credentials_path = os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json")
+    return sincronizar_pendientes(sheet_id, credentials_path, obtener_store().ruta)
+
+
+def _ejecutar_comando(args):
+    if args.comando == "preparar":
+        preparar_batch(args.rutas, args.salida)
+    elif args.comando == "enviar":
+        for archivo in args.archivos:
+            enviar_batch(archivo)
+    elif args.comando == "esperar":
+        if not esperar_batch(args.batch_id, args.salida, args.intervalo):
+            sys.exit(1)
+    else:
+        if args.comando == "ejecutar":
+            partes = preparar_batch(args.rutas, args.salida)
+            if not partes:
+                print("No hay imágenes nuevas")
+                sys.exit(0)
+            manifest = args.salida + ".manifest.json"
+            # Todas las partes se envían antes de esperar: la Batch API las procesa en paralelo
+            batch_ids = [enviar_batch(parte) for parte in partes]
+            agregados = errores = 0
+            for parte, batch_id in zip(partes, batch_ids):
+                resultados = esperar_batch(batch_id, parte + ".resultados.jsonl", args.intervalo)
+                if not resultados:
+                    errores += 1
+                    continue
+                agregados_parte, errores_parte = fusionar_resultados(resultados, manifest)
+                agregados += agregados_parte
+                errores += errores_parte
+        else:
+            agregados, errores = fusionar_resultados(args.resultados, args.manifest)
+
+        if agregados and not args.sin_sheets and not _sincronizar():
+            sys.exit(1)
+        sys.exit(1 if errores else 0)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extracción de recibos con la Batch API de OpenAI")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p = comandos.add_parser("preparar", help="Escribir el JSONL de solicitudes")
+    p.add_argument("rutas", nargs="+")
+    p.add_argument("--salida", default="batch.jsonl")
+
+    p = comandos.add_parser("enviar", help="Subir cada JSONL y crear su batch")
+    p.add_argument("archivos", nargs="+")
+
+    p = comandos.add_parser("esperar", help="Esperar el batch y descargar resultados")
+    p.add_argument("batch_id")
+    p.add_argument("--salida", default="resultados.jsonl")
+    p.add_argument("--intervalo", type=float, default=60)
+
+    p = comandos.add_parser("fusionar", help="Agregar los resultados al store")
+    p.add_argument("resultados")
+    p.add_argument("--manifest", default="batch.jsonl.manifest.json")
+    p.add_argument("--sin-sheets", action="store_true")
+
+    p = comandos.add_parser("ejecutar", help="Preparar, enviar, esperar y fusionar")
+    p.add_argument("rutas", nargs="+")
+    p.add_argument("--salida", default="batch.jsonl")
+    p.add_argument("--intervalo", type=float, default=60)
+    p.add_argument("--sin-sheets", action="store_true")
+
+    args = parser.parse_args()
+
+    # Todo el proceso usa el carril de backfill: no compite con el bot por la cuota
+    with carril(CARRIL_BACKFILL):
+        _ejecutar_comando(args)
+
+
+if __name__ == "__main__":
+    main()
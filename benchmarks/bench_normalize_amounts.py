@@ -0,0 +1,58 @@
+"""
+Benchmark: normalización de montos por lotes.
+
+Compara _normalize_amount_string aplicado valor por valor contra
+normalize_amounts sobre la misma lista, con montos todos distintos y con
+montos recurrentes. Los montos salen del mismo generador que las pruebas
+de equivalencia (tests/test_normalize_amount.py).
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_normalize_amounts.py [CANTIDAD] [SEMILLA]
+"""
+
+import os
+import random
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "tests"))
+
+from helpers.normalize_amount import _normalize_amount_string, normalize_amounts
+# Los mismos montos que usan las pruebas de equivalencia
+from test_normalize_amount import FIJOS, monto_aleatorio
+
+
+def medir(funcion, repeticiones=5):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return min(tiempos)
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    semilla = int(sys.argv[2]) if len(sys.argv) > 2 else 1234
+    rng = random.Random(semilla)
+    valores = FIJOS + [monto_aleatorio(rng) for _ in range(cantidad)]
+
+    print(f"{len(valores)} montos (semilla {semilla})")
+
+    # Montos todos distintos (peor caso) y con repeticiones, como en un backfill real
+    # donde se repiten alquileres, servicios y transferencias habituales
+    recurrentes = [rng.choice(valores[:len(valores) // 50 or 1]) for _ in range(len(valores))]
+    for nombre, lote in (("distintos", valores), ("recurrentes", recurrentes)):
+        uno_por_uno = medir(lambda: [_normalize_amount_string(valor) for valor in lote])
+        por_lotes = medir(lambda: normalize_amounts(lote))
+        centavos = medir(lambda: normalize_amounts(lote, como_centavos=True))
+        print(f"\nMontos {nombre}:")
+        print(f"  {'_normalize_amount_string':<26} {uno_por_uno:9.1f} ms")
+        print(f"  {'normalize_amounts':<26} {por_lotes:9.1f} ms  ({uno_por_uno / por_lotes:.1f}x)")
+        print(f"  {'normalize_amounts centavos':<26} {centavos:9.1f} ms  ({uno_por_uno / centavos:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: costo por imagen del orquestador, sin red.
+
+Compara el flujo anterior (cargar invoice_reader.py con
+spec_from_file_location + exec_module en cada imagen, importar invoices,
+extraer y guardar) contra InvoicePipeline.procesar completo con un pipeline
+reutilizado (cola persistente, extracción, guardado con chequeo de
+duplicados y sincronización). La extracción devuelve datos fijos y la
+subida a Google Sheets se reemplaza por una función que no hace nada, así
+se mide solo lo que agrega el orquestador. Store y cola van a un
+directorio temporal.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_orchestrator_overhead.py [ITERACIONES]
+"""
+
+import contextlib
+import importlib.util
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.chdir(RAIZ)
+
+from cola_recibos import ColaRecibos
+from invoice_store import obtener_store
+from orchestrator import InvoicePipeline
+
+
+def datos_extraidos(imagen_path):
+    """Lo que devolvería la extracción, con un id nuevo por imagen."""
+    return {
+        "id": str(uuid.uuid4()),
+        "fecha": "19/08/2025",
+        "total": "12500.00",
+        "receptor": "Comercio de prueba",
+        "archivo": os.path.basename(imagen_path),
+    }
+
+
+class LectorFijo:
+    """Reemplaza a invoice_reader: no llama a OpenAI."""
+
+    def leer_recibo(self, imagen_path):
+        return datos_extraidos(imagen_path)
+
+
+def flujo_exec_module(imagen_path, ruta_store):
+    """El orquestador anterior: recarga invoice_reader.py en cada imagen."""
+    spec = importlib.util.spec_from_file_location("invoice_reader", "invoice_reader.py")
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    from invoices import sincronizar_pendientes  # noqa: F401 (ya cacheado, como antes)
+
+    resultado = datos_extraidos(imagen_path)
+    if not modulo.guardar_en_json(resultado, ruta_store):
+        raise RuntimeError("No se pudo guardar en el store")
+    return resultado
+
+
+def medir(funcion, iteraciones):
+    tiempos = []
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            resultado = funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        if not resultado:
+            raise RuntimeError("El flujo no devolvió datos")
+    return tiempos
+
+
+def main():
+    iteraciones = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    with tempfile.TemporaryDirectory() as directorio:
+        imagen_path = os.path.join(directorio, "recibo.jpg")
+        with open(imagen_path, "wb") as f:
+            f.write(b"\xff\xd8\xff\xe0 jpeg de prueba")
+
+        store_anterior = os.path.join(directorio, "anterior.jsonl")
+        cola = ColaRecibos(os.path.join(directorio, "cola.db"))
+        pipeline = InvoicePipeline(
+            reader=LectorFijo(),
+            store=obtener_store(os.path.join(directorio, "pipeline.jsonl")),
+            cola=cola,
+            sheet_id="benchmark",
+        )
+        pipeline.sincronizar = lambda: True
+
+        # Primera pasada fuera de la medición: ambos pagan los imports de terceros una vez
+        medir(lambda: flujo_exec_module(imagen_path, store_anterior), 1)
+        medir(lambda: pipeline.procesar(imagen_path)[0], 1)
+
+        for nombre, funcion in (
+            ("exec_module por imagen", lambda: flujo_exec_module(imagen_path, store_anterior)),
+            ("pipeline.procesar", lambda: pipeline.procesar(imagen_path)[0]),
+        ):
+            tiempos = sorted(medir(funcion, iteraciones))
+            print(f"{nombre:<24} media {statistics.mean(tiempos):8.3f} ms  "
+                  f"mediana {statistics.median(tiempos):8.3f} ms  "
+                  f"p95 {tiempos[int(len(tiempos) * 0.95) - 1]:8.3f} ms")
+
+        cola.close()
+
+
+if __name__ == "__main__":
+    main()
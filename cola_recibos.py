@@ -0,0 +1,407 @@
+"""
+COLA PERSISTENTE DE RECIBOS
+===========================
+
+Cada recibo es un trabajo en SQLite que avanza por etapas:
+
+    extraer -> guardar -> sincronizar -> terminado
+
+El estado se guarda al terminar cada etapa, así que si el proceso muere o
+Google Sheets está caído después de guardar, el trabajo queda en la cola y un
+worker lo retoma (entrega al menos una vez). Un trabajo tomado queda
+"alquilado" COLA_LEASE_SEGUNDOS; si quien lo tomó se cae, el alquiler vence y
+otro worker lo reintenta. El id del invoice (generado al extraer y guardado
+en el trabajo) es la clave de idempotencia: reintentar "guardar" no duplica
+registros y "sincronizar" solo sube lo que el store marca como pendiente.
+
+Uso:
+    python cola_recibos.py worker --concurrencia 4
+    python cola_recibos.py worker --una-pasada
+    python cola_recibos.py encolar docs/invoices/recibo.jpg
+    python cola_recibos.py estado
+    python cola_recibos.py reintentar-errores
+
+Configuración (.env):
+    COLA_PATH=docs/invoices/cola_recibos.db
+    COLA_LEASE_SEGUNDOS=300
+    COLA_MAX_INTENTOS=5           # para extraer; sincronizar se reintenta sin límite
+    COLA_WORKER_CONCURRENCIA=4
+    COLA_WORKER_INTERVALO=5       # segundos entre pasadas cuando la cola está vacía
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Cargar variables de entorno (la configuración se lee al importar)
+load_dotenv()
+
+COLA_PATH = os.getenv("COLA_PATH", "docs/invoices/cola_recibos.db")
+COLA_LEASE_SEGUNDOS = float(os.getenv("COLA_LEASE_SEGUNDOS", "300"))
+COLA_MAX_INTENTOS = int(os.getenv("COLA_MAX_INTENTOS", "5"))
+COLA_WORKER_CONCURRENCIA = int(os.getenv("COLA_WORKER_CONCURRENCIA", "4"))
+COLA_WORKER_INTERVALO = float(os.getenv("COLA_WORKER_INTERVALO", "5"))
+
+ETAPA_EXTRAER = "extraer"
+ETAPA_GUARDAR = "guardar"
+ETAPA_SINCRONIZAR = "sincronizar"
+ETAPA_TERMINADO = "terminado"
+ETAPA_ERROR = "error"
+
+ETAPAS_PENDIENTES = (ETAPA_EXTRAER, ETAPA_GUARDAR, ETAPA_SINCRONIZAR)
+
+
+class ColaRecibos:
+    """
+    Cola de trabajos por etapas sobre SQLite (WAL), segura entre hilos y
+    entre procesos que comparten el archivo.
+    """
+
+    def __init__(self, ruta: str = COLA_PATH, lease_segundos: float = COLA_LEASE_SEGUNDOS,
+                 max_intentos: int = COLA_MAX_INTENTOS):
+        self.ruta = ruta
+        self.lease_segundos = lease_segundos
+        self.max_intentos = max_intentos
+        self._lock = threading.Lock()
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS trabajos (
+                id TEXT PRIMARY KEY,
+                archivo TEXT NOT NULL,
+                etapa TEXT NOT NULL,
+                datos TEXT,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                disponible_desde REAL NOT NULL,
+                error TEXT,
+                origen TEXT,
+                creado REAL NOT NULL,
+                actualizado REAL NOT NULL,
+                error_archivo TEXT
+            )
+        """)
+        # Columna agregada después de crear la cola
+        existentes = {fila["name"] for fila in self._conn.execute("PRAGMA table_info(trabajos)")}
+        if "error_archivo" not in existentes:
+            self._conn.execute("ALTER TABLE trabajos ADD COLUMN error_archivo TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_etapa ON trabajos (etapa, disponible_desde)")
+
+    def _fila(self, fila):
+        if fila is None:
+            return None
+        trabajo = dict(fila)
+        trabajo["datos"] = json.loads(trabajo["datos"]) if trabajo["datos"] else None
+        return trabajo
+
+    def encolar(self, archivo: str, origen: str = "", reclamar: bool = False) -> dict:
+        """
+        Agrega un recibo en la etapa "extraer".
+
+        Args:
+            archivo: Ruta de la imagen
+            origen: De dónde vino (telegram, api, ...), informativo
+            reclamar: Si es True el trabajo queda alquilado para quien lo encola,
+                que va a procesarlo en línea; si se cae, un worker lo retoma
+        """
+        ahora = time.time()
+        trabajo = {
+            "id": str(uuid.uuid4()),
+            "archivo": archivo,
+            "etapa": ETAPA_EXTRAER,
+            "datos": None,
+            "intentos": 0,
+            "disponible_desde": ahora + self.lease_segundos if reclamar else ahora,
+            "error": None,
+            "origen": origen,
+            "creado": ahora,
+            "actualizado": ahora,
+            "error_archivo": None,
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO trabajos (id, archivo, etapa, datos, intentos, disponible_desde, error, origen, creado, actualizado, error_archivo) "
+                "VALUES (:id, :archivo, :etapa, :datos, :intentos, :disponible_desde, :error, :origen, :creado, :actualizado, :error_archivo)",
+                trabajo,
+            )
+        return trabajo
+
+    def reclamar(self, etapas=ETAPAS_PENDIENTES, limite: int = 1):
+        """
+        Toma hasta `limite` trabajos disponibles en las etapas indicadas,
+        alquilándolos por lease_segundos.
+
+        Returns:
+            Lista de trabajos tomados (puede estar vacía)
+        """
+        ahora = time.time()
+        marcadores = ",".join("?" for _ in etapas)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                filas = self._conn.execute(
+                    f"SELECT * FROM trabajos WHERE etapa IN ({marcadores}) AND disponible_desde <= ? "
+                    "ORDER BY creado LIMIT ?",
+                    (*etapas, ahora, limite),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE trabajos SET disponible_desde = ?, actualizado = ? WHERE id = ?",
+                    [(ahora + self.lease_segundos, ahora, fila["id"]) for fila in filas],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [self._fila(fila) for fila in filas]
+
+    def avanzar(self, trabajo_id: str, etapa: str, datos=None):
+        """
+        Registra que terminó la etapa actual y pasa el trabajo a `etapa`.
+        Quien lo tiene sigue con la etapa siguiente, así que el alquiler se
+        renueva: otro worker lo toma solo si este se cae.
+        """
+        ahora = time.time()
+        with self._lock:
+            if datos is None:
+                self._conn.execute(
+                    "UPDATE trabajos SET etapa = ?, intentos = 0, error = NULL, disponible_desde = ?, actualizado = ? WHERE id = ?",
+                    (etapa, ahora + self.lease_segundos, ahora, trabajo_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE trabajos SET etapa = ?, datos = ?, intentos = 0, error = NULL, disponible_desde = ?, actualizado = ? "
+                    "WHERE id = ?",
+                    (etapa, json.dumps(datos, ensure_ascii=False), ahora + self.lease_segundos, ahora, trabajo_id),
+                )
+
+    def fallar(self, trabajo_id: str, error: str):
+        """
+        Registra un fallo de la etapa actual y programa el reintento con backoff.
+        "extraer" pasa a "error" tras max_intentos; las demás etapas se
+        reintentan siempre (el recibo ya está extraído y no debe perderse).
+
+        Returns:
+            La etapa en la que quedó el trabajo
+        """
+        ahora = time.time()
+        with self._lock:
+            fila = self._conn.execute("SELECT etapa, intentos FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+            if fila is None:
+                return None
+            intentos = fila["intentos"] + 1
+            etapa = fila["etapa"]
+            if etapa == ETAPA_EXTRAER and intentos >= self.max_intentos:
+                etapa = ETAPA_ERROR
+            espera = min(2 ** intentos * 5, 300) * random.uniform(0.8, 1.2)
+            self._conn.execute(
+                "UPDATE trabajos SET etapa = ?, intentos = ?, error = ?, disponible_desde = ?, actualizado = ? WHERE id = ?",
+                (etapa, intentos, error, ahora + espera, ahora, trabajo_id),
+            )
+        return etapa
+
+    def registrar_error_archivo(self, trabajo_id: str, error: str):
+        """
+        Anota que la imagen del trabajo no se pudo escribir en disco, sin
+        cambiar su etapa: si hubiera que reintentar la extracción, el
+        archivo no está (ver "estado").
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE trabajos SET error_archivo = ?, actualizado = ? WHERE id = ?",
+                (error, time.time(), trabajo_id),
+            )
+
+    def obtener(self, trabajo_id: str):
+        with self._lock:
+            fila = self._conn.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        return self._fila(fila)
+
+    def reintentar_errores(self) -> int:
+        """Vuelve a poner en "extraer" los trabajos que agotaron sus intentos."""
+        ahora = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE trabajos SET etapa = ?, intentos = 0, disponible_desde = ?, actualizado = ? WHERE etapa = ?",
+                (ETAPA_EXTRAER, ahora, ahora, ETAPA_ERROR),
+            )
+        return cursor.rowcount
+
+    def estado(self) -> dict:
+        """Cantidad de trabajos por etapa, más "sin_archivo": los que no se pudieron archivar."""
+        with self._lock:
+            filas = self._conn.execute("SELECT etapa, COUNT(*) FROM trabajos GROUP BY etapa").fetchall()
+            sin_archivo = self._conn.execute(
+                "SELECT COUNT(*) FROM trabajos WHERE error_archivo IS NOT NULL"
+            ).fetchone()[0]
+        estado = {etapa: cantidad for etapa, cantidad in filas}
+        estado["sin_archivo"] = sin_archivo
+        return estado
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cola = None
+_cola_lock = threading.Lock()
+
+
+def obtener_cola() -> ColaRecibos:
+    """Devuelve la cola del proceso, creándola la primera vez."""
+    global _cola
+    with _cola_lock:
+        if _cola is None:
+            _cola = ColaRecibos()
+        return _cola
+
+
+async def ejecutar_etapas(pipeline, cola: ColaRecibos, trabajo: dict, imagen_bytes: bytes = None):
+    """
+    Lleva un trabajo desde su etapa actual hasta "terminado", guardando el
+    avance en la cola después de cada etapa. Si se pasa imagen_bytes, la
+    extracción usa esos bytes en lugar de leer el archivo del trabajo.
+
+    Returns:
+        Tupla (etapa_final, datos)
+    """
+    etapa, datos = trabajo["etapa"], trabajo["datos"]
+    try:
+        if etapa == ETAPA_EXTRAER:
+            datos = await pipeline.reader.aleer_recibo(trabajo["archivo"], imagen_bytes)
+            if not datos:
+                return await asyncio.to_thread(cola.fallar, trabajo["id"], "No se pudieron extraer datos de la imagen"), None
+            etapa = ETAPA_GUARDAR
+            await asyncio.to_thread(cola.avanzar, trabajo["id"], etapa, datos)
+
+        if etapa == ETAPA_GUARDAR:
+            # Idempotente: guardar no agrega un id que ya está en el store
+            # (un intento anterior o la misma imagen procesada antes)
+            if not await asyncio.to_thread(pipeline.guardar, datos):
+                return await asyncio.to_thread(cola.fallar, trabajo["id"], "No se pudo guardar en el store"), datos
+            etapa = ETAPA_SINCRONIZAR
+            await asyncio.to_thread(cola.avanzar, trabajo["id"], etapa)
+
+        if etapa == ETAPA_SINCRONIZAR:
+            if not await asyncio.to_thread(pipeline.sincronizar):
+                return await asyncio.to_thread(cola.fallar, trabajo["id"], "No se pudo subir a Google Sheets"), datos
+            etapa = ETAPA_TERMINADO
+            await asyncio.to_thread(cola.avanzar, trabajo["id"], etapa)
+
+    except Exception as e:
+        return await asyncio.to_thread(cola.fallar, trabajo["id"], str(e)), datos
+    return etapa, datos
+
+
+async def _sincronizar_lote(pipeline, cola: ColaRecibos, trabajos):
+    # Una sola sincronización sube los pendientes de todos los trabajos
+    ok = await asyncio.to_thread(pipeline.sincronizar)
+
+    def registrar():
+        # Las escrituras en la cola (SQLite) no corren en el event loop
+        for trabajo in trabajos:
+            if ok:
+                cola.avanzar(trabajo["id"], ETAPA_TERMINADO)
+            else:
+                cola.fallar(trabajo["id"], "No se pudo subir a Google Sheets")
+
+    await asyncio.to_thread(registrar)
+    return len(trabajos)
+
+
+async def drenar(pipeline=None, cola: ColaRecibos = None, concurrencia: int = COLA_WORKER_CONCURRENCIA,
+                 una_pasada: bool = False, intervalo: float = COLA_WORKER_INTERVALO):
+    """
+    Worker: procesa los trabajos disponibles manteniendo hasta `concurrencia`
+    en curso. Los que esperan sincronizar se resuelven juntos con una sola
+    subida. Con una_pasada=True termina cuando no queda nada disponible.
+
+    Returns:
+        Cantidad de trabajos procesados
+    """
+    if pipeline is None:
+        from orchestrator import obtener_pipeline
+        pipeline = obtener_pipeline()
+    cola = cola or obtener_cola()
+    procesados = 0
+    en_curso = set()
+
+    async def procesar(trabajo):
+        nonlocal procesados
+        etapa, _ = await ejecutar_etapas(pipeline, cola, trabajo)
+        procesados += 1
+        print(f"Trabajo {trabajo['id']} ({trabajo['archivo']}): {etapa}")
+
+    while True:
+        sincronizar = await asyncio.to_thread(cola.reclamar, (ETAPA_SINCRONIZAR,), 1000)
+        if sincronizar:
+            procesados += await _sincronizar_lote(pipeline, cola, sincronizar)
+
+        libres = concurrencia - len(en_curso)
+        trabajos = await asyncio.to_thread(cola.reclamar, (ETAPA_EXTRAER, ETAPA_GUARDAR), libres) if libres > 0 else []
+        for trabajo in trabajos:
+            tarea = asyncio.create_task(procesar(trabajo))
+            en_curso.add(tarea)
+            tarea.add_done_callback(en_curso.discard)
+
+        if en_curso:
+            # Volver a buscar trabajo apenas se libera un lugar
+            await asyncio.wait(en_curso, timeout=intervalo, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        if una_pasada and not sincronizar:
+            return procesados
+        await asyncio.sleep(intervalo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cola persistente de recibos")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p = comandos.add_parser("worker", help="Procesar la cola")
+    p.add_argument("--concurrencia", type=int, default=COLA_WORKER_CONCURRENCIA)
+    p.add_argument("--una-pasada", action="store_true", help="Terminar cuando la cola quede vacía")
+
+    p = comandos.add_parser("encolar", help="Agregar imágenes a la cola")
+    p.add_argument("imagenes", nargs="+")
+
+    comandos.add_parser("estado", help="Trabajos por etapa")
+    comandos.add_parser("reintentar-errores", help="Reintentar los trabajos en error")
+
+    args = parser.parse_args()
+    cola = obtener_cola()
+
+    if args.comando == "worker":
+        print(f"Worker iniciado (concurrencia {args.concurrencia}, cola {cola.ruta})")
+        try:
+            procesados = asyncio.run(drenar(cola=cola, concurrencia=max(1, args.concurrencia), una_pasada=args.una_pasada))
+            print(f"{procesados} trabajos procesados")
+        except KeyboardInterrupt:
+            print("Worker detenido")
+    elif args.comando == "encolar":
+        for imagen in args.imagenes:
+            trabajo = cola.encolar(imagen, origen="cli")
+            print(f"Encolado {imagen}: {trabajo['id']}")
+    elif args.comando == "estado":
+        estado = cola.estado()
+        for etapa in (*ETAPAS_PENDIENTES, ETAPA_TERMINADO, ETAPA_ERROR, "sin_archivo"):
+            print(f"{etapa:<12} {estado.get(etapa, 0)}")
+    else:
+        print(f"{cola.reintentar_errores()} trabajos reencolados")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Índice incremental de estadísticas de invoices.
+
+El comando 'estado' del bot contaba imágenes con glob y registros recorriendo
+el store completo en cada mensaje. Este índice se actualiza al guardar cada
+invoice y al marcarlo como subido a Sheets, así que el resumen sale de unas
+pocas filas sin importar el tamaño del historial:
+
+- cantidad de recibos por día de procesamiento
+- cantidad y total por cuenta_origen y por receptor
+- último recibo procesado y última sincronización
+- pendientes de subir a Sheets y desde cuándo (retraso de sincronización)
+
+Vive en "<store>.stats.db" junto al store (ver invoice_store.obtener_store),
+en SQLite WAL para que el bot y un worker aparte puedan actualizarlo a la vez.
+Guarda hasta dónde leyó el store (offset en bytes del JSONL o seq de SQLite):
+cada actualización suma solo lo agregado desde esa marca, en la misma
+transacción que la mueve, así que una actualización fallida o lo que guardó
+otro proceso se recupera en la siguiente (o al abrir el store) sin contar
+nada dos veces. Si no existe se reconstruye recorriendo el store por partes.
+
+Configuración (.env):
+    ESTADISTICAS_HABILITADAS=1
+
+Uso:
+    python estadisticas.py [RUTA_STORE]               # resumen
+    python estadisticas.py reconstruir [RUTA_STORE]   # ej: después de compactar o importar
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+from helpers.normalize_amount import normalize_amounts
+from setup_google_sheets import CSVColumns
+
+# Cargar variables de entorno (la configuración se lee al importar)
+load_dotenv()
+
+ESTADISTICAS_HABILITADAS = os.getenv("ESTADISTICAS_HABILITADAS", "1") not in ("0", "false", "no")
+
+DIMENSION_DIA = "dia"
+DIMENSION_CUENTA = CSVColumns.CUENTA_ORIGEN.value
+DIMENSION_RECEPTOR = CSVColumns.RECEPTOR.value
+
+
+def ruta_indice(ruta_store: str) -> str:
+    # Se conserva la extensión: la marca es un offset en el JSONL y un seq en
+    # SQLite, así que invoices.jsonl e invoices.db no pueden compartir índice
+    return ruta_store + ".stats.db"
+
+
+def _fecha_procesamiento(datos: dict):
+    try:
+        return datetime.strptime(str(datos.get(CSVColumns.FECHA_PROCESAMIENTO.value)), "%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _dia_procesamiento(datos: dict) -> str:
+    """Día (AAAA-MM-DD) en que se procesó el recibo; hoy si no lo indica."""
+    return (_fecha_procesamiento(datos) or datetime.now()).strftime("%Y-%m-%d")
+
+
+class IndiceEstadisticas:
+    """
+    Contadores por dimensión (día, cuenta_origen, receptor) más algunos
+    valores sueltos (registros, pendientes, marcas de tiempo). Seguro entre
+    hilos y procesos: cada actualización es una transacción.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        # Autocommit: las transacciones se abren explícitamente con BEGIN
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS contadores (
+                dimension TEXT NOT NULL,
+                clave TEXT NOT NULL,
+                cantidad INTEGER NOT NULL DEFAULT 0,
+                total_centavos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, clave)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_contadores_cantidad ON contadores (dimension, cantidad)"
+        )
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS valores (
+                clave TEXT PRIMARY KEY,
+                valor REAL
+            )
+        """)
+
+    def _valor(self, clave: str, defecto=None):
+        fila = self._conn.execute("SELECT valor FROM valores WHERE clave = ?", (clave,)).fetchone()
+        return fila[0] if fila and fila[0] is not None else defecto
+
+    def _fijar(self, clave: str, valor):
+        self._conn.execute(
+            "INSERT INTO valores (clave, valor) VALUES (?, ?) "
+            "ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+            (clave, valor),
+        )
+
+    def _transaccion(self, funcion, *args):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = funcion(*args)
+                self._conn.execute("COMMIT")
+                return resultado
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def inicializado(self) -> bool:
+        with self._lock:
+            return self._valor("marca_store") is not None
+
+    def _sumar(self, invoices):
+        centavos = normalize_amounts(
+            [datos.get(CSVColumns.TOTAL.value) or "0" for datos in invoices], como_centavos=True
+        )
+        incrementos = {}
+        for datos, monto in zip(invoices, centavos):
+            claves = (
+                (DIMENSION_DIA, _dia_procesamiento(datos)),
+                (DIMENSION_CUENTA, str(datos.get(DIMENSION_CUENTA) or "").strip() or "(sin cuenta)"),
+                (DIMENSION_RECEPTOR, str(datos.get(DIMENSION_RECEPTOR) or "").strip() or "(sin receptor)"),
+            )
+            for clave in claves:
+                cantidad, total = incrementos.get(clave, (0, 0))
+                incrementos[clave] = (cantidad + 1, total + monto)
+        self._conn.executemany(
+            "INSERT INTO contadores (dimension, clave, cantidad, total_centavos) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(dimension, clave) DO UPDATE SET "
+            "cantidad = cantidad + excluded.cantidad, total_centavos = total_centavos + excluded.total_centavos",
+            [(dimension, clave, cantidad, total) for (dimension, clave), (cantidad, total) in incrementos.items()],
+        )
+
+        ahora = time.time()
+        pendientes = self._valor("pendientes", 0)
+        nuevos_pendientes = len(invoices)
+        fecha = _fecha_procesamiento(invoices[-1])
+        self._fijar("registros", self._valor("registros", 0) + len(invoices))
+        self._fijar("pendientes", pendientes + nuevos_pendientes)
+        self._fijar("ultimo_procesado", fecha.timestamp() if fecha else ahora)
+        if pendientes == 0 and nuevos_pendientes > 0:
+            self._fijar("pendiente_desde", ahora)
+
+    def _vaciar(self):
+        self._conn.execute("DELETE FROM contadores")
+        self._conn.execute("DELETE FROM valores")
+        self._fijar("registros", 0)
+        self._fijar("pendientes", 0)
+        self._fijar("marca_store", 0)
+
+    def _avanzar(self, store, lote: int):
+        marca = int(self._valor("marca_store", 0))
+        if marca > store.marca_final():
+            # El store se compactó o reemplazó por fuera: la marca ya no vale
+            self._vaciar()
+            marca = 0
+        invoices, marca = store.leer_desde(marca, lote)
+        if invoices:
+            self._sumar(invoices)
+        self._fijar("marca_store", marca)
+        return len(invoices)
+
+    def ponerse_al_dia(self, store, lote: int = 1000) -> int:
+        """
+        Suma lo que se agregó al store desde la marca guardada (lo recién
+        guardado por este proceso, por otro, o lo que quedó sin sumar por un
+        error). Cada lote es una transacción corta.
+
+        Returns:
+            Cantidad de registros sumados
+        """
+        total = 0
+        while True:
+            sumados = self._transaccion(self._avanzar, store, lote)
+            total += sumados
+            if sumados < lote:
+                return total
+
+    def _fijar_pendientes(self, pendientes: int):
+        self._fijar("pendientes", pendientes)
+        if not pendientes:
+            self._fijar("pendiente_desde", None)
+        elif self._valor("pendiente_desde") is None:
+            self._fijar("pendiente_desde", time.time())
+
+    def recontar_pendientes(self, store):
+        """Corrige pendientes con el conteo del store (al abrirlo o después de reconstruir)."""
+        self._transaccion(self._fijar_pendientes, store.count_unsynced())
+
+    def _restar_pendientes(self, cantidad: int):
+        pendientes = max(0, self._valor("pendientes", 0) - cantidad)
+        self._fijar("pendientes", pendientes)
+        self._fijar("ultimo_sincronizado", time.time())
+        if pendientes == 0:
+            self._fijar("pendiente_desde", None)
+
+    def registrar_sincronizados(self, cantidad: int):
+        """Descuenta de pendientes los invoices que se acaban de subir a Sheets."""
+        if cantidad:
+            self._transaccion(self._restar_pendientes, cantidad)
+
+    def reconstruir(self, store):
+        """
+        Recalcula todo recorriendo el store desde el inicio (una vez, o
+        después de compactar o importar). Avanza por lotes, así que los otros
+        procesos no quedan bloqueados durante el recorrido; lo que guarden
+        mientras tanto se suma una sola vez gracias a la marca.
+
+        Returns:
+            Cantidad de registros
+        """
+        self._transaccion(self._vaciar)
+        self.ponerse_al_dia(store)
+        self.recontar_pendientes(store)
+        with self._lock:
+            return int(self._valor("registros", 0))
+
+    def _mayores(self, dimension: str, limite: int):
+        filas = self._conn.execute(
+            "SELECT clave, cantidad, total_centavos FROM contadores WHERE dimension = ? "
+            "ORDER BY cantidad DESC LIMIT ?",
+            (dimension, limite),
+        ).fetchall()
+        return [{"clave": clave, "cantidad": cantidad, "total": total / 100} for clave, cantidad, total in filas]
+
+    def resumen(self, limite: int = 3) -> dict:
+        """
+        Resumen para 'estado': totales, hoy, marcas de tiempo, retraso de
+        sincronización y las cuentas y receptores con más recibos.
+        """
+        hoy = datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT cantidad FROM contadores WHERE dimension = ? AND clave = ?", (DIMENSION_DIA, hoy)
+            ).fetchone()
+            pendiente_desde = self._valor("pendiente_desde")
+            return {
+                "registros": int(self._valor("registros", 0)),
+                "hoy": fila[0] if fila else 0,
+                "pendientes": int(self._valor("pendientes", 0)),
+                "retraso_sync_segundos": round(time.time() - pendiente_desde) if pendiente_desde else 0,
+                "ultimo_procesado": self._valor("ultimo_procesado"),
+                "ultimo_sincronizado": self._valor("ultimo_sincronizado"),
+                "cuentas": self._mayores(DIMENSION_CUENTA, limite),
+                "receptores": self._mayores(DIMENSION_RECEPTOR, limite),
+            }
+
+    def por_dia(self, dias: int = 7):
+        """Cantidad de recibos de los últimos `dias` días con actividad, más reciente primero."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT clave, cantidad FROM contadores WHERE dimension = ? ORDER BY clave DESC LIMIT ?",
+                (DIMENSION_DIA, dias),
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def main():
+    """CLI: resumen o reconstrucción del índice de un store"""
+    from invoice_store import obtener_store
+
+    argumentos = sys.argv[1:]
+    reconstruir = bool(argumentos) and argumentos[0] == "reconstruir"
+    if reconstruir:
+        argumentos = argumentos[1:]
+    store = obtener_store(argumentos[0] if argumentos else None)
+    indice = getattr(store, "estadisticas", None)
+    if indice is None:
+        print("Estadísticas deshabilitadas (ESTADISTICAS_HABILITADAS=0)")
+        sys.exit(1)
+
+    if reconstruir:
+        print(f"Índice reconstruido: {indice.reconstruir(store)} registros")
+    for clave, valor in indice.resumen(limite=10).items():
+        print(f"{clave}: {valor}")
+    for dia, cantidad in indice.por_dia():
+        print(f"  {dia}: {cantidad}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Cache persistente de extracciones de recibos.
+
+Un mismo recibo suele llegar dos veces (Telegram y la API de uploads), y
+cada copia pagaba un base64 completo y una llamada a gpt-4o. La clave es el
+SHA-256 de los bytes de la imagen junto con la versión del prompt/modelo, así
+que un recibo repetido devuelve el resultado guardado sin llamar a OpenAI.
+Cambiar el prompt o el modelo invalida las entradas anteriores.
+
+Configuración (.env):
+    EXTRACCION_CACHE_HABILITADA=1
+    EXTRACCION_CACHE_PATH=docs/invoices/extraction_cache.db
+    EXTRACCION_CACHE_MAX=5000          # entradas; se desalojan las menos usadas
+    EXTRACCION_CACHE_TTL_DIAS=90
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno (la configuración se lee al importar)
+load_dotenv()
+
+EXTRACCION_CACHE_HABILITADA = os.getenv("EXTRACCION_CACHE_HABILITADA", "1") not in ("0", "false", "no")
+EXTRACCION_CACHE_PATH = os.getenv("EXTRACCION_CACHE_PATH", "docs/invoices/extraction_cache.db")
+EXTRACCION_CACHE_MAX = int(os.getenv("EXTRACCION_CACHE_MAX", "5000"))
+EXTRACCION_CACHE_TTL_DIAS = float(os.getenv("EXTRACCION_CACHE_TTL_DIAS", "90"))
+
+
+def hash_imagen(imagen_bytes: bytes) -> str:
+    return hashlib.sha256(imagen_bytes).hexdigest()
+
+
+def clave_extraccion(sha256_imagen: str, version: str) -> str:
+    """Clave de cache: hash de la imagen + versión de prompt y modelo."""
+    return f"{version}:{sha256_imagen}"
+
+
+class ExtractionCache:
+    """
+    Cache SQLite con desalojo LRU (por último uso) y vencimiento por TTL.
+    """
+
+    def __init__(self, ruta: str = EXTRACCION_CACHE_PATH, max_entradas: int = EXTRACCION_CACHE_MAX,
+                 ttl_segundos: float = EXTRACCION_CACHE_TTL_DIAS * 86400):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extracciones (
+                clave TEXT PRIMARY KEY,
+                datos TEXT NOT NULL,
+                creado REAL NOT NULL,
+                usado REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_extracciones_usado ON extracciones (usado)")
+
+    def get(self, clave: str):
+        """
+        Devuelve los datos cacheados o None. Las entradas vencidas se borran.
+        """
+        ahora = time.time()
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT datos, creado FROM extracciones WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila and ahora - fila[1] > self.ttl_segundos:
+                self._conn.execute("DELETE FROM extracciones WHERE clave = ?", (clave,))
+                fila = None
+            if not fila:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE extracciones SET usado = ? WHERE clave = ?", (ahora, clave))
+            self.hits += 1
+        return json.loads(fila[0])
+
+    def put(self, clave: str, datos: dict):
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extracciones (clave, datos, creado, usado) VALUES (?, ?, ?, ?)",
+                (clave, json.dumps(datos, ensure_ascii=False), ahora, ahora),
+            )
+            self._desalojar()
+
+    def _desalojar(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM extracciones").fetchone()[0]
+        sobrantes = total - self.max_entradas
+        if sobrantes > 0:
+            self._conn.execute(
+                "DELETE FROM extracciones WHERE clave IN "
+                "(SELECT clave FROM extracciones ORDER BY usado LIMIT ?)",
+                (sobrantes,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM extracciones").fetchone()[0]
+            consultas = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / consultas, 3) if consultas else 0.0,
+                "entradas": entradas,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache():
+    """
+    Devuelve la cache del proceso, o None si está deshabilitada.
+    """
+    global _cache
+    if not EXTRACCION_CACHE_HABILITADA:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache()
+        return _cache
@@ -0,0 +1,116 @@
+# Preparar la imagen del recibo antes de enviarla al modelo de visión
+import io
+import os
+import threading
+import time
+
+from PIL import Image, ImageChops, ImageOps
+
+RECIBO_LADO_MAXIMO = int(os.getenv("RECIBO_LADO_MAXIMO", "1600"))
+RECIBO_CALIDAD_JPEG = int(os.getenv("RECIBO_CALIDAD_JPEG", "80"))
+RECIBO_ESCALA_GRISES = os.getenv("RECIBO_ESCALA_GRISES", "1") not in ("0", "false", "no")
+# Saturación media (0-255) por debajo de la cual la imagen se pasa a grises
+RECIBO_UMBRAL_SATURACION = int(os.getenv("RECIBO_UMBRAL_SATURACION", "40"))
+
+# Identifica la configuración, para invalidar caches si cambia
+VERSION_PREPROCESADO = f"{RECIBO_LADO_MAXIMO}-{RECIBO_CALIDAD_JPEG}-{int(RECIBO_ESCALA_GRISES)}-{RECIBO_UMBRAL_SATURACION}"
+
+_FIRMAS_MIME = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+_metricas = {
+    "imagenes": 0,
+    "bytes_originales": 0,
+    "bytes_enviados": 0,
+    "segundos_preprocesado": 0.0,
+    "llamadas_modelo": 0,
+    "segundos_modelo": 0.0,
+}
+_metricas_lock = threading.Lock()
+
+
+def detectar_mime(imagen_bytes: bytes) -> str:
+    for firma, mime in _FIRMAS_MIME:
+        if imagen_bytes.startswith(firma):
+            return mime
+    if imagen_bytes[:4] == b"RIFF" and imagen_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _recortar_bordes(imagen):
+    # Recortar márgenes lisos (del color de la esquina superior izquierda)
+    fondo = Image.new(imagen.mode, imagen.size, imagen.getpixel((0, 0)))
+    diferencia = ImageChops.difference(imagen, fondo).convert("L").point(lambda p: 255 if p > 16 else 0)
+    caja = diferencia.getbbox()
+    if caja and caja != (0, 0) + imagen.size:
+        return imagen.crop(caja)
+    return imagen
+
+
+def _es_casi_gris(imagen) -> bool:
+    saturacion = imagen.convert("HSV").getchannel("S")
+    histograma = saturacion.histogram()
+    total = sum(histograma) or 1
+    media = sum(valor * cantidad for valor, cantidad in enumerate(histograma)) / total
+    return media < RECIBO_UMBRAL_SATURACION
+
+
+def preparar_imagen(imagen_bytes: bytes):
+    """
+    Orienta según EXIF, recorta márgenes, reduce al lado máximo, pasa a
+    grises si la imagen casi no tiene color y la recodifica como JPEG.
+    Si el resultado no es más chico (o la imagen no se puede abrir) se
+    envían los bytes originales con su MIME real.
+
+    Returns:
+        Tupla (bytes_a_enviar, mime_type)
+    """
+    inicio = time.perf_counter()
+    resultado, mime = imagen_bytes, detectar_mime(imagen_bytes)
+    try:
+        with Image.open(io.BytesIO(imagen_bytes)) as original:
+            imagen = ImageOps.exif_transpose(original)
+            if imagen.mode not in ("RGB", "L"):
+                imagen = imagen.convert("RGB")
+            imagen = _recortar_bordes(imagen)
+            imagen.thumbnail((RECIBO_LADO_MAXIMO, RECIBO_LADO_MAXIMO), Image.LANCZOS)
+            if RECIBO_ESCALA_GRISES and imagen.mode == "RGB" and _es_casi_gris(imagen):
+                imagen = imagen.convert("L")
+
+            salida = io.BytesIO()
+            imagen.save(salida, format="JPEG", quality=RECIBO_CALIDAD_JPEG, optimize=True)
+            if salida.tell() < len(imagen_bytes):
+                resultado, mime = salida.getvalue(), "image/jpeg"
+    except Exception as e:
+        print(f"No se pudo preprocesar la imagen, se envía original: {e}")
+
+    with _metricas_lock:
+        _metricas["imagenes"] += 1
+        _metricas["bytes_originales"] += len(imagen_bytes)
+        _metricas["bytes_enviados"] += len(resultado)
+        _metricas["segundos_preprocesado"] += time.perf_counter() - inicio
+    return resultado, mime
+
+
+def registrar_llamada_modelo(segundos: float):
+    with _metricas_lock:
+        _metricas["llamadas_modelo"] += 1
+        _metricas["segundos_modelo"] += segundos
+
+
+def metricas() -> dict:
+    """Bytes ahorrados y tiempos promedio de preprocesado y de llamada al modelo."""
+    with _metricas_lock:
+        m = dict(_metricas)
+    imagenes = m["imagenes"] or 1
+    llamadas = m["llamadas_modelo"] or 1
+    m["bytes_ahorrados"] = m["bytes_originales"] - m["bytes_enviados"]
+    m["ahorro_pct"] = round(100 * m["bytes_ahorrados"] / m["bytes_originales"], 1) if m["bytes_originales"] else 0.0
+    m["ms_preprocesado_promedio"] = round(1000 * m["segundos_preprocesado"] / imagenes, 1)
+    m["ms_modelo_promedio"] = round(1000 * m["segundos_modelo"] / llamadas, 1)
+    return m
@@ -0,0 +1,201 @@
+# OCR local y plantillas por banco/app para extraer recibos sin llamar al modelo
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+from helpers.normalize_amount import _normalize_amount_string
+
+try:
+    import pytesseract
+except ImportError:  # dependencia opcional
+    pytesseract = None
+
+OCR_LOCAL_HABILITADO = os.getenv("OCR_LOCAL_HABILITADO", "1") not in ("0", "false", "no")
+OCR_IDIOMA = os.getenv("OCR_IDIOMA", "spa")
+# Lado máximo de la imagen que se pasa a tesseract
+OCR_LADO_MAXIMO = int(os.getenv("OCR_LADO_MAXIMO", "2000"))
+
+_MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+
+# Patrones comunes a todas las apps; cada plantilla puede reemplazarlos.
+# El total va anclado a su etiqueta: el primer "$" del recibo puede ser una
+# comisión, un saldo o un aviso del celular
+_CAMPOS_COMUNES = {
+    "total": r"(?:Monto|Total|Importe)(?: transferido| enviado)?\s*:?\s*\n?\s*\$\s*(-?[\d.,]+)",
+    "fecha": r"(\d{1,2}/\d{1,2}/\d{4}|\d{1,2} de [a-záéíóú]+ (?:de )?\d{4})",
+    "receptor": r"(?:Para|Destinatario|Enviaste a)\s*:?\s*\n?\s*([^\n$]{3,60})",
+    "remitente": r"(?:^|\n)\s*(?:De|Remitente|Ordenante|Origen)\b\s*(?::\s*|\n\s*)([^\n$]{3,60})",
+    "id_transaccion": r"(?:N[uú]mero de operaci[oó]n|C[oó]digo de (?:operaci[oó]n|transacci[oó]n)|"
+                      r"ID de (?:la )?operaci[oó]n|N[uú]mero de comprobante|Comprobante)[^\n\d]*?\n?\s*#?\s*"
+                      r"((?=[A-Z0-9-]*\d)[A-Z0-9-]{4,})",
+}
+
+# cuenta_origen -> patrón que identifica la app y patrones propios del layout
+PLANTILLAS = [
+    {
+        # "Comprobante de transferencia", fecha y el monto sin etiqueta debajo;
+        # después los bloques "De" y "Para" con el nombre en la línea siguiente
+        "cuenta_origen": "Mercado Pago",
+        "detectar": r"mercado\s*pago",
+        "campos": {
+            "total": r"Comprobante de transferencia[^$]*?\$\s*(-?[\d.,]+)",
+            "receptor": r"(?:^|\n)\s*Para\s*\n\s*([^\n$]{3,60})",
+            "remitente": r"(?:^|\n)\s*De\s*\n\s*([^\n$]{3,60})",
+            "id_transaccion": r"N[uú]mero de operaci[oó]n(?: de Mercado Pago)?\s*:?\s*\n?\s*(\d{6,})",
+        },
+    },
+    {
+        # "Monto" con el importe debajo, "Para" / "De" en bloques, "Código de transacción"
+        "cuenta_origen": "Ualá",
+        "detectar": r"\bual[aá]\b",
+        "campos": {
+            "total": r"(?:^|\n)\s*Monto\s*:?\s*\n?\s*\$\s*(-?[\d.,]+)",
+            "receptor": r"(?:^|\n)\s*(?:Para|Destinatario)\b\s*:?\s*\n?\s*([^\n$]{3,60})",
+            "remitente": r"(?:^|\n)\s*De\b\s*(?::\s*|\n\s*)([^\n$]{3,60})",
+            "id_transaccion": r"C[oó]digo de (?:transacci[oó]n|operaci[oó]n)\s*:?\s*\n?\s*((?=[A-Z0-9-]*\d)[A-Z0-9-]{6,})",
+        },
+    },
+    {
+        "cuenta_origen": "Lemon",
+        "detectar": r"\blemon\b",
+        "campos": {
+            "receptor": r"(?:Enviaste a|Para|Destinatario)\s*:?\s*\n?\s*([^\n$]{3,60})",
+        },
+    },
+    {
+        "cuenta_origen": "Santander",
+        "detectar": r"\bsantander\b",
+        "campos": {
+            "receptor": r"(?:Destinatario|Titular de la cuenta destino|Nombre)\s*:?\s*\n?\s*([^\n$]{3,60})",
+            "id_transaccion": r"(?:N[uú]mero de comprobante|Comprobante N[°º]?)\s*:?\s*\n?\s*([0-9-]{4,})",
+        },
+    },
+]
+
+# Todos los campos deben encontrarse para aceptar el resultado sin el modelo
+CAMPOS_OBLIGATORIOS = ("total", "fecha", "receptor", "id_transaccion")
+
+_PLANTILLAS_COMPILADAS = [
+    (
+        plantilla["cuenta_origen"],
+        re.compile(plantilla["detectar"], re.IGNORECASE),
+        {
+            campo: re.compile(plantilla["campos"].get(campo, patron), re.IGNORECASE)
+            for campo, patron in _CAMPOS_COMUNES.items()
+        },
+    )
+    for plantilla in PLANTILLAS
+]
+
+# Identifica las plantillas, para invalidar caches si cambian
+VERSION_PLANTILLAS = hashlib.sha256(repr((_CAMPOS_COMUNES, PLANTILLAS)).encode("utf-8")).hexdigest()[:8]
+
+_metricas = {"intentos": 0, "aciertos": 0, "segundos": 0.0, "por_plantilla": {}}
+_metricas_lock = threading.Lock()
+_tesseract_disponible = pytesseract is not None
+
+
+def ocr_disponible() -> bool:
+    return OCR_LOCAL_HABILITADO and _tesseract_disponible
+
+
+def _normalizar_fecha(texto: str):
+    """Convierte 'DD/MM/AAAA' o 'DD de <mes> de AAAA' a DD/MM/AAAA."""
+    partes = re.match(r"(\d{1,2})/(\d{1,2})/(\d{4})$", texto)
+    if partes:
+        dia, mes, anio = (int(p) for p in partes.groups())
+    else:
+        partes = re.match(r"(\d{1,2}) de ([a-záéíóú]+) (?:de )?(\d{4})$", texto, re.IGNORECASE)
+        if not partes or partes.group(2).lower() not in _MESES:
+            return None
+        dia, mes, anio = int(partes.group(1)), _MESES[partes.group(2).lower()], int(partes.group(3))
+    return f"{dia:02d}/{mes:02d}/{anio}"
+
+
+def _ocr(imagen_bytes: bytes) -> str:
+    with Image.open(io.BytesIO(imagen_bytes)) as original:
+        imagen = ImageOps.grayscale(ImageOps.exif_transpose(original))
+    imagen.thumbnail((OCR_LADO_MAXIMO, OCR_LADO_MAXIMO))
+    return pytesseract.image_to_string(imagen, lang=OCR_IDIOMA)
+
+
+def aplicar_plantillas(texto: str):
+    """
+    Detecta la app emisora en el texto OCR y extrae los campos con su plantilla.
+
+    Returns:
+        Diccionario con los campos del recibo, o None si ninguna plantilla
+        coincide o falta algún campo obligatorio
+    """
+    for cuenta_origen, detectar, campos in _PLANTILLAS_COMPILADAS:
+        if not detectar.search(texto):
+            continue
+        encontrados = {}
+        for campo, patron in campos.items():
+            coincidencia = patron.search(texto)
+            if coincidencia:
+                encontrados[campo] = coincidencia.group(1).strip()
+        if "fecha" in encontrados:
+            encontrados["fecha"] = _normalizar_fecha(encontrados["fecha"])
+        if not all(encontrados.get(campo) for campo in CAMPOS_OBLIGATORIOS):
+            # Puede ser otra app que menciona a esta (ej: transferencia a una cuenta de Mercado Pago)
+            continue
+        return {
+            "total": _normalize_amount_string(encontrados["total"]),
+            "fecha": encontrados["fecha"],
+            "receptor": encontrados["receptor"],
+            "cuenta_origen": cuenta_origen,
+            "transaction_type": "transferencia",
+            "id_transaccion": encontrados["id_transaccion"],
+            "remitente": encontrados.get("remitente", ""),
+        }
+    return None
+
+
+def extraer_local(imagen_bytes: bytes):
+    """
+    OCR en CPU + plantillas. Devuelve los datos solo si una plantilla
+    reconoce el recibo con todos los campos obligatorios; si no, None y el
+    recibo sigue al modelo.
+    """
+    global _tesseract_disponible
+    if not ocr_disponible():
+        return None
+
+    inicio = time.perf_counter()
+    try:
+        texto = _ocr(imagen_bytes)
+    except pytesseract.TesseractNotFoundError:
+        print("tesseract no está instalado, se desactiva el OCR local")
+        _tesseract_disponible = False
+        return None
+    except Exception as e:
+        print(f"Error en OCR local: {e}")
+        return None
+
+    datos = aplicar_plantillas(texto)
+    with _metricas_lock:
+        _metricas["intentos"] += 1
+        _metricas["segundos"] += time.perf_counter() - inicio
+        if datos:
+            _metricas["aciertos"] += 1
+            por_plantilla = _metricas["por_plantilla"]
+            por_plantilla[datos["cuenta_origen"]] = por_plantilla.get(datos["cuenta_origen"], 0) + 1
+    return datos
+
+
+def metricas() -> dict:
+    """Recibos resueltos localmente, por plantilla, y tiempo promedio de OCR."""
+    with _metricas_lock:
+        m = dict(_metricas, por_plantilla=dict(_metricas["por_plantilla"]))
+    m["tasa_aciertos"] = round(m["aciertos"] / m["intentos"], 3) if m["intentos"] else 0.0
+    m["ms_promedio"] = round(1000 * m["segundos"] / m["intentos"], 1) if m["intentos"] else 0.0
+    return m
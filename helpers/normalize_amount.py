@@ -2,13 +2,16 @@
 from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
 import re
 
+# Todo lo que no sea dígito, punto, coma o guión
+_NO_NUMERICO = re.compile(r'[^\d,\.\-]')
+
 
 def _normalize_amount_string(amount_input) -> str:
     s = str(amount_input).strip()
     if not s:
         return "0.00"
     # Quitar símbolos de moneda y espacios, dejar solo dígitos, punto, coma y guión
-    s = re.sub(r'[^\d,\.\-]', '', s)
+    s = _NO_NUMERICO.sub('', s)
     negative = False
     if '-' in s:
         # Si empieza con -, considerar negativo
@@ -57,4 +60,150 @@ def _normalize_amount_string(amount_input) -> str:
             value = -value
     except (InvalidOperation, ValueError):
         return "0.00"
-    return f"{value:,.2f}"
\ No newline at end of file
+    return f"{value:,.2f}"
+
+
+# Versión por lotes: mismo resultado que _normalize_amount_string, pero cada
+# monto se recorre una sola vez con una tabla de clases de caracteres y se
+# calcula en centavos enteros, sin re, rfind/replace ni Decimal
+_PUNTO = -1
+_COMA = -2
+_MENOS = -3
+_IGNORAR = -4
+# Más dígitos que esto se delegan a la versión con Decimal (límite de precisión)
+_MAX_DIGITOS_RAPIDO = 24
+_POTENCIAS = [10 ** exponente for exponente in range(_MAX_DIGITOS_RAPIDO + 1)]
+# Parte decimal ya formateada para cada resto de centavos (".00" a ".99")
+_DECIMALES = [f".{resto:02d}" for resto in range(100)]
+
+
+class _TablaClases(dict):
+    """
+    Clase de cada carácter: el valor si es dígito, si no separador, signo o
+    ignorado. Los caracteres no ASCII se clasifican la primera vez que
+    aparecen (dígitos de otros alfabetos: los mismos que \\d en _NO_NUMERICO).
+    """
+
+    def __missing__(self, ch):
+        clase = int(ch) if _NO_NUMERICO.match(ch) is None else _IGNORAR
+        self[ch] = clase
+        return clase
+
+
+_CLASES = _TablaClases({chr(codigo): _IGNORAR for codigo in range(128)})
+_CLASES.update({str(digito): digito for digito in range(10)})
+_CLASES.update({'.': _PUNTO, ',': _COMA, '-': _MENOS})
+
+
+def _a_centavos(texto: str):
+    """
+    Recorre el texto una vez y aplica las reglas de _normalize_amount_string:
+    negativo si el primer carácter útil es un guión; con punto y coma, el
+    último es el decimal; con uno solo, es decimal si le siguen 1 o 2 dígitos.
+
+    Returns:
+        Tupla (negativo, centavos). Un monto inválido devuelve (False, 0),
+        igual que el "0.00" de _normalize_amount_string. None si tiene más
+        de _MAX_DIGITOS_RAPIDO dígitos y hay que delegar en la versión con
+        Decimal.
+    """
+    clases = _CLASES
+    numero = digitos = 0
+    puntos = comas = 0
+    # Dígitos vistos antes del último punto y de la última coma
+    antes_punto = antes_coma = 0
+    ultimo_punto = False
+    negativo = False
+    for ch in texto:
+        clase = clases[ch]
+        if clase >= 0:
+            numero = numero * 10 + clase
+            digitos += 1
+        elif clase == _IGNORAR:
+            continue
+        elif clase == _PUNTO:
+            puntos += 1
+            antes_punto = digitos
+            ultimo_punto = True
+        elif clase == _COMA:
+            comas += 1
+            antes_coma = digitos
+            ultimo_punto = False
+        elif not (digitos or puntos or comas):
+            # Guión antes de cualquier dígito o separador
+            negativo = True
+
+    if digitos > _MAX_DIGITOS_RAPIDO:
+        return None
+    # (separadores iguales al decimal, dígitos antes del decimal)
+    if puntos and comas:
+        decimal = (puntos, antes_punto) if ultimo_punto else (comas, antes_coma)
+    elif puntos and digitos - antes_punto in (1, 2):
+        decimal = (puntos, antes_punto)
+    elif comas and digitos - antes_coma in (1, 2):
+        decimal = (comas, antes_coma)
+    else:
+        # Sin decimal: los separadores son de miles
+        decimal = None
+
+    fraccion = 0
+    if decimal:
+        repeticiones, antes = decimal
+        if repeticiones > 1 or not digitos:
+            return False, 0
+        fraccion = digitos - antes
+    if fraccion <= 2:
+        centavos = numero * _POTENCIAS[2 - fraccion]
+    else:
+        # ROUND_HALF_UP sobre los dígitos descartados
+        escala = _POTENCIAS[fraccion - 2]
+        centavos, resto = divmod(numero, escala)
+        if resto * 2 >= escala:
+            centavos += 1
+    # -0 queda como 0.00, igual que Decimal
+    return negativo and centavos > 0, centavos
+
+
+def normalize_amounts(valores, como_centavos: bool = False):
+    """
+    Normaliza muchos montos de una vez, con exactamente el mismo resultado
+    que llamar a _normalize_amount_string sobre cada uno (verificado en
+    tests/test_normalize_amount.py). Los textos repetidos (montos
+    recurrentes) se resuelven una sola vez por llamada.
+
+    Args:
+        valores: Iterable de montos (texto o números)
+        como_centavos: Si es True devuelve enteros en centavos (con signo)
+            en lugar de textos con formato 1,234.56
+
+    Returns:
+        Lista con un resultado por valor, en el mismo orden
+    """
+    resultados = []
+    agregar = resultados.append
+    vistos = {}
+    for valor in valores:
+        es_texto = valor.__class__ is str
+        if es_texto and valor in vistos:
+            agregar(vistos[valor])
+            continue
+
+        parseado = _a_centavos(valor if es_texto else str(valor))
+        if parseado is None:
+            resultado = _normalize_amount_string(valor)
+            if como_centavos:
+                resultado = int(resultado.replace(',', '').replace('.', ''))
+        else:
+            negative, centavos = parseado
+            if como_centavos:
+                resultado = -centavos if negative else centavos
+            else:
+                unidades, resto = divmod(centavos, 100)
+                resultado = format(unidades, ',') + _DECIMALES[resto]
+                if negative:
+                    resultado = '-' + resultado
+
+        if es_texto:
+            vistos[valor] = resultado
+        agregar(resultado)
+    return resultados
@@ -0,0 +1,155 @@
+"""
+INGESTA MASIVA DE RECIBOS
+=========================
+
+Procesa una carpeta (o glob) completa de recibos, para backfills:
+1. Busca las imágenes y descarta las ya procesadas (por hash del contenido)
+2. Extrae los datos en paralelo, con concurrencia acotada
+3. Guarda todos los resultados en el store en una sola escritura
+4. Sincroniza con Google Sheets en una única pasada por lotes
+
+Uso:
+    python ingestar.py docs/invoices uploads
+    python ingestar.py "uploads/**/*.jpg" --workers 8 --sin-sheets
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+import invoice_reader
+from extraction_cache import hash_imagen
+from invoice_store import obtener_store
+from invoices import sincronizar_pendientes
+from rate_limiter import CARRIL_BACKFILL, carril
+
+# Cargar variables de entorno
+load_dotenv()
+
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+
+def buscar_imagenes(rutas):
+    """
+    Expande carpetas (recursivamente) y globs a una lista ordenada de imágenes.
+    """
+    encontradas = set()
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for raiz, _, archivos in os.walk(ruta):
+                for nombre in archivos:
+                    if nombre.lower().endswith(EXTENSIONES_IMAGEN):
+                        encontradas.add(os.path.join(raiz, nombre))
+        else:
+            for archivo in glob.glob(ruta, recursive=True):
+                if os.path.isfile(archivo) and archivo.lower().endswith(EXTENSIONES_IMAGEN):
+                    encontradas.add(archivo)
+    return sorted(encontradas)
+
+
+def filtrar_nuevas(imagenes, hashes_procesados):
+    """
+    Descarta las imágenes cuyo contenido ya está en el store, y las
+    repetidas dentro de la misma tanda.
+
+    Returns:
+        Tupla (imagenes_nuevas, cantidad_omitidas)
+    """
+    vistos = set(hashes_procesados)
+    nuevas = []
+    for imagen in imagenes:
+        with open(imagen, "rb") as f:
+            sha256 = hash_imagen(f.read())
+        if sha256 in vistos:
+            continue
+        vistos.add(sha256)
+        nuevas.append(imagen)
+    return nuevas, len(imagenes) - len(nuevas)
+
+
+async def extraer_en_paralelo(imagenes, workers: int):
+    """
+    Extrae los datos de todas las imágenes con a lo sumo `workers` en curso,
+    mostrando progreso y recibos por minuto.
+
+    Returns:
+        Tupla (resultados, imagenes_con_error)
+    """
+    semaforo = asyncio.Semaphore(workers)
+    resultados = []
+    errores = []
+    inicio = time.perf_counter()
+
+    async def extraer(imagen):
+        async with semaforo:
+            datos = await invoice_reader.aleer_recibo(imagen)
+        if datos:
+            resultados.append(datos)
+        else:
+            errores.append(imagen)
+        hechos = len(resultados) + len(errores)
+        minutos = (time.perf_counter() - inicio) / 60
+        ritmo = hechos / minutos if minutos else 0.0
+        print(f"[{hechos}/{len(imagenes)}] {len(errores)} errores - {ritmo:.1f} recibos/min")
+
+    await asyncio.gather(*(extraer(imagen) for imagen in imagenes))
+    return resultados, errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta masiva de recibos")
+    parser.add_argument("rutas", nargs="+", help="Carpetas o globs con imágenes de recibos")
+    parser.add_argument("--workers", type=int, default=invoice_reader.OPENAI_MAX_CONCURRENCIA,
+                        help="Extracciones simultáneas")
+    parser.add_argument("--sin-sheets", action="store_true", help="No sincronizar con Google Sheets")
+    args = parser.parse_args()
+
+    print("INGESTA MASIVA DE RECIBOS")
+    print("=" * 50)
+
+    store = obtener_store()
+    imagenes = buscar_imagenes(args.rutas)
+    nuevas, omitidas = filtrar_nuevas(imagenes, store.hashes_procesados())
+    print(f"Imágenes encontradas: {len(imagenes)} - ya procesadas: {omitidas} - a procesar: {len(nuevas)}")
+
+    if not nuevas:
+        print("No hay imágenes nuevas")
+        sys.exit(0)
+
+    inicio = time.perf_counter()
+    # Carril de backfill: deja libre parte de la cuota para el bot y la API
+    with carril(CARRIL_BACKFILL):
+        resultados, errores = asyncio.run(extraer_en_paralelo(nuevas, max(1, args.workers)))
+    duracion = time.perf_counter() - inicio
+
+    # Una sola escritura (una transacción en SQLite) para toda la tanda
+    if resultados:
+        store.append_many(resultados)
+        print(f"{len(resultados)} registros guardados en {store.ruta}")
+
+    print(f"Extracción: {len(resultados)} ok, {len(errores)} errores en {duracion:.1f}s "
+          f"({len(nuevas) / (duracion / 60):.1f} recibos/min)")
+    for imagen in errores:
+        print(f"  Error: {imagen}")
+
+    if resultados and not args.sin_sheets:
+        sheet_id = os.getenv("GOOGLE_SHEET_ID")
+        credentials_path = os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json")
+        if not sheet_id:
+            print("GOOGLE_SHEET_ID no configurado, se omite la sincronización")
+        else:
+            with carril(CARRIL_BACKFILL):
+                sincronizado = sincronizar_pendientes(sheet_id, credentials_path, store.ruta)
+            if not sincronizado:
+                print("Error sincronizando con Google Sheets")
+                sys.exit(1)
+
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
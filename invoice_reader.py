@@ -1,7 +1,12 @@
+import asyncio
 import base64
+import hashlib
 import json
 import openai
 import os
+import threading
+import time
+import weakref
 from datetime import datetime
 from dotenv import load_dotenv
 import re
@@ -11,98 +16,565 @@ import uuid
 from setup_google_sheets import CSVColumns, CSVColumnsNames
 # Agregar este import al inicio del archivo
 from helpers.normalize_amount import _normalize_amount_string
+from helpers.image_preprocess import VERSION_PREPROCESADO, preparar_imagen, registrar_llamada_modelo
+from helpers.local_ocr import VERSION_PLANTILLAS, extraer_local, ocr_disponible
+from invoice_store import obtener_store
+from extraction_cache import clave_extraccion, hash_imagen, obtener_cache
+from rate_limiter import obtener_limitador
 # Cargar variables de entorno
 load_dotenv()
 
-def leer_recibo(imagen_path: str):
+# Modelo y prompt de extracción
+MODELO_EXTRACCION = os.getenv("OPENAI_MODEL", "gpt-4o")
+
+SCHEMA_EJEMPLO = {
+    CSVColumns.TOTAL.value: "monto numérico con decimales en formato 123.45",
+    CSVColumns.FECHA_TRANSFERENCIA.value: "DD/MM/AAAA",
+    CSVColumns.RECEPTOR.value: "nombre del destinatario o comercio, dejar en blanco si no aparece",
+    CSVColumns.CUENTA_ORIGEN.value: "institución o medio de pago (ej: Lemon, Mercado Pago, Santander, Ualá, etc.)",
+    CSVColumns.TRANSACTION_TYPE.value: "transferencia | débito | crédito | otro (si no está claro)",
+    CSVColumns.ID_TRANSACCION.value: "código o identificador de la operación, dejar en blanco si no se encuentra",
+    CSVColumns.REMITENTE.value: "nombre del remitente, dejar en blanco si no aparece",
+}
+
+PROMPT_EXTRACCION = f"""
+        Extrae de la imagen los siguientes campos y responde ÚNICAMENTE en formato JSON:
+        {json.dumps(SCHEMA_EJEMPLO, ensure_ascii=False, indent=4)}
+        Reglas:
+            - El campo "{CSVColumns.TRANSACTION_TYPE.value}" debe ser "débito" o "crédito" si explícitamente lo indica el ticket; si no aparece, asumir "transferencia".
+            - No incluyas texto extra ni explicaciones fuera del JSON.
+            - Si algún dato no se puede identificar con certeza, deja el campo en blanco.
+            - Respeta el formato exacto de claves y comillas del JSON.
+        """
+
+# Salida estructurada: el modelo responde un objeto con exactamente estas claves
+OPENAI_SALIDA_ESTRUCTURADA = os.getenv("OPENAI_SALIDA_ESTRUCTURADA", "1") not in ("0", "false", "no")
+# Modelo para la llamada de reparación (solo texto, sin imagen)
+MODELO_REPARACION = os.getenv("OPENAI_MODEL_REPARACION", "gpt-4o-mini")
+
+SCHEMA_RESPUESTA = {
+    "type": "object",
+    "properties": {
+        campo: {"type": "string", "description": descripcion}
+        for campo, descripcion in SCHEMA_EJEMPLO.items()
+    },
+    "required": list(SCHEMA_EJEMPLO),
+    "additionalProperties": False,
+}
+SCHEMA_RESPUESTA["properties"][CSVColumns.TRANSACTION_TYPE.value]["enum"] = [
+    "transferencia", "débito", "crédito", "otro"
+]
+
+FORMATO_RESPUESTA = {
+    "type": "json_schema",
+    "json_schema": {"name": "recibo", "strict": True, "schema": SCHEMA_RESPUESTA},
+}
+
+PROMPT_REPARACION = f"""
+        Convierte el siguiente texto, extraído de un recibo, en un objeto JSON con exactamente estas claves:
+        {json.dumps(SCHEMA_EJEMPLO, ensure_ascii=False, indent=4)}
+        Usa solo la información del texto; deja en blanco lo que no aparezca. Responde únicamente el JSON.
+        """
+
+# Enrutamiento por niveles: primero el modelo rápido y, solo si su resultado
+# no pasa validar_datos, el modelo grande. OPENAI_MODEL_RAPIDO vacío lo desactiva.
+MODELO_RAPIDO = os.getenv("OPENAI_MODEL_RAPIDO", "gpt-4o-mini")
+MODELOS_EXTRACCION = [modelo for modelo in dict.fromkeys([MODELO_RAPIDO, MODELO_EXTRACCION]) if modelo]
+
+CAMPOS_REQUERIDOS = [
+    campo.strip() for campo in os.getenv(
+        "EXTRACCION_CAMPOS_REQUERIDOS",
+        f"{CSVColumns.TOTAL.value},{CSVColumns.FECHA_TRANSFERENCIA.value},{CSVColumns.CUENTA_ORIGEN.value}",
+    ).split(",") if campo.strip()
+]
+
+# USD por millón de tokens (entrada, salida), para estimar el costo por nivel
+PRECIOS_MODELOS = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+# Cambia si cambian el prompt, los modelos o el formato: invalida la cache de extracciones
+VERSION_EXTRACCION = hashlib.sha256(
+    f"{','.join(MODELOS_EXTRACCION)}\n{VERSION_PREPROCESADO}\n{PROMPT_EXTRACCION}\n"
+    f"{json.dumps(FORMATO_RESPUESTA, sort_keys=True) if OPENAI_SALIDA_ESTRUCTURADA else ''}\n"
+    f"{VERSION_PLANTILLAS if ocr_disponible() else ''}".encode("utf-8")
+).hexdigest()[:12]
+
+_RE_BLOQUE_CODIGO = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+_metricas_parseo = {
+    "respuestas": 0,
+    "json_directo": 0,
+    "json_tolerante": 0,
+    "reparaciones": 0,
+    "reparaciones_exitosas": 0,
+    "fallos_parseo": 0,
+}
+_metricas_parseo_lock = threading.Lock()
+
+def _contar_parseo(clave: str):
+    with _metricas_parseo_lock:
+        _metricas_parseo[clave] += 1
+
+def metricas_parseo() -> dict:
+    """Respuestas parseadas directo, con el parser tolerante, reparadas y perdidas."""
+    with _metricas_parseo_lock:
+        return dict(_metricas_parseo)
+
+def _parsear_json(texto: str):
+    """
+    Parser tolerante: JSON directo, dentro de un bloque de código, o entre
+    la primera y la última llave.
+    
+    Returns:
+        Tupla (datos, directo)
+    """
+    texto = (texto or "").strip()
+    candidatos = [texto]
+    bloque = _RE_BLOQUE_CODIGO.search(texto)
+    if bloque:
+        candidatos.append(bloque.group(1).strip())
+    inicio, fin = texto.find("{"), texto.rfind("}")
+    if inicio != -1 and fin > inicio:
+        candidatos.append(texto[inicio:fin + 1])
+    
+    for i, candidato in enumerate(candidatos):
+        try:
+            datos = json.loads(candidato)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(datos, dict):
+            return datos, i == 0
+    raise json.JSONDecodeError("No se encontró un objeto JSON en la respuesta", texto, 0)
+
+def _interpretar_respuesta(result: str, reparada: bool = False):
+    """
+    Parsea el JSON de la respuesta y normaliza el total.
+    
+    Args:
+        result: Texto devuelto por el modelo
+        reparada: True si el texto viene de la llamada de reparación
+    """
+    if not reparada:
+        _contar_parseo("respuestas")
+    try:
+        datos, directo = _parsear_json(result)
+    except json.JSONDecodeError:
+        if reparada:
+            _contar_parseo("fallos_parseo")
+        raise
+    
+    if reparada:
+        _contar_parseo("reparaciones_exitosas")
+    else:
+        _contar_parseo("json_directo" if directo else "json_tolerante")
+    
+    if 'total' in datos:
+        datos['total'] = _normalize_amount_string(datos.get('total'))
+    return datos
+
+_metricas_niveles = {}
+_metricas_enrutamiento = {"recibos": 0, "escalados": 0}
+_metricas_niveles_lock = threading.Lock()
+
+def _registrar_nivel(modelo: str, segundos: float, response, valido: bool):
+    usage = getattr(response, "usage", None)
+    tokens_entrada = getattr(usage, "prompt_tokens", 0) or 0
+    tokens_salida = getattr(usage, "completion_tokens", 0) or 0
+    precio_entrada, precio_salida = PRECIOS_MODELOS.get(modelo, (0.0, 0.0))
+    with _metricas_niveles_lock:
+        m = _metricas_niveles.setdefault(modelo, {
+            "llamadas": 0, "validos": 0, "segundos": 0.0,
+            "tokens_entrada": 0, "tokens_salida": 0, "costo_usd": 0.0,
+        })
+        m["llamadas"] += 1
+        m["validos"] += int(valido)
+        m["segundos"] += segundos
+        m["tokens_entrada"] += tokens_entrada
+        m["tokens_salida"] += tokens_salida
+        m["costo_usd"] += (tokens_entrada * precio_entrada + tokens_salida * precio_salida) / 1_000_000
+
+def _registrar_recibo(nivel: int):
+    with _metricas_niveles_lock:
+        _metricas_enrutamiento["recibos"] += 1
+        _metricas_enrutamiento["escalados"] += int(nivel > 0)
+
+def metricas_enrutamiento() -> dict:
+    """Latencia, tokens y costo por modelo, y tasa de escalamiento al modelo grande."""
+    with _metricas_niveles_lock:
+        niveles = {modelo: dict(m) for modelo, m in _metricas_niveles.items()}
+        resumen = dict(_metricas_enrutamiento)
+    for m in niveles.values():
+        m["ms_promedio"] = round(1000 * m["segundos"] / m["llamadas"], 1)
+        m["costo_usd"] = round(m["costo_usd"], 6)
+    resumen["tasa_escalamiento"] = round(resumen["escalados"] / resumen["recibos"], 3) if resumen["recibos"] else 0.0
+    resumen["costo_usd"] = round(sum(m["costo_usd"] for m in niveles.values()), 6)
+    resumen["niveles"] = niveles
+    return resumen
+
+def validar_datos(datos) -> list:
+    """
+    Revisa que la extracción sea confiable: campos requeridos presentes,
+    total interpretable y fecha DD/MM/AAAA válida.
+    
+    Returns:
+        Lista de problemas encontrados (vacía si los datos son válidos)
+    """
+    problemas = []
+    for campo in CAMPOS_REQUERIDOS:
+        if not str(datos.get(campo) or "").strip():
+            problemas.append(f"falta {campo}")
+    
+    total = str(datos.get(CSVColumns.TOTAL.value) or "").strip()
+    if total and _normalize_amount_string(total) == "0.00":
+        problemas.append("total inválido")
+    
+    fecha = str(datos.get(CSVColumns.FECHA_TRANSFERENCIA.value) or "").strip()
+    if fecha:
+        try:
+            datetime.strptime(fecha, "%d/%m/%Y")
+        except ValueError:
+            problemas.append("fecha inválida")
+    return problemas
+
+def _contenido_respuesta(response) -> str:
+    return (response.choices[0].message.content or "").strip()
+
+def _solicitud_reparacion(texto: str):
+    """
+    Argumentos de una llamada solo texto que convierte una respuesta
+    inválida en JSON, sin volver a enviar la imagen.
+    """
+    solicitud = {
+        "model": MODELO_REPARACION,
+        "messages": [
+            {"role": "system", "content": PROMPT_REPARACION},
+            {"role": "user", "content": texto or ""},
+        ],
+        "max_tokens": 300,
+        "temperature": 0,
+    }
+    if OPENAI_SALIDA_ESTRUCTURADA:
+        solicitud["response_format"] = FORMATO_RESPUESTA
+    return solicitud
+
+def _mostrar_datos(datos):
+    print("DATOS EXTRAIDOS:")
+    print(f"{CSVColumnsNames.TOTAL.value}: {datos.get(CSVColumns.TOTAL.value, 'NO_ENCONTRADO')}")
+    print(f"{CSVColumnsNames.FECHA_TRANSFERENCIA.value}: {datos.get(CSVColumns.FECHA_TRANSFERENCIA.value, 'NO_ENCONTRADO')}")
+    print(f"{CSVColumnsNames.RECEPTOR.value}: {datos.get(CSVColumns.RECEPTOR.value, 'NO_ENCONTRADO')}")
+    print(f"{CSVColumnsNames.TRANSACTION_TYPE.value}: {datos.get(CSVColumns.TRANSACTION_TYPE.value, 'NO_ENCONTRADO')}")
+    print(f"{CSVColumnsNames.ID_TRANSACCION.value}: {datos.get(CSVColumns.ID_TRANSACCION.value, 'NO_ENCONTRADO')}")
+    print(f"{CSVColumnsNames.CUENTA_ORIGEN.value}: {datos.get(CSVColumns.CUENTA_ORIGEN.value, 'NO_ENCONTRADO')}")
+
+# Llamadas simultáneas a OpenAI desde el camino asíncrono
+OPENAI_MAX_CONCURRENCIA = int(os.getenv("OPENAI_MAX_CONCURRENCIA", "8"))
+
+_cliente = None
+_cliente_lock = threading.Lock()
+_clientes_async = weakref.WeakKeyDictionary()
+
+def _api_key():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY no encontrada en variables de entorno. Configura el archivo .env")
+    return api_key
+
+def obtener_cliente():
+    """Cliente OpenAI compartido: reutiliza conexiones HTTP y TLS entre recibos."""
+    global _cliente
+    with _cliente_lock:
+        if _cliente is None:
+            # Los reintentos (429, 5xx, conexión) los maneja rate_limiter
+            _cliente = openai.OpenAI(api_key=_api_key(), max_retries=0)
+        return _cliente
+
+def obtener_cliente_async():
+    """
+    Cliente AsyncOpenAI y semáforo de concurrencia del event loop actual.
+    El pool de conexiones queda ligado al loop que lo creó, por eso hay uno por loop.
+    
+    Returns:
+        Tupla (cliente, semaforo)
+    """
+    loop = asyncio.get_running_loop()
+    par = _clientes_async.get(loop)
+    if par is None:
+        par = (openai.AsyncOpenAI(api_key=_api_key(), max_retries=0), asyncio.Semaphore(OPENAI_MAX_CONCURRENCIA))
+        _clientes_async[loop] = par
+    return par
+
+# Tokens que OpenAI cuenta por imagen de recibo (aprox.), para la cuota de tokens por minuto
+OPENAI_TOKENS_ESTIMADOS_IMAGEN = int(os.getenv("OPENAI_TOKENS_ESTIMADOS_IMAGEN", "1100"))
+
+def _tokens_estimados(solicitud) -> int:
+    caracteres = 0
+    imagenes = 0
+    for mensaje in solicitud["messages"]:
+        contenido = mensaje["content"]
+        if isinstance(contenido, str):
+            caracteres += len(contenido)
+            continue
+        for parte in contenido:
+            if parte["type"] == "text":
+                caracteres += len(parte["text"])
+            else:
+                imagenes += 1
+    return caracteres // 4 + imagenes * OPENAI_TOKENS_ESTIMADOS_IMAGEN + solicitud.get("max_tokens", 0)
+
+def _crear_respuesta(solicitud):
+    """chat.completions.create dentro de la cuota de OpenAI, con reintentos ante 429."""
+    return obtener_limitador("openai").ejecutar(
+        obtener_cliente().chat.completions.create, tokens=_tokens_estimados(solicitud), **solicitud
+    )
+
+async def _acrear_respuesta(solicitud):
+    """Versión asíncrona de _crear_respuesta."""
+    cliente, semaforo = obtener_cliente_async()
+    async with semaforo:
+        return await obtener_limitador("openai").aejecutar(
+            cliente.chat.completions.create, tokens=_tokens_estimados(solicitud), **solicitud
+        )
+
+def reparar_respuesta(texto: str):
+    """
+    Una única llamada de reparación para una respuesta que no se pudo parsear.
+    
+    Raises:
+        json.JSONDecodeError: si la respuesta reparada tampoco es JSON válido
+    """
+    print("Respuesta no parseable, intentando reparación (solo texto)...")
+    _contar_parseo("reparaciones")
+    response = _crear_respuesta(_solicitud_reparacion(texto))
+    return _interpretar_respuesta(_contenido_respuesta(response), reparada=True)
+
+async def areparar_respuesta(texto: str):
+    """Versión asíncrona de reparar_respuesta."""
+    print("Respuesta no parseable, intentando reparación (solo texto)...")
+    _contar_parseo("reparaciones")
+    response = await _acrear_respuesta(_solicitud_reparacion(texto))
+    return _interpretar_respuesta(_contenido_respuesta(response), reparada=True)
+
+def _leer_bytes(imagen_path: str) -> bytes:
+    with open(imagen_path, "rb") as image_file:
+        return image_file.read()
+
+def _buscar_en_cache(imagen_bytes: bytes):
+    """
+    Returns:
+        Tupla (sha256, cache, clave, datos_cacheados_o_None)
+    """
+    sha256 = hash_imagen(imagen_bytes)
+    cache = obtener_cache()
+    clave = clave_extraccion(sha256, VERSION_EXTRACCION)
+    datos = cache.get(clave) if cache else None
+    if datos is not None:
+        print("Recibo ya procesado anteriormente, usando datos de la cache")
+    return sha256, cache, clave, datos
+
+def _imagen_data_url(imagen_bytes: bytes) -> str:
+    # Orientar, reducir y recomprimir antes de codificar
+    imagen_enviada, mime_type = preparar_imagen(imagen_bytes)
+    print(f"Imagen preparada: {len(imagen_bytes)} -> {len(imagen_enviada)} bytes ({mime_type})")
+    image_data = base64.b64encode(imagen_enviada).decode('utf-8')
+    return f"data:{mime_type};base64,{image_data}"
+
+def _armar_solicitud(data_url: str, modelo: str):
+    return {
+        "model": modelo,
+        "messages": [{
+            "role": "user", 
+            "content": [
+                {"type": "text", "text": PROMPT_EXTRACCION},
+                {"type": "image_url", "image_url": {"url": data_url}}
+            ]
+        }],
+        "max_tokens": 300,
+        "temperature": 0.1,
+        **({"response_format": FORMATO_RESPUESTA} if OPENAI_SALIDA_ESTRUCTURADA else {}),
+    }
+
+def _solicitud_extraccion(imagen_bytes: bytes, modelo: str = MODELO_EXTRACCION):
+    """
+    Arma los argumentos de chat.completions.create para una imagen.
+    """
+    return _armar_solicitud(_imagen_data_url(imagen_bytes), modelo)
+
+def _evaluar_nivel(modelo: str, nivel: int, segundos: float, response):
+    """
+    Parsea y valida la respuesta de un nivel.
+    
+    Returns:
+        Tupla (datos, aceptado, texto_sin_parsear). Si texto_sin_parsear no es
+        None, la respuesta del último nivel necesita la llamada de reparación.
+    """
+    ultimo = nivel == len(MODELOS_EXTRACCION) - 1
+    registrar_llamada_modelo(segundos)
+    result = _contenido_respuesta(response)
+    try:
+        datos = _interpretar_respuesta(result)
+    except json.JSONDecodeError:
+        _registrar_nivel(modelo, segundos, response, False)
+        if ultimo:
+            return None, True, result
+        print(f"Respuesta no parseable con {modelo}, escalando...")
+        return None, False, None
+    
+    problemas = validar_datos(datos)
+    _registrar_nivel(modelo, segundos, response, not problemas)
+    if problemas and not ultimo:
+        print(f"Validación fallida con {modelo} ({', '.join(problemas)}), escalando...")
+        return datos, False, None
+    return datos, True, None
+
+def _resultado_local(datos):
+    """Acepta el resultado del OCR local solo si además pasa validar_datos."""
+    if datos and not validar_datos(datos):
+        print(f"Recibo reconocido localmente ({datos[CSVColumns.CUENTA_ORIGEN.value]}), sin llamar a OpenAI")
+        return datos
+    return None
+
+def _extraer_por_niveles(imagen_bytes: bytes):
+    """
+    Intenta primero el OCR local con plantillas; si no alcanza, prueba los
+    modelos de MODELOS_EXTRACCION en orden y devuelve el primer resultado
+    que pasa validar_datos. El del último nivel se acepta igual.
+    """
+    datos = _resultado_local(extraer_local(imagen_bytes))
+    if datos:
+        return datos
+    
+    data_url = _imagen_data_url(imagen_bytes)
+    for nivel, modelo in enumerate(MODELOS_EXTRACCION):
+        inicio = time.perf_counter()
+        response = _crear_respuesta(_armar_solicitud(data_url, modelo))
+        datos, aceptado, sin_parsear = _evaluar_nivel(modelo, nivel, time.perf_counter() - inicio, response)
+        if aceptado:
+            _registrar_recibo(nivel)
+            # Si falla el parseo, reparar sin reenviar la imagen
+            return reparar_respuesta(sin_parsear) if sin_parsear is not None else datos
+
+async def _aextraer_por_niveles(imagen_bytes: bytes, niveles: range = None):
+    """
+    Versión asíncrona de _extraer_por_niveles.
+    
+    Con niveles se prueban solo esos índices de MODELOS_EXTRACCION (el OCR
+    local, solo si incluye el primero): si ninguno pasa validar_datos y el
+    último nivel no está entre ellos, devuelve None (ver aleer_recibo).
+    """
+    niveles = range(len(MODELOS_EXTRACCION)) if niveles is None else niveles
+    if 0 in niveles:
+        datos = _resultado_local(await asyncio.to_thread(extraer_local, imagen_bytes))
+        if datos:
+            return datos
+    
+    data_url = await asyncio.to_thread(_imagen_data_url, imagen_bytes)
+    for nivel in niveles:
+        modelo = MODELOS_EXTRACCION[nivel]
+        inicio = time.perf_counter()
+        response = await _acrear_respuesta(_armar_solicitud(data_url, modelo))
+        datos, aceptado, sin_parsear = _evaluar_nivel(modelo, nivel, time.perf_counter() - inicio, response)
+        if aceptado:
+            _registrar_recibo(nivel)
+            return await areparar_respuesta(sin_parsear) if sin_parsear is not None else datos
+
+def _completar_datos(datos, imagen_path: str, sha256: str):
+    # Agregar metadatos
+    datos["fecha_procesamiento"] = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    datos["archivo_imagen"] = imagen_path
+    datos[CSVColumns.HASH_IMAGEN.value] = sha256
+    # Un hit de la cache trae el id del registro ya guardado: reusarlo evita duplicarlo
+    datos["id"] = datos.get("id") or str(uuid.uuid4())
+    
+    # Mostrar resultados
+    _mostrar_datos(datos)
+    return datos
+
+def leer_recibo(imagen_path: str, imagen_bytes: bytes = None):
     """
     Lee una imagen de recibo/transferencia y extrae los datos principales.
     
+    Si la misma imagen ya se procesó con el mismo prompt y modelo, devuelve
+    el resultado de la cache de extracciones sin llamar a OpenAI. Si no, prueba
+    primero el modelo rápido y escala al grande solo si la validación falla.
+    
     Args:
         imagen_path: Ruta a la imagen del recibo
+        imagen_bytes: Contenido de la imagen ya en memoria (ej: descargado de
+            Telegram); si se pasa no se lee el disco y imagen_path queda solo
+            como referencia al archivo archivado
     """
     print("Leyendo recibo...")
     print(f"Imagen: {imagen_path}")
     print("-" * 50)
     
     try:
-        # Leer y codificar la imagen
-        with open(imagen_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # Configurar cliente OpenAI con variable de entorno
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY no encontrada en variables de entorno. Configura el archivo .env")
+        if imagen_bytes is None:
+            imagen_bytes = _leer_bytes(imagen_path)
+        sha256, cache, clave, datos = _buscar_en_cache(imagen_bytes)
+        nuevo = datos is None
         
-        client = openai.OpenAI(api_key=api_key)
+        if nuevo:
+            # Analizar imagen: modelo rápido primero, el grande solo si hace falta
+            datos = _extraer_por_niveles(imagen_bytes)
         
-        # Analizar imagen con GPT-4 Vision
-        schema_example = {
-            CSVColumns.TOTAL.value: "monto numérico con decimales en formato 123.45",
-            CSVColumns.FECHA_TRANSFERENCIA.value: "DD/MM/AAAA",
-            CSVColumns.RECEPTOR.value: "nombre del destinatario o comercio, dejar en blanco si no aparece",
-            CSVColumns.CUENTA_ORIGEN.value: "institución o medio de pago (ej: Lemon, Mercado Pago, Santander, Ualá, etc.)",
-            CSVColumns.TRANSACTION_TYPE.value: "transferencia | débito | crédito | otro (si no está claro)",
-            CSVColumns.ID_TRANSACCION.value: "código o identificador de la operación, dejar en blanco si no se encuentra",
-            CSVColumns.REMITENTE.value: "nombre del remitente, dejar en blanco si no aparece",
-        }
-
-        text = f"""
-        Extrae de la imagen los siguientes campos y responde ÚNICAMENTE en formato JSON:
-        {json.dumps(schema_example, ensure_ascii=False, indent=4)}
-        Reglas:
-            - El campo "{CSVColumns.TRANSACTION_TYPE.value}" debe ser "débito" o "crédito" si explícitamente lo indica el ticket; si no aparece, asumir "transferencia".
-            - No incluyas texto extra ni explicaciones fuera del JSON.
-            - Si algún dato no se puede identificar con certeza, deja el campo en blanco.
-            - Respeta el formato exacto de claves y comillas del JSON.
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user", 
-                "content": [
-                    {"type": "text", "text": text},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
-                ]
-            }],
-            max_tokens=300,
-            temperature=0.1
-        )
-        
-        # Limpiar respuesta
-        result = response.choices[0].message.content.strip()
-        if result.startswith("```"):
-            result = result.split("```")[1].replace("json", "").strip()
-        
-        # Parsear JSON
-        datos = json.loads(result)
+        datos = _completar_datos(datos, imagen_path, sha256)
+        if nuevo and cache:
+            # Se cachea con el id: si la imagen vuelve a llegar, apunta al mismo registro
+            cache.put(clave, datos)
+        return datos
         
+    except json.JSONDecodeError as e:
+        print(f"Error al parsear JSON: {e}")
+        print(f"Respuesta original: {e.doc}")
+        return None
         
+    except Exception as e:
+        print(f"Error procesando imagen: {e}")
+        return None
 
-        if 'total' in datos:
-            datos['total'] = _normalize_amount_string(datos.get('total'))
-        
-        # Agregar metadatos
-        datos["fecha_procesamiento"] = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        datos["archivo_imagen"] = imagen_path
-        datos["id"] = str(uuid.uuid4())
+async def aleer_recibo(imagen_path: str, imagen_bytes: bytes = None, niveles: range = None):
+    """
+    Versión asíncrona de leer_recibo.
+    
+    Usa un AsyncOpenAI compartido (keep-alive) y limita las llamadas
+    simultáneas con OPENAI_MAX_CONCURRENCIA, así el bot y la API pueden
+    procesar muchos recibos a la vez sin un hilo por recibo. Lectura de
+    disco y preprocesado de la imagen corren fuera del event loop.
+    
+    Args:
+        imagen_path: Ruta a la imagen del recibo
+        imagen_bytes: Contenido de la imagen ya en memoria (ver leer_recibo)
+        niveles: Índices de MODELOS_EXTRACCION a probar (por defecto todos).
+            Ej: range(1) prueba solo el modelo rápido y devuelve None si no
+            alcanza, para intentar antes una versión más grande de la imagen
+            (cuesta menos que el modelo grande). None no se guarda en la cache
+    """
+    print(f"Leyendo recibo (async): {imagen_path}")
+    
+    try:
+        if imagen_bytes is None:
+            imagen_bytes = await asyncio.to_thread(_leer_bytes, imagen_path)
+        sha256, cache, clave, datos = _buscar_en_cache(imagen_bytes)
+        nuevo = datos is None
         
-        # Mostrar resultados
-        print("DATOS EXTRAIDOS:")
-        print(f"{CSVColumnsNames.TOTAL.value}: {datos.get(CSVColumns.TOTAL.value, 'NO_ENCONTRADO')}")
-        print(f"{CSVColumnsNames.FECHA_TRANSFERENCIA.value}: {datos.get(CSVColumns.FECHA_TRANSFERENCIA.value, 'NO_ENCONTRADO')}")
-        print(f"{CSVColumnsNames.RECEPTOR.value}: {datos.get(CSVColumns.RECEPTOR.value, 'NO_ENCONTRADO')}")
-        print(f"{CSVColumnsNames.TRANSACTION_TYPE.value}: {datos.get(CSVColumns.TRANSACTION_TYPE.value, 'NO_ENCONTRADO')}")
-        print(f"{CSVColumnsNames.ID_TRANSACCION.value}: {datos.get(CSVColumns.ID_TRANSACCION.value, 'NO_ENCONTRADO')}")
-        print(f"{CSVColumnsNames.CUENTA_ORIGEN.value}: {datos.get(CSVColumns.CUENTA_ORIGEN.value, 'NO_ENCONTRADO')}")
+        if nuevo:
+            datos = await _aextraer_por_niveles(imagen_bytes, niveles)
+            if not datos:
+                return None
         
+        datos = _completar_datos(datos, imagen_path, sha256)
+        if nuevo and cache:
+            cache.put(clave, datos)
         return datos
         
     except json.JSONDecodeError as e:
         print(f"Error al parsear JSON: {e}")
-        print(f"Respuesta original: {result}")
+        print(f"Respuesta original: {e.doc}")
         return None
         
     except Exception as e:
@@ -111,42 +583,17 @@ def leer_recibo(imagen_path: str):
 
 def guardar_en_json(datos, archivo_json="docs/invoices/invoices.json"):
     """
-    Guarda los datos extraídos en un archivo JSON en la carpeta docs/invoices.
+    Guarda los datos extraídos en el store de invoices (JSON Lines, append-only).
     
     Args:
         datos: Diccionario con los datos extraídos
-        archivo_json: Ruta completa al archivo JSON donde guardar
+        archivo_json: Ruta al store o al invoices.json heredado (se migra solo la primera vez)
     """
     try:
-        # Crear directorio si no existe
-        directorio = os.path.dirname(archivo_json)
-        if not os.path.exists(directorio):
-            os.makedirs(directorio)
-        
-        # Leer datos existentes si el archivo existe
-        if os.path.exists(archivo_json):
-            with open(archivo_json, 'r', encoding='utf-8') as f:
-                try:
-                    invoices = json.load(f)
-                    if not isinstance(invoices, list):
-                        # Si el archivo no contiene una lista, crear una nueva
-                        invoices = []
-                except json.JSONDecodeError:
-                    # Si el archivo está corrupto, crear una nueva lista
-                    print("Archivo JSON corrupto, creando nuevo...")
-                    invoices = []
-        else:
-            invoices = []
-        
-        # Agregar nuevos datos
-        invoices.append(datos)
-        
-        # Guardar archivo actualizado
-        with open(archivo_json, 'w', encoding='utf-8') as f:
-            json.dump(invoices, f, indent=2, ensure_ascii=False)
+        store = obtener_store(archivo_json)
+        store.append(datos)
         
-        print(f"Datos guardados en {archivo_json}")
-        print(f"Total de registros en archivo: {len(invoices)}")
+        print(f"Datos guardados en {getattr(store, 'ruta', archivo_json)}")
         return True
         
     except Exception as e:
@@ -188,7 +635,7 @@ if __name__ == "__main__":
         
         # Guardar en JSON en la carpeta docs/invoices
         if guardar_en_json(resultado):
-            print("Datos agregados al archivo docs/invoices/invoices.json")
+            print("Datos agregados al archivo docs/invoices/invoices.jsonl")
         else:
             print("Error al guardar en archivo JSON")
     else:
@@ -0,0 +1,826 @@
+"""
+ALMACENAMIENTO DE INVOICES
+==========================
+
+Reemplaza el "leer todo el array JSON, agregar y reescribir" de
+guardar_en_json por un store con backend intercambiable.
+
+Backend por defecto: JSON Lines (un invoice por línea, solo se agrega al final).
+- Agregar un registro es O(1): una única escritura con O_APPEND.
+- El fsync se hace por lotes (cada N registros o cada T segundos).
+- Los lectores recorren el archivo línea a línea sin cargarlo completo.
+
+Backend opcional: SQLite en modo WAL, con una columna por campo de CSVColumns
+e índices en id_transaccion, fecha, receptor, cuenta_origen y estado de
+sincronización, para que búsquedas, conteos y "pendientes de subir" sean
+consultas indexadas.
+
+Cada store mantiene además un índice de estadísticas (estadisticas.py) que
+se actualiza al guardar y al sincronizar, para que 'estado' no recorra el
+historial.
+
+Configuración (.env):
+    INVOICE_STORE_BACKEND=jsonl        # o sqlite
+    INVOICE_STORE_PATH=docs/invoices/invoices.jsonl
+    INVOICE_STORE_FSYNC_CADA=20
+    INVOICE_STORE_FSYNC_SEGUNDOS=2.0
+    INVOICE_STORE_MIGRAR_SINCRONIZADO=1  # lo migrado de invoices.json ya está en Sheets
+
+Uso:
+    python invoice_store.py migrar [RUTA_JSON] [--pendientes]
+    python invoice_store.py compactar [RUTA_JSONL]
+    python invoice_store.py importar RUTA_JSON [RUTA_DB]
+"""
+
+import abc
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+from estadisticas import ESTADISTICAS_HABILITADAS, IndiceEstadisticas, ruta_indice
+from setup_google_sheets import CSVColumns
+
+# Cargar variables de entorno (la configuración se lee al importar)
+load_dotenv()
+
+EXTENSIONES_BACKEND = {"jsonl": ".jsonl", "sqlite": ".db"}
+BACKEND_DEFAULT = os.getenv("INVOICE_STORE_BACKEND", "jsonl").lower()
+RUTA_JSON_LEGACY = "docs/invoices/invoices.json"
+# Con guardar_en_json cada registro se subía a Sheets al guardarlo: lo migrado ya está en la planilla
+MIGRAR_SINCRONIZADO = os.getenv("INVOICE_STORE_MIGRAR_SINCRONIZADO", "1") not in ("0", "false", "no")
+RUTA_STORE_DEFAULT = os.getenv(
+    "INVOICE_STORE_PATH",
+    "docs/invoices/invoices" + EXTENSIONES_BACKEND.get(BACKEND_DEFAULT, ".jsonl"),
+)
+
+
+class InvoiceStore(abc.ABC):
+    """
+    Interfaz común de los backends de almacenamiento de invoices.
+    """
+
+    # Índice de estadísticas (ver obtener_store); None si no se usa
+    estadisticas = None
+
+    def _indexar(self):
+        # Si falla, lo pendiente se suma en la próxima actualización (el índice guarda hasta dónde leyó)
+        if self.estadisticas is not None:
+            try:
+                self.estadisticas.ponerse_al_dia(self)
+            except Exception as e:
+                print(f"Error actualizando estadísticas: {e}")
+
+    def _indexar_sincronizados(self, cantidad: int):
+        if self.estadisticas is not None:
+            try:
+                self.estadisticas.registrar_sincronizados(cantidad)
+            except Exception as e:
+                print(f"Error actualizando estadísticas: {e}")
+
+    @abc.abstractmethod
+    def append(self, datos: dict):
+        """Agrega un invoice."""
+
+    def append_many(self, invoices):
+        for datos in invoices:
+            self.append(datos)
+        self.flush()
+
+    @abc.abstractmethod
+    def iter_invoices(self):
+        """Recorre los invoices en orden de inserción, de forma perezosa."""
+
+    def count(self) -> int:
+        return sum(1 for _ in self.iter_invoices())
+
+    def last(self):
+        ultimo = None
+        for invoice in self.iter_invoices():
+            ultimo = invoice
+        return ultimo
+
+    def get(self, invoice_id: str):
+        encontrado = None
+        for invoice in self.iter_invoices():
+            if invoice.get("id") == invoice_id:
+                encontrado = invoice
+        return encontrado
+
+    def hashes_procesados(self) -> set:
+        """Hashes de las imágenes ya extraídas (para no procesarlas de nuevo)."""
+        campo = CSVColumns.HASH_IMAGEN.value
+        return {invoice[campo] for invoice in self.iter_invoices() if invoice.get(campo)}
+
+    @abc.abstractmethod
+    def leer_desde(self, marca: int, limite: int):
+        """
+        Invoices agregados después de `marca` (posición propia del backend),
+        hasta `limite`, en orden de inserción.
+
+        Returns:
+            Tupla (invoices, nueva_marca)
+        """
+
+    @abc.abstractmethod
+    def marca_final(self) -> int:
+        """Marca del final actual del store (ver leer_desde)."""
+
+    @abc.abstractmethod
+    def unsynced(self):
+        """Invoices que todavía no se subieron a Google Sheets."""
+
+    def count_unsynced(self) -> int:
+        return sum(1 for _ in self.unsynced())
+
+    @abc.abstractmethod
+    def mark_synced(self, ids):
+        """Registra los ids como ya subidos a Google Sheets."""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JsonlInvoiceStore(InvoiceStore):
+    """
+    Store append-only en formato JSON Lines.
+
+    El estado de sincronización con Sheets vive en "<ruta>.sync", también
+    append-only: cada línea agrega los ids subidos y la marca (offset en
+    bytes) hasta la cual todo el archivo ya está sincronizado, para que
+    buscar pendientes no relea el historial completo.
+    """
+
+    def __init__(self, ruta: str, fsync_cada: int = None, fsync_segundos: float = None):
+        self.ruta = ruta
+        self.fsync_cada = fsync_cada if fsync_cada is not None else int(os.getenv("INVOICE_STORE_FSYNC_CADA", "20"))
+        self.fsync_segundos = fsync_segundos if fsync_segundos is not None else float(os.getenv("INVOICE_STORE_FSYNC_SEGUNDOS", "2.0"))
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pendientes_fsync = 0
+        self._ultimo_fsync = time.monotonic()
+        self.ruta_sync = ruta + ".sync"
+        self._sincronizados = None
+        self._marca_sync = 0
+        # Índice id -> offset de la línea, completado perezosamente por get
+        self._offsets = {}
+        self._indexado_hasta = 0
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    def _abrir(self):
+        if self._fd is None:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+            self._fd = os.open(self.ruta, flags, 0o644)
+        return self._fd
+
+    def append(self, datos: dict):
+        """
+        Agrega un invoice al final del archivo.
+
+        La línea completa se escribe con un único write sobre un descriptor
+        abierto con O_APPEND, así dos procesos que guardan a la vez no se pisan.
+        """
+        linea = (json.dumps(datos, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            fd = self._abrir()
+            os.write(fd, linea)
+            self._pendientes_fsync += 1
+            if (self._pendientes_fsync >= self.fsync_cada
+                    or time.monotonic() - self._ultimo_fsync >= self.fsync_segundos):
+                self._fsync()
+        self._indexar()
+
+    def append_many(self, invoices):
+        """Agrega varios invoices con una sola escritura y un solo fsync."""
+        invoices = list(invoices)
+        bloque = b"".join(
+            (json.dumps(datos, ensure_ascii=False) + "\n").encode("utf-8") for datos in invoices
+        )
+        if not bloque:
+            return
+        with self._lock:
+            os.write(self._abrir(), bloque)
+            self._pendientes_fsync += 1
+            self._fsync()
+        self._indexar()
+
+    def _fsync(self):
+        if self._fd is not None and self._pendientes_fsync:
+            os.fsync(self._fd)
+        self._pendientes_fsync = 0
+        self._ultimo_fsync = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._fsync()
+
+    def close(self):
+        with self._lock:
+            self._fsync()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        if self.estadisticas is not None:
+            self.estadisticas.close()
+
+    def iter_invoices(self):
+        """
+        Recorre los invoices de forma perezosa, uno por línea.
+        Las líneas vacías o corruptas (ej: escritura cortada) se ignoran.
+        """
+        if not os.path.exists(self.ruta):
+            return
+        with open(self.ruta, "r", encoding="utf-8") as f:
+            for numero, linea in enumerate(f, start=1):
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    yield json.loads(linea)
+                except json.JSONDecodeError:
+                    print(f"Línea {numero} corrupta en {self.ruta}, se ignora")
+
+    def last(self):
+        """
+        Devuelve el último invoice leyendo el archivo desde el final.
+        """
+        if not os.path.exists(self.ruta):
+            return None
+        with open(self.ruta, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            fin = f.tell()
+            bloque = b""
+            posicion = fin
+            while posicion > 0:
+                paso = min(4096, posicion)
+                posicion -= paso
+                f.seek(posicion)
+                bloque = f.read(paso) + bloque
+                lineas = bloque.split(b"\n")
+                # El primer fragmento puede estar cortado si no llegamos al inicio
+                completas = lineas if posicion == 0 else lineas[1:]
+                for linea in reversed(completas):
+                    if not linea.strip():
+                        continue
+                    try:
+                        return json.loads(linea.decode("utf-8"))
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        continue
+                bloque = lineas[0] if posicion > 0 else b""
+        return None
+
+    def _cargar_sync(self):
+        if self._sincronizados is not None:
+            return
+        self._sincronizados = set()
+        self._marca_sync = 0
+        if not os.path.exists(self.ruta_sync):
+            return
+        with open(self.ruta_sync, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    entrada = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                self._sincronizados.update(entrada.get("ids", []))
+                self._marca_sync = entrada.get("offset", self._marca_sync)
+
+    def _registrar_sync(self, ids):
+        entrada = {"ids": list(ids), "offset": self._marca_sync}
+        with open(self.ruta_sync, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entrada) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _iter_lineas(self, desde: int = 0):
+        """Recorre (offset_inicio, offset_fin, invoice) desde un offset en bytes."""
+        if not os.path.exists(self.ruta):
+            return
+        with open(self.ruta, "rb") as f:
+            f.seek(desde)
+            posicion = desde
+            for linea in f:
+                # Una última línea sin salto puede estar escribiéndose todavía
+                if not linea.endswith(b"\n"):
+                    return
+                inicio = posicion
+                posicion += len(linea)
+                if not linea.strip():
+                    continue
+                try:
+                    yield inicio, posicion, json.loads(linea.decode("utf-8"))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+
+    def _iter_con_offsets(self, desde: int = 0):
+        """Recorre (offset_fin_de_linea, invoice) desde un offset en bytes."""
+        for _, fin, invoice in self._iter_lineas(desde):
+            yield fin, invoice
+
+    def leer_desde(self, marca: int, limite: int):
+        """La marca es el offset en bytes hasta el que ya se leyó."""
+        invoices = []
+        for _, fin, invoice in self._iter_lineas(marca):
+            invoices.append(invoice)
+            marca = fin
+            if len(invoices) >= limite:
+                break
+        return invoices, marca
+
+    def marca_final(self) -> int:
+        return os.path.getsize(self.ruta) if os.path.exists(self.ruta) else 0
+
+    def get(self, invoice_id: str):
+        """
+        Busca un invoice por id sin recorrer el historial en cada llamada:
+        el índice id -> offset solo lee lo agregado desde la búsqueda anterior
+        (incluido lo que escribió otro proceso) y la línea se lee con un seek.
+        """
+        with self._lock:
+            if os.path.exists(self.ruta) and os.path.getsize(self.ruta) < self._indexado_hasta:
+                # El archivo se compactó por fuera: los offsets ya no valen
+                self._offsets = {}
+                self._indexado_hasta = 0
+            for inicio, fin, invoice in self._iter_lineas(self._indexado_hasta):
+                if invoice.get("id"):
+                    # Si un id se repite, gana la última versión (como en compact)
+                    self._offsets[invoice["id"]] = inicio
+                self._indexado_hasta = fin
+            inicio = self._offsets.get(invoice_id)
+        if inicio is None:
+            return None
+        with open(self.ruta, "rb") as f:
+            f.seek(inicio)
+            return json.loads(f.readline().decode("utf-8"))
+
+    def unsynced(self):
+        """
+        Invoices cuyo id todavía no figura en "<ruta>.sync", leyendo solo
+        desde la marca de sincronización.
+        """
+        with self._lock:
+            self._cargar_sync()
+            sincronizados = set(self._sincronizados)
+            desde = self._marca_sync
+        for _, invoice in self._iter_con_offsets(desde):
+            invoice_id = invoice.get("id")
+            if not invoice_id:
+                print("Invoice sin id, no se puede sincronizar")
+                continue
+            if invoice_id not in sincronizados:
+                yield invoice
+
+    def mark_synced(self, ids):
+        """
+        Registra los ids como subidos y avanza la marca sobre el prefijo
+        del archivo que quedó completamente sincronizado. Las líneas sin id
+        (ej: editadas a mano) nunca se pueden subir, así que no la frenan.
+        """
+        ids = [i for i in ids if i]
+        with self._lock:
+            self._cargar_sync()
+            nuevos = len(set(ids) - self._sincronizados)
+            self._sincronizados.update(ids)
+            for fin, invoice in self._iter_con_offsets(self._marca_sync):
+                invoice_id = invoice.get("id")
+                if invoice_id and invoice_id not in self._sincronizados:
+                    break
+                self._marca_sync = fin
+            self._registrar_sync(ids)
+        self._indexar_sincronizados(nuevos)
+
+    def compact(self):
+        """
+        Reescribe el archivo descartando líneas corruptas y versiones
+        duplicadas de un mismo id (gana la última).
+
+        Ejecutar con el bot detenido: los registros agregados por otro
+        proceso durante la compactación se perderían.
+
+        Returns:
+            Tupla (registros_antes, registros_despues)
+        """
+        with self._lock:
+            self._fsync()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+            antes = 0
+            por_id = {}
+            for invoice in self.iter_invoices():
+                antes += 1
+                clave = invoice.get("id") or f"_sin_id_{antes}"
+                # Reinsertar para que el orden refleje la última escritura
+                por_id.pop(clave, None)
+                por_id[clave] = invoice
+
+            temporal = self.ruta + ".tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                for invoice in por_id.values():
+                    f.write(json.dumps(invoice, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, self.ruta)
+
+            # Los offsets cambiaron: la marca vuelve al inicio (los ids siguen valiendo)
+            self._offsets = {}
+            self._indexado_hasta = 0
+            self._cargar_sync()
+            self._marca_sync = 0
+            self._registrar_sync([])
+            return antes, len(por_id)
+
+
+class SqliteInvoiceStore(InvoiceStore):
+    """
+    Store SQLite (WAL) con el esquema derivado de CSVColumns.
+
+    Cada campo conocido tiene su columna; el registro completo se guarda
+    además en "datos" para no perder claves extra.
+    """
+
+    COLUMNAS = [c.value for c in CSVColumns if c != CSVColumns.ID]
+    INDICES = [
+        CSVColumns.ID_TRANSACCION.value,
+        CSVColumns.FECHA_TRANSFERENCIA.value,
+        CSVColumns.RECEPTOR.value,
+        CSVColumns.CUENTA_ORIGEN.value,
+        CSVColumns.HASH_IMAGEN.value,
+    ]
+    TAMANO_PAGINA = 500
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        # Autocommit: las transacciones se abren explícitamente con BEGIN
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._crear_esquema()
+
+    def _crear_esquema(self):
+        columnas = ",\n".join(f'    "{c}" TEXT' for c in self.COLUMNAS)
+        with self._lock:
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                {columnas},
+                    datos TEXT NOT NULL,
+                    sincronizado INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            # Columnas agregadas a CSVColumns después de crear la base
+            existentes = {fila["name"] for fila in self._conn.execute("PRAGMA table_info(invoices)")}
+            for columna in self.COLUMNAS:
+                if columna not in existentes:
+                    self._conn.execute(f'ALTER TABLE invoices ADD COLUMN "{columna}" TEXT')
+            for columna in self.INDICES:
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_invoices_{columna} ON invoices ("{columna}")'
+                )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_sincronizado ON invoices (sincronizado, seq)"
+            )
+
+    def _fila(self, datos: dict):
+        if not datos.get("id"):
+            datos["id"] = str(uuid.uuid4())
+        valores = [datos.get(c) for c in self.COLUMNAS]
+        return [datos["id"], *valores, json.dumps(datos, ensure_ascii=False)]
+
+    def _sql_upsert(self):
+        columnas = ", ".join(f'"{c}"' for c in self.COLUMNAS)
+        marcadores = ", ".join("?" for _ in range(len(self.COLUMNAS) + 2))
+        actualizar = ", ".join(f'"{c}" = excluded."{c}"' for c in [*self.COLUMNAS, "datos"])
+        return (
+            f"INSERT INTO invoices (id, {columnas}, datos) VALUES ({marcadores}) "
+            f"ON CONFLICT(id) DO UPDATE SET {actualizar}"
+        )
+
+    def append(self, datos: dict):
+        with self._lock:
+            self._conn.execute(self._sql_upsert(), self._fila(datos))
+        self._indexar()
+
+    def append_many(self, invoices):
+        """Inserta todos los invoices en una única transacción."""
+        invoices = list(invoices)
+        filas = [self._fila(datos) for datos in invoices]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(self._sql_upsert(), filas)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._indexar()
+
+    def _paginar(self, where: str = "", parametros=()):
+        ultimo_seq = 0
+        while True:
+            condicion = f"seq > ? {'AND ' + where if where else ''}"
+            with self._lock:
+                filas = self._conn.execute(
+                    f"SELECT seq, datos FROM invoices WHERE {condicion} ORDER BY seq LIMIT ?",
+                    (ultimo_seq, *parametros, self.TAMANO_PAGINA),
+                ).fetchall()
+            if not filas:
+                return
+            for fila in filas:
+                yield json.loads(fila["datos"])
+            ultimo_seq = filas[-1]["seq"]
+
+    def iter_invoices(self):
+        """Recorre los invoices por páginas, en orden de inserción."""
+        return self._paginar()
+
+    def leer_desde(self, marca: int, limite: int):
+        """La marca es el último seq leído (una actualización por upsert no cuenta de nuevo)."""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT seq, datos FROM invoices WHERE seq > ? ORDER BY seq LIMIT ?", (marca, limite)
+            ).fetchall()
+        if not filas:
+            return [], marca
+        return [json.loads(fila["datos"]) for fila in filas], filas[-1]["seq"]
+
+    def marca_final(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM invoices").fetchone()[0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def last(self):
+        with self._lock:
+            fila = self._conn.execute("SELECT datos FROM invoices ORDER BY seq DESC LIMIT 1").fetchone()
+        return json.loads(fila["datos"]) if fila else None
+
+    def get(self, invoice_id: str):
+        with self._lock:
+            fila = self._conn.execute("SELECT datos FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+        return json.loads(fila["datos"]) if fila else None
+
+    def buscar(self, **filtros):
+        """
+        Busca invoices por igualdad sobre columnas del esquema.
+
+        Ejemplo:
+            store.buscar(id_transaccion="84469555")
+        """
+        for columna in filtros:
+            if columna not in self.COLUMNAS:
+                raise ValueError(f"Columna desconocida: {columna}")
+        where = " AND ".join(f'"{c}" = ?' for c in filtros)
+        return list(self._paginar(where, tuple(filtros.values())))
+
+    def hashes_procesados(self) -> set:
+        campo = CSVColumns.HASH_IMAGEN.value
+        with self._lock:
+            filas = self._conn.execute(f'SELECT DISTINCT "{campo}" FROM invoices WHERE "{campo}" IS NOT NULL').fetchall()
+        return {fila[0] for fila in filas}
+
+    def unsynced(self):
+        """Invoices que todavía no se subieron a Google Sheets."""
+        return self._paginar("sincronizado = 0")
+
+    def count_unsynced(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM invoices WHERE sincronizado = 0"
+            ).fetchone()[0]
+
+    def mark_synced(self, ids):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                cursor = self._conn.executemany(
+                    "UPDATE invoices SET sincronizado = 1 WHERE id = ? AND sincronizado = 0",
+                    [(i,) for i in ids],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._indexar_sincronizados(cursor.rowcount)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        if self.estadisticas is not None:
+            self.estadisticas.close()
+
+
+def migrar_desde_json(archivo_json: str, store: InvoiceStore, sincronizado: bool = None):
+    """
+    Migra el array de invoices.json al store (una sola vez).
+
+    A los registros antiguos sin "id" se les asigna uno, para que el resto
+    del sistema pueda identificarlos.
+
+    Args:
+        archivo_json: Ruta al invoices.json heredado
+        store: Store destino
+        sincronizado: Marcar los registros como ya subidos a Sheets (por
+            defecto MIGRAR_SINCRONIZADO); si no, la próxima sincronización
+            los vuelve a subir todos
+
+    Returns:
+        Cantidad de registros migrados
+    """
+    if not os.path.exists(archivo_json):
+        return 0
+    try:
+        with open(archivo_json, "r", encoding="utf-8") as f:
+            invoices = json.load(f)
+    except json.JSONDecodeError:
+        print(f"Archivo {archivo_json} corrupto, no se migra")
+        return 0
+    if not isinstance(invoices, list):
+        return 0
+
+    for invoice in invoices:
+        if not invoice.get("id"):
+            invoice["id"] = str(uuid.uuid4())
+    store.append_many(invoices)
+    if MIGRAR_SINCRONIZADO if sincronizado is None else sincronizado:
+        store.mark_synced([invoice["id"] for invoice in invoices])
+        print(f"Migrados {len(invoices)} registros de {archivo_json} (marcados como ya subidos a Sheets)")
+    else:
+        print(f"Migrados {len(invoices)} registros de {archivo_json} (pendientes de subir a Sheets)")
+    return len(invoices)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _backend_de_ruta(ruta: str):
+    if ruta.endswith((".db", ".sqlite", ".sqlite3")):
+        return "sqlite"
+    return "jsonl"
+
+
+def _resolver_ruta(ruta: str = None):
+    """
+    Devuelve (backend, ruta_store, ruta_json_legacy). Las rutas ".json"
+    heredadas se traducen al archivo hermano del backend configurado.
+    """
+    if not ruta or ruta == RUTA_JSON_LEGACY:
+        return _backend_de_ruta(RUTA_STORE_DEFAULT), RUTA_STORE_DEFAULT, RUTA_JSON_LEGACY
+    base, extension = os.path.splitext(ruta)
+    if extension == ".json":
+        backend = BACKEND_DEFAULT if BACKEND_DEFAULT in EXTENSIONES_BACKEND else "jsonl"
+        return backend, base + EXTENSIONES_BACKEND[backend], ruta
+    return _backend_de_ruta(ruta), ruta, base + ".json"
+
+
+def crear_store(backend: str, ruta: str) -> InvoiceStore:
+    if backend == "sqlite":
+        return SqliteInvoiceStore(ruta)
+    return JsonlInvoiceStore(ruta)
+
+
+def obtener_store(ruta: str = None) -> InvoiceStore:
+    """
+    Devuelve el store del proceso para la ruta indicada, creándolo (y
+    migrando el invoices.json heredado) la primera vez.
+
+    Args:
+        ruta: Ruta al store o al invoices.json heredado
+
+    Returns:
+        Instancia de InvoiceStore compartida
+    """
+    backend, ruta_store, ruta_legacy = _resolver_ruta(ruta)
+    with _stores_lock:
+        store = _stores.get(ruta_store)
+        if store is None:
+            existia = os.path.exists(ruta_store)
+            store = crear_store(backend, ruta_store)
+            if not existia and ruta_legacy:
+                migrar_desde_json(ruta_legacy, store)
+            if ESTADISTICAS_HABILITADAS:
+                indice = IndiceEstadisticas(ruta_indice(ruta_store))
+                if not indice.inicializado():
+                    # Primera vez (o índice borrado): se recorre el store una sola vez
+                    indice.reconstruir(store)
+                else:
+                    # Lo que guardó otro proceso o quedó sin sumar por un error
+                    indice.ponerse_al_dia(store)
+                    indice.recontar_pendientes(store)
+                store.estadisticas = indice
+            _stores[ruta_store] = store
+        return store
+
+
+@atexit.register
+def _cerrar_stores():
+    for store in list(_stores.values()):
+        try:
+            store.close()
+        except Exception as e:
+            print(f"Error cerrando store: {e}")
+
+
+def _reconstruir_estadisticas(store: InvoiceStore):
+    """Recalcula el índice de estadísticas de un store modificado por fuera (importar, compactar)."""
+    ruta = ruta_indice(store.ruta)
+    if ESTADISTICAS_HABILITADAS and os.path.exists(ruta):
+        indice = IndiceEstadisticas(ruta)
+        try:
+            indice.reconstruir(store)
+        finally:
+            indice.close()
+
+
+def importar(origen: str, destino: str):
+    """
+    Importa un invoices.json (array) o un .jsonl a la base SQLite.
+
+    Args:
+        origen: Ruta al invoices.json o invoices.jsonl existente
+        destino: Ruta a la base SQLite
+    """
+    store = SqliteInvoiceStore(destino)
+    try:
+        if origen.endswith(".jsonl"):
+            origen_store = JsonlInvoiceStore(origen)
+            invoices = list(origen_store.iter_invoices())
+            store.append_many(invoices)
+            # Conservar el estado de sincronización del .jsonl para no volver a subir lo ya subido
+            pendientes = {invoice.get("id") for invoice in origen_store.unsynced()}
+            store.mark_synced([invoice["id"] for invoice in invoices if invoice.get("id") and invoice["id"] not in pendientes])
+            print(f"Importados {len(invoices)} registros de {origen} ({len(pendientes)} pendientes de subir)")
+        else:
+            migrar_desde_json(origen, store)
+        print(f"Registros en {destino}: {store.count()}")
+        _reconstruir_estadisticas(store)
+    finally:
+        store.close()
+
+
+def main():
+    """CLI de mantenimiento del store"""
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrar", "compactar", "importar"):
+        print("Uso:")
+        print("  python invoice_store.py migrar [RUTA_JSON] [--pendientes]")
+        print("  python invoice_store.py compactar [RUTA_JSONL]")
+        print("  python invoice_store.py importar RUTA_JSON [RUTA_DB]")
+        sys.exit(1)
+
+    comando = sys.argv[1]
+    # --pendientes: los registros migrados quedan sin marcar y se vuelven a subir a Sheets
+    pendientes = "--pendientes" in sys.argv
+    argumentos = [a for a in sys.argv[2:] if a != "--pendientes"]
+    ruta = argumentos[0] if argumentos else None
+
+    if comando == "migrar":
+        backend, ruta_store, ruta_legacy = _resolver_ruta(ruta or RUTA_JSON_LEGACY)
+        if os.path.exists(ruta_store):
+            print(f"{ruta_store} ya existe, no se migra de nuevo")
+            sys.exit(0)
+        store = crear_store(backend, ruta_store)
+        migrar_desde_json(ruta_legacy, store, sincronizado=not pendientes)
+        store.close()
+    elif comando == "importar":
+        origen = ruta or RUTA_JSON_LEGACY
+        destino = argumentos[1] if len(argumentos) > 1 else os.path.splitext(origen)[0] + ".db"
+        importar(origen, destino)
+    else:
+        backend, ruta_store, _ = _resolver_ruta(ruta)
+        if backend != "jsonl":
+            print(f"{ruta_store} es una base SQLite: no necesita compactarse (usar VACUUM si hace falta)")
+            sys.exit(1)
+        store = crear_store(backend, ruta_store)
+        antes, despues = store.compact()
+        print(f"Compactación completada: {antes} -> {despues} registros")
+        _reconstruir_estadisticas(store)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,166 +1,255 @@
 import gspread
-from google.oauth2.service_account import Credentials
 import json
 import os
+import sys
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
 
 from setup_google_sheets import CSVColumns, CSVColumnsNames
+from invoice_store import obtener_store
+from rate_limiter import obtener_limitador
+from sheets_session import obtener_sesion
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Encabezados y columnas de la hoja, en el mismo orden
+ENCABEZADOS = [
+    CSVColumnsNames.FECHA_PROCESAMIENTO.value,
+    CSVColumnsNames.FECHA_TRANSFERENCIA.value,
+    CSVColumnsNames.REMITENTE.value,
+    CSVColumnsNames.RECEPTOR.value,
+    CSVColumnsNames.TRANSACTION_TYPE.value,
+    CSVColumnsNames.TOTAL.value,
+    CSVColumnsNames.ID_TRANSACCION.value,
+    CSVColumnsNames.CUENTA_ORIGEN.value,
+    CSVColumnsNames.ARCHIVO_IMAGEN.value
+]
+
+# (columna, valor por defecto si falta)
+COLUMNAS_FILA = [
+    (CSVColumns.FECHA_PROCESAMIENTO, ""),
+    (CSVColumns.FECHA_TRANSFERENCIA, "NO_ENCONTRADO"),
+    (CSVColumns.REMITENTE, "NO_ENCONTRADO"),
+    (CSVColumns.RECEPTOR, "NO_ENCONTRADO"),
+    (CSVColumns.TRANSACTION_TYPE, "NO_ENCONTRADO"),
+    (CSVColumns.TOTAL, "NO_ENCONTRADO"),
+    (CSVColumns.ID_TRANSACCION, ""),
+    (CSVColumns.CUENTA_ORIGEN, "NO_ENCONTRADO"),
+    (CSVColumns.ARCHIVO_IMAGEN, "NO_ENCONTRADO")
+]
+
+# Filas por request de append_rows
+SHEETS_TAMANO_LOTE = int(os.getenv("SHEETS_TAMANO_LOTE", "500"))
+
+_sync_lock = threading.Lock()
+
+
+def construir_fila(invoice):
+    """
+    Convierte un invoice en la fila de 9 columnas de la hoja.
+    """
+    return [invoice.get(columna.value, defecto) for columna, defecto in COLUMNAS_FILA]
+
+
+def _append_rows_con_reintentos(sheet, filas):
+    """
+    Envía un lote con un único append_rows dentro de la cuota de escrituras
+    de Sheets, reintentando 429 y errores 5xx con backoff (ver rate_limiter).
+    """
+    return obtener_limitador("sheets").ejecutar(sheet.append_rows, filas)
+
+
+def subir_filas_en_lotes(sheet, invoices, tamano_lote=None, al_subir_lote=None):
+    """
+    Sube los invoices a la hoja en lotes de `tamano_lote` filas, un request por lote.
+    
+    Args:
+        sheet: Worksheet de gspread
+        invoices: Iterable de invoices (puede ser perezoso)
+        tamano_lote: Filas por request (por defecto SHEETS_TAMANO_LOTE)
+        al_subir_lote: Callback opcional que recibe los invoices de cada lote subido
+        
+    Returns:
+        Cantidad de filas subidas
+    """
+    tamano_lote = tamano_lote or SHEETS_TAMANO_LOTE
+    contador = 0
+    lote = []
+
+    def enviar():
+        nonlocal contador
+        _append_rows_con_reintentos(sheet, [construir_fila(invoice) for invoice in lote])
+        contador += len(lote)
+        if al_subir_lote:
+            al_subir_lote(lote)
+        print(f"Lote subido: {contador} registros")
+
+    for invoice in invoices:
+        lote.append(invoice)
+        if len(lote) >= tamano_lote:
+            enviar()
+            lote = []
+    if lote:
+        enviar()
+    return contador
+
 
 def leer_json_invoices(archivo_json="docs/invoices/invoices.json"):
     """
-    Lee el archivo JSON con los datos de invoices.
+    Lee los invoices del store de forma perezosa.
     
     Args:
-        archivo_json: Ruta al archivo JSON
+        archivo_json: Ruta al store o al invoices.json heredado
         
     Returns:
-        Lista de invoices o None si hay error
+        Iterador de invoices o None si hay error
     """
     try:
-        if not os.path.exists(archivo_json):
-            print(f"Archivo {archivo_json} no encontrado")
+        store = obtener_store(archivo_json)
+        if not os.path.exists(store.ruta):
+            print(f"Archivo {store.ruta} no encontrado")
             return None
             
-        with open(archivo_json, 'r', encoding='utf-8') as f:
-            invoices = json.load(f)
-            
-        print(f"Archivo JSON leido exitosamente: {len(invoices)} registros encontrados")
-        return invoices
+        return store.iter_invoices()
         
     except Exception as e:
         print(f"Error leyendo archivo JSON: {e}")
         return None
 
-def subir_json_a_sheets(sheet_id: str, credentials_path: str = "credentials.json", archivo_json="docs/invoices/invoices.json"):
+def _abrir_hoja(sheet_id: str, credentials_path: str):
+    # Cliente, hoja y estado de encabezados quedan cacheados en la sesión del proceso
+    sesion = obtener_sesion(credentials_path)
+    sesion.asegurar_encabezados(sheet_id, ENCABEZADOS)
+    return sesion.hoja(sheet_id)
+
+def sincronizar_pendientes(sheet_id: str, credentials_path: str = "credentials.json", archivo_json="docs/invoices/invoices.json", tamano_lote=None):
+    """
+    Sube a Google Sheets solo los invoices que todavía no fueron subidos.
+    
+    Los ids subidos quedan registrados en el store después de cada lote,
+    así que correrlo dos veces no duplica filas y un corte a mitad de camino
+    retoma desde el último lote confirmado.
+    
+    Args:
+        sheet_id: ID de la Google Sheet
+        credentials_path: Ruta al archivo de credenciales
+        archivo_json: Ruta al store o al invoices.json heredado
+        tamano_lote: Filas por request (por defecto SHEETS_TAMANO_LOTE)
+        
+    Returns:
+        bool: True si no quedó nada pendiente
+    """
+    try:
+        store = obtener_store(archivo_json)
+        # Una sincronización a la vez por proceso: dos en paralelo subirían los mismos pendientes
+        with _sync_lock:
+            return _sincronizar_pendientes(store, sheet_id, credentials_path, tamano_lote)
+        
+    except Exception as e:
+        print(f"Error sincronizando con Google Sheets: {e}")
+        obtener_sesion(credentials_path).invalidar(sheet_id)
+        return False
+
+def _sincronizar_pendientes(store, sheet_id, credentials_path, tamano_lote):
+    pendientes = list(store.unsynced())
+    
+    if not pendientes:
+        print("No hay registros pendientes de sincronizar")
+        return True
+    
+    print(f"Registros pendientes: {len(pendientes)}")
+    print("Conectando a Google Sheets...")
+    sheet = _abrir_hoja(sheet_id, credentials_path)
+    
+    contador = subir_filas_en_lotes(
+        sheet,
+        pendientes,
+        tamano_lote,
+        al_subir_lote=lambda lote: store.mark_synced([invoice.get("id") for invoice in lote]),
+    )
+    
+    print(f"Sincronización completada: {contador} registros subidos")
+    return True
+
+def marcar_todo_sincronizado(archivo_json="docs/invoices/invoices.json"):
     """
-    Lee el archivo JSON y sube todos los datos a Google Sheets.
+    Marca todos los invoices actuales como ya subidos, sin tocar la hoja.
+    Útil la primera vez, cuando la hoja ya tiene el historial cargado.
+    
+    Returns:
+        Cantidad de invoices marcados
+    """
+    store = obtener_store(archivo_json)
+    ids = [invoice.get("id") for invoice in store.unsynced()]
+    store.mark_synced(ids)
+    print(f"{len(ids)} registros marcados como sincronizados")
+    return len(ids)
+
+def subir_json_a_sheets(sheet_id: str, credentials_path: str = "credentials.json", archivo_json="docs/invoices/invoices.json", tamano_lote=None, completo=False):
+    """
+    Sube los invoices del JSON a Google Sheets en lotes.
+    
+    Por defecto es incremental (solo lo pendiente). Con completo=True vuelve
+    a subir todo el historial, como hacía antes.
     
     Args:
         sheet_id: ID de la Google Sheet
         credentials_path: Ruta al archivo de credenciales
         archivo_json: Ruta al archivo JSON
+        tamano_lote: Filas por request (por defecto SHEETS_TAMANO_LOTE)
+        completo: Re-subir todos los registros aunque ya estén sincronizados
     """
+    if not completo:
+        return sincronizar_pendientes(sheet_id, credentials_path, archivo_json, tamano_lote)
+    
     try:
         print("Leyendo archivo JSON...")
         invoices = leer_json_invoices(archivo_json)
         
-        if not invoices:
+        if invoices is None:
             print("No hay datos para subir")
             return False
             
         print("Conectando a Google Sheets...")
+        sheet = _abrir_hoja(sheet_id, credentials_path)
+        store = obtener_store(archivo_json)
         
-        # Configurar credenciales
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        creds = Credentials.from_service_account_file(credentials_path, scopes=scope)
-        client = gspread.authorize(creds)
-        
-        # Abrir la hoja
-        sheet = client.open_by_key(sheet_id).sheet1
-        print(f"Hoja abierta: {sheet.title}")
+        # Subir los invoices en lotes
+        contador = subir_filas_en_lotes(
+            sheet,
+            invoices,
+            tamano_lote,
+            al_subir_lote=lambda lote: store.mark_synced([invoice.get("id") for invoice in lote]),
+        )
         
-        # Limpiar hoja existente (opcional - comentar si quieres mantener datos)
-        # sheet.clear()
-        
-        # Agregar encabezados si la hoja está vacía
-        if not sheet.get_all_values():
-            headers = [
-                CSVColumnsNames.FECHA_PROCESAMIENTO.value,
-                CSVColumnsNames.FECHA_TRANSFERENCIA.value,
-                CSVColumnsNames.REMITENTE.value,
-                CSVColumnsNames.RECEPTOR.value,
-                CSVColumnsNames.TRANSACTION_TYPE.value,
-                CSVColumnsNames.TOTAL.value,
-                CSVColumnsNames.ID_TRANSACCION.value,
-                CSVColumnsNames.CUENTA_ORIGEN.value,
-                CSVColumnsNames.ARCHIVO_IMAGEN.value
-            ]
-            sheet.append_row(headers)
-            print("Encabezados agregados")
-        
-        # Subir cada invoice
-        contador = 0
-        for invoice in invoices:
-            row_data = [
-                invoice.get(CSVColumns.FECHA_PROCESAMIENTO.value, ""),
-                invoice.get(CSVColumns.FECHA_TRANSFERENCIA.value, "NO_ENCONTRADO"),
-                invoice.get(CSVColumns.REMITENTE.value, "NO_ENCONTRADO"),
-                invoice.get(CSVColumns.RECEPTOR.value, "NO_ENCONTRADO"),
-                invoice.get(CSVColumns.TRANSACTION_TYPE.value, "NO_ENCONTRADO"),
-                invoice.get(CSVColumns.TOTAL.value, "NO_ENCONTRADO"),
-                invoice.get(CSVColumns.ID_TRANSACCION.value, ""),
-                invoice.get(CSVColumns.CUENTA_ORIGEN.value, "NO_ENCONTRADO"),
-                invoice.get(CSVColumns.ARCHIVO_IMAGEN.value, "NO_ENCONTRADO")
-            ]
-            
-            sheet.append_row(row_data)
-            contador += 1
-            print(f"Registro {contador} subido: {invoice.get('total')} - {invoice.get('receptor')}")
+        if contador == 0:
+            print("No hay datos para subir")
+            return False
         
         print(f"Proceso completado: {contador} registros subidos exitosamente")
         return True
         
     except Exception as e:
         print(f"Error subiendo a Google Sheets: {e}")
+        obtener_sesion(credentials_path).invalidar(sheet_id)
         return False
 
-# NUEVO: Agregar solo la última entrada del JSON a Google Sheets
 def append_ultima_invoice_a_sheets(sheet_id: str, credentials_path: str = "credentials.json", archivo_json="docs/invoices/invoices.json"):
     """
-    Lee el archivo JSON y agrega SOLO la última entrada a Google Sheets.
+    Agrega a Google Sheets las entradas nuevas del JSON.
+    
+    Antes subía solo invoices[-1] y perdía registros si llegaban dos recibos
+    seguidos; ahora sube todo lo pendiente en un único lote.
     
     Args:
         sheet_id: ID de la Google Sheet
         credentials_path: Ruta al archivo de credenciales
         archivo_json: Ruta al archivo JSON
     """
-    try:
-        print("Leyendo archivo JSON para última entrada...")
-        invoices = leer_json_invoices(archivo_json)
-        
-        if not invoices:
-            print("No hay datos para subir")
-            return False
-        
-        last_invoice = invoices[-1]
-        
-        print("Conectando a Google Sheets...")
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        creds = Credentials.from_service_account_file(credentials_path, scopes=scope)
-        client = gspread.authorize(creds)
-        
-        sheet = client.open_by_key(sheet_id).sheet1
-        print(f"Hoja abierta: {sheet.title}")
-        
-        # Agregar encabezados si la hoja está vacía
-        if not sheet.get_all_values():
-            headers = ["Fecha Procesamiento", "Fecha Transferencia", "Total", "Receptor", "Cuenta Origen", "Id Transaccion", "Archivo Imagen"]
-            sheet.append_row(headers)
-            print("Encabezados agregados")
-        
-        row_data = [
-            last_invoice.get(CSVColumns.FECHA_PROCESAMIENTO.value, ""),
-            last_invoice.get(CSVColumns.FECHA_TRANSFERENCIA.value, "NO_ENCONTRADO"),
-            last_invoice.get(CSVColumns.REMITENTE.value, "NO_ENCONTRADO"),
-            last_invoice.get(CSVColumns.RECEPTOR.value, "NO_ENCONTRADO"),
-            last_invoice.get(CSVColumns.TRANSACTION_TYPE.value, "NO_ENCONTRADO"),
-            last_invoice.get(CSVColumns.TOTAL.value, "NO_ENCONTRADO"),
-            last_invoice.get(CSVColumns.ID_TRANSACCION.value, ""),
-            last_invoice.get(CSVColumns.CUENTA_ORIGEN.value, "NO_ENCONTRADO"),
-            last_invoice.get(CSVColumns.ARCHIVO_IMAGEN.value, "NO_ENCONTRADO")
-        ]
-        
-        sheet.append_row(row_data)
-        print("Último registro subido exitosamente")
-        return True
-    except Exception as e:
-        print(f"Error subiendo última entrada a Google Sheets: {e}")
-        return False
+    return sincronizar_pendientes(sheet_id, credentials_path, archivo_json)
+
 # Ejecutar la sincronización
 if __name__ == "__main__":
     print("SINCRONIZADOR JSON A GOOGLE SHEETS")
@@ -177,8 +266,12 @@ if __name__ == "__main__":
         print("   GOOGLE_SHEET_ID=tu_id_de_google_sheet")
         exit(1)
     
-    # Subir datos del JSON al Sheet
-    if subir_json_a_sheets(sheet_id, credentials_path):
+    if "--marcar-sincronizado" in sys.argv:
+        marcar_todo_sincronizado()
+        exit(0)
+    
+    # Subir datos del JSON al Sheet (--completo vuelve a subir todo el historial)
+    if subir_json_a_sheets(sheet_id, credentials_path, completo="--completo" in sys.argv):
         print("Sincronizacion completada exitosamente")
     else:
         print("Error en la sincronizacion")
@@ -1,12 +1,56 @@
 # Para usar este endpoint en tu app principal
 # app/main.py
+import asyncio
+import os
+import secrets
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app.api.upload import router as upload_router
+from app.api.telegram import TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_URL, router as telegram_router
+from app.api.upload import rechazar_uploads_grandes, router as upload_router
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Con TELEGRAM_WEBHOOK_URL configurada, el bot de Telegram corre dentro de
+    esta app en modo webhook (un solo proceso, el mismo pipeline que los
+    uploads) junto con el worker de la cola persistente.
+
+    El webhook nunca queda abierto sin secret: si TELEGRAM_WEBHOOK_SECRET
+    está vacío se genera uno para esta ejecución y se registra en Telegram.
+    """
+    bot = None
+    worker = None
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if TELEGRAM_WEBHOOK_URL and token:
+        from cola_recibos import drenar
+        from orchestrator import obtener_pipeline
+        from telegram_bot import COLA_WORKER_EN_BOT, TelegramBot
+
+        secret = TELEGRAM_WEBHOOK_SECRET
+        if not secret:
+            secret = secrets.token_urlsafe(32)
+            print("TELEGRAM_WEBHOOK_SECRET vacío: se generó uno para esta ejecución")
+        bot = TelegramBot(token, webhook=True)
+        await bot.iniciar_webhook(TELEGRAM_WEBHOOK_URL, secret)
+        app.state.telegram_webhook_secret = secret
+        if COLA_WORKER_EN_BOT:
+            worker = asyncio.create_task(drenar(obtener_pipeline()))
+    app.state.telegram_bot = bot
+    try:
+        yield
+    finally:
+        if worker:
+            worker.cancel()
+        if bot:
+            await bot.detener_webhook()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
+app.middleware("http")(rechazar_uploads_grandes)
 app.include_router(upload_router, prefix="/api/v1")
+app.include_router(telegram_router, prefix="/api/v1")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -5,19 +5,34 @@ ORQUESTADOR SIMPLE PARA FLUJO DE TELEGRAM
 Flujo:
 1. Telegram Bot recibe imagen -> Guarda en docs/invoices/
 2. Orchestrator recibe ruta de imagen
-3. Llama a invoice_reader.py para procesar imagen y guardar en JSON
-4. Llama a invoices.py para subir JSON a Google Sheets
+3. Llama a invoice_reader.py para procesar imagen y guardar en el store
+4. Llama a invoices.py para subir los registros pendientes a Google Sheets
+
+Los módulos se importan una sola vez; InvoicePipeline reúne lector, store y
+destino de Sheets y se reutiliza entre imágenes (ver obtener_pipeline).
+Cada imagen se registra en la cola persistente (cola_recibos) y su avance se
+guarda por etapa: si algo falla después de extraer, un worker lo completa.
+Las versiones asíncronas aceptan la imagen ya en memoria (bot, uploads): se
+extrae de esos bytes y el archivo se escribe en segundo plano.
 
 Uso:
     python orchestrator.py --imagen RUTA_IMAGEN
 """
 
+import asyncio
 import sys
 import os
-import importlib.util
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
 
+import invoice_reader
+from cola_recibos import (
+    ETAPA_GUARDAR, ETAPA_SINCRONIZAR, ETAPA_TERMINADO, ejecutar_etapas, obtener_cola
+)
+from invoice_store import obtener_store
+from invoices import sincronizar_pendientes
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -27,121 +42,339 @@ if os.name == 'nt':  # Windows
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
 
-def cargar_invoice_reader():
-    """Carga el módulo invoice_reader.py"""
-    try:
-        spec = importlib.util.spec_from_file_location("invoice_reader", "invoice_reader.py")
-        invoice_reader = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(invoice_reader)
-        return invoice_reader
-    except Exception as e:
-        print(f"Error cargando invoice_reader.py: {e}")
-        return None
-
-def cargar_invoices():
-    """Carga el módulo invoices.py"""
-    try:
-        from invoices import append_ultima_invoice_a_sheets
-        return append_ultima_invoice_a_sheets
-    except Exception as e:
-        print(f"Error cargando invoices.py: {e}")
-        return None
-
-def procesar_imagen_telegram(imagen_path):
+class InvoicePipeline:
     """
-    Procesar imagen recibida.
+    Flujo completo de un recibo: lector (invoice_reader), store y Google Sheets.
     
-    Args:
-        imagen_path: Ruta completa a la imagen
-        
-    Returns:
-        bool: True si todo el proceso fue exitoso
+    Se construye una vez por proceso y se reutiliza en cada imagen, así ni el
+    bot ni el endpoint HTTP vuelven a importar módulos por request.
     """
-    print("PROCESADOR DE IMAGEN")
-    print("=" * 50)
-    print(f"Imagen: {imagen_path}")
-    print(f"Inicio: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-    print()
     
-    # Verificar que la imagen existe
-    if not os.path.exists(imagen_path):
-        print(f"Error: Imagen no encontrada: {imagen_path}")
-        return False
+    def __init__(self, reader=None, store=None, sheet_id=None, credentials_path=None, cola=None):
+        self.reader = reader or invoice_reader
+        self.store = store or obtener_store()
+        self.cola = cola or obtener_cola()
+        self.sheet_id = sheet_id or os.getenv("GOOGLE_SHEET_ID")
+        self.credentials_path = credentials_path or os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json")
+        # Ruta -> última escritura en curso (las de una misma ruta van en orden)
+        self._archivando = {}
     
-    # PASO 1: Cargar módulos
-    print("PASO 1: Cargando módulos...")
-    print("-" * 30)
+    def archivar(self, imagen_path, imagen_bytes: bytes, trabajo_id: str = None):
+        """
+        Escribe la imagen en disco en segundo plano, fuera del camino de la
+        extracción (que usa los bytes en memoria). Debe llamarse desde el
+        event loop. Si la misma ruta se archiva de nuevo (ej: una versión más
+        grande de la foto), queda la última. Si la escritura falla se anota
+        en el trabajo de la cola (trabajo_id), que de otro modo no podría
+        reintentarse desde el archivo sin que nadie lo sepa.
+        """
+        anterior = self._archivando.get(imagen_path)
+        
+        async def escribir():
+            if anterior:
+                await anterior
+            try:
+                await asyncio.to_thread(escribir_archivo, imagen_path, imagen_bytes)
+            except Exception as e:
+                print(f"Error archivando {imagen_path}: {e}")
+                if trabajo_id:
+                    try:
+                        await asyncio.to_thread(self.cola.registrar_error_archivo, trabajo_id, str(e))
+                    except Exception as error_cola:
+                        print(f"Error registrando en la cola el fallo de archivo: {error_cola}")
+        
+        tarea = asyncio.create_task(escribir())
+        self._archivando[imagen_path] = tarea
+        
+        def terminar(_):
+            if self._archivando.get(imagen_path) is tarea:
+                del self._archivando[imagen_path]
+        
+        tarea.add_done_callback(terminar)
+        return tarea
     
-    invoice_reader = cargar_invoice_reader()
-    if not invoice_reader:
-        return False
+    def extraer(self, imagen_path):
+        return self.reader.leer_recibo(imagen_path)
     
-    subir_json_a_sheets = cargar_invoices()
-    if not subir_json_a_sheets:
-        return False
+    def nuevos(self, invoices):
+        """
+        Los invoices cuyo id todavía no está en el store. Una imagen repetida
+        (hit de la cache de extracciones) trae el id del registro que ya se
+        guardó, así que no se agrega de nuevo.
+        """
+        vistos = set()
+        resultado = []
+        for datos in invoices:
+            if datos["id"] in vistos or self.store.get(datos["id"]) is not None:
+                continue
+            vistos.add(datos["id"])
+            resultado.append(datos)
+        return resultado
     
-    print("OK - Módulos cargados exitosamente")
+    def guardar(self, datos):
+        try:
+            if self.nuevos([datos]):
+                self.store.append(datos)
+            return True
+        except Exception as e:
+            print(f"Error guardando en el store: {e}")
+            return False
     
-    # PASO 2: Procesar imagen y guardar en JSON
-    print("\nPASO 2: Procesando imagen...")
-    print("-" * 30)
+    def sincronizar(self):
+        if not self.sheet_id:
+            print("Error: GOOGLE_SHEET_ID no encontrada en variables de entorno")
+            print("Configura el archivo .env con GOOGLE_SHEET_ID=tu_id_aqui")
+            return False
+        return sincronizar_pendientes(self.sheet_id, self.credentials_path, self.store.ruta)
     
-    try:
-        # Leer la imagen y extraer datos
-        resultado = invoice_reader.leer_recibo(imagen_path)
+    def procesar(self, imagen_path):
+        """
+        Procesa una imagen: extrae, guarda y sincroniza.
         
-        if not resultado:
-            print("Error: No se pudieron extraer datos de la imagen")
-            return False
+        Args:
+            imagen_path: Ruta completa a la imagen
+            
+        Returns:
+            Tupla (resultado, sincronizado): los datos extraídos (None si no
+            se pudo extraer o guardar) y si la subida a Sheets terminó bien
+            (si no, queda pendiente en la cola)
+        """
+        # Verificar que la imagen existe
+        if not os.path.exists(imagen_path):
+            print(f"Error: Imagen no encontrada: {imagen_path}")
+            return None, False
         
-        # Guardar en JSON
-        if not invoice_reader.guardar_en_json(resultado):
-            print("Error: No se pudo guardar en JSON")
-            return False
+        trabajo = self.cola.encolar(imagen_path, origen="orchestrator", reclamar=True)
+        
+        # PASO 1: Procesar imagen y guardar en el store
+        print("PASO 1: Procesando imagen...")
+        print("-" * 30)
+        
+        try:
+            resultado = self.extraer(imagen_path)
+            
+            if not resultado:
+                print("Error: No se pudieron extraer datos de la imagen")
+                self.cola.fallar(trabajo["id"], "No se pudieron extraer datos de la imagen")
+                return None, False
+            self.cola.avanzar(trabajo["id"], ETAPA_GUARDAR, resultado)
             
-        print("OK - Imagen procesada y guardada en JSON")
+            if not self.guardar(resultado):
+                print("Error: No se pudo guardar en JSON")
+                self.cola.fallar(trabajo["id"], "No se pudo guardar en el store")
+                return None, False
+            self.cola.avanzar(trabajo["id"], ETAPA_SINCRONIZAR)
+                
+            print("OK - Imagen procesada y guardada en JSON")
+            
+        except Exception as e:
+            print(f"Error en procesamiento: {e}")
+            self.cola.fallar(trabajo["id"], str(e))
+            return None, False
         
-    except Exception as e:
-        print(f"Error en procesamiento: {e}")
-        return False
-    
-    # PASO 3: Subir a Google Sheets (solo última entrada)
-    print("\nPASO 3: Subiendo a Google Sheets...")
-    print("-" * 30)
+        # PASO 2: Subir a Google Sheets (entradas pendientes)
+        print("\nPASO 2: Subiendo a Google Sheets...")
+        print("-" * 30)
+        
+        sincronizado = False
+        try:
+            sincronizado = bool(self.sincronizar())
+            if sincronizado:
+                self.cola.avanzar(trabajo["id"], ETAPA_TERMINADO)
+                print("OK - Datos subidos a Google Sheets")
+            else:
+                # El recibo ya está guardado: el worker de la cola reintenta la subida
+                self.cola.fallar(trabajo["id"], "No se pudo subir a Google Sheets")
+                print("Aviso: No se pudo subir a Google Sheets, queda pendiente en la cola")
+            
+        except Exception as e:
+            self.cola.fallar(trabajo["id"], str(e))
+            print(f"Error en Google Sheets, queda pendiente en la cola: {e}")
+        
+        return resultado, sincronizado
     
-    try:
-        # Configuración de Google Sheets desde variables de entorno
-        sheet_id = os.getenv("GOOGLE_SHEET_ID")
-        credentials_path = os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json")
+    async def aprocesar(self, imagen_path, imagen_bytes: bytes = None):
+        """
+        Versión asíncrona de procesar: la extracción usa aleer_recibo y el
+        guardado y la sincronización (bloqueantes) corren en un hilo.
         
-        if not sheet_id:
-            print("Error: GOOGLE_SHEET_ID no encontrada en variables de entorno")
-            print("Configura el archivo .env con GOOGLE_SHEET_ID=tu_id_aqui")
-            return False
+        Args:
+            imagen_path: Ruta de la imagen
+            imagen_bytes: Contenido de la imagen ya en memoria; se extrae de
+                ahí y se archiva en imagen_path en segundo plano
         
-        if not subir_json_a_sheets(sheet_id, credentials_path):
-            print("Error: No se pudo subir a Google Sheets")
-            return False
+        Returns:
+            Diccionario con los datos extraídos (aunque la subida a Sheets
+            quede pendiente en la cola), o None si no se pudo extraer o guardar
+        """
+        if imagen_bytes is None and not os.path.exists(imagen_path):
+            print(f"Error: Imagen no encontrada: {imagen_path}")
+            return None
+        
+        trabajo = await asyncio.to_thread(self.cola.encolar, imagen_path, "orchestrator", True)
+        if imagen_bytes is not None:
+            self.archivar(imagen_path, imagen_bytes, trabajo["id"])
+        etapa, resultado = await ejecutar_etapas(self, self.cola, trabajo, imagen_bytes)
+        
+        if etapa == ETAPA_SINCRONIZAR:
+            # El recibo ya está guardado: el worker de la cola reintenta la subida
+            print("Aviso: No se pudo subir a Google Sheets, queda pendiente en la cola")
+        elif etapa != ETAPA_TERMINADO:
+            print(f"Error: el recibo quedó en la etapa '{etapa}' de la cola")
+            return None
+        
+        return resultado
+
+    async def _aextraer_trabajo(self, trabajo, imagen_bytes: bytes = None, ampliar=None):
+        try:
+            # Con tamaños más grandes disponibles, cada uno se prueba solo con
+            # el modelo rápido: una foto más grande cuesta menos que el modelo
+            # grande, que se usa recién con la foto más grande
+            rapido = range(1) if ampliar else None
+            datos = await self.reader.aleer_recibo(trabajo["archivo"], imagen_bytes, rapido)
+            while ampliar and (not datos or invoice_reader.validar_datos(datos)):
+                mayor = await ampliar()
+                if mayor is None:
+                    resto = range(1, len(invoice_reader.MODELOS_EXTRACCION))
+                    datos = await self.reader.aleer_recibo(trabajo["archivo"], imagen_bytes, resto) or datos
+                    break
+                imagen_bytes = mayor
+                print(f"Reintentando con una imagen más grande: {trabajo['archivo']}")
+                self.archivar(trabajo["archivo"], imagen_bytes, trabajo["id"])
+                datos = await self.reader.aleer_recibo(trabajo["archivo"], imagen_bytes, rapido) or datos
+        except Exception as e:
+            print(f"Error en procesamiento: {e}")
+            datos = None
+        if not datos:
+            await asyncio.to_thread(self.cola.fallar, trabajo["id"], "No se pudieron extraer datos de la imagen")
+            return None
+        await asyncio.to_thread(self.cola.avanzar, trabajo["id"], ETAPA_GUARDAR, datos)
+        return datos
+    
+    async def aprocesar_lote(self, imagenes, contenidos=None, ampliadores=None):
+        """
+        Procesa varias imágenes juntas (un álbum o una ráfaga de fotos):
+        extracción concurrente, una sola escritura al store y una sola
+        sincronización con Google Sheets.
+        
+        Args:
+            imagenes: Rutas de las imágenes
+            contenidos: Bytes de cada imagen ya en memoria, en el mismo orden
+                (opcional); se archivan en su ruta en segundo plano
+            ampliadores: Por imagen, None o una corrutina sin argumentos que
+                devuelve los bytes de una versión más grande (o None si no
+                hay); se usa cuando la extracción no pasa validar_datos
             
-        print("OK - Datos subidos a Google Sheets")
+        Returns:
+            Tupla (resultados, sincronizado): los datos extraídos de cada
+            imagen en el mismo orden (None si falló) y si la subida a Sheets
+            terminó bien (si no, queda pendiente en la cola)
+        """
+        contenidos = contenidos or [None] * len(imagenes)
+        ampliadores = ampliadores or [None] * len(imagenes)
+        trabajos = []
+        for imagen_path, imagen_bytes in zip(imagenes, contenidos):
+            if imagen_bytes is not None or os.path.exists(imagen_path):
+                trabajo = await asyncio.to_thread(self.cola.encolar, imagen_path, "orchestrator", True)
+                if imagen_bytes is not None:
+                    self.archivar(imagen_path, imagen_bytes, trabajo["id"])
+                trabajos.append(trabajo)
+            else:
+                print(f"Error: Imagen no encontrada: {imagen_path}")
+                trabajos.append(None)
+        
+        async def extraer(trabajo, imagen_bytes, ampliar):
+            return await self._aextraer_trabajo(trabajo, imagen_bytes, ampliar) if trabajo else None
+        
+        resultados = list(await asyncio.gather(*(
+            extraer(trabajo, imagen_bytes, ampliar)
+            for trabajo, imagen_bytes, ampliar in zip(trabajos, contenidos, ampliadores)
+        )))
+        extraidos = [(trabajo, datos) for trabajo, datos in zip(trabajos, resultados) if datos]
+        if not extraidos:
+            return resultados, False
         
-    except Exception as e:
-        print(f"Error en Google Sheets: {e}")
+        try:
+            await asyncio.to_thread(
+                lambda: self.store.append_many(self.nuevos([datos for _, datos in extraidos]))
+            )
+        except Exception as e:
+            print(f"Error guardando en el store: {e}")
+            for trabajo, _ in extraidos:
+                await asyncio.to_thread(self.cola.fallar, trabajo["id"], "No se pudo guardar en el store")
+            return [None] * len(resultados), False
+        for trabajo, _ in extraidos:
+            await asyncio.to_thread(self.cola.avanzar, trabajo["id"], ETAPA_SINCRONIZAR)
+        
+        try:
+            sincronizado = await asyncio.to_thread(self.sincronizar)
+        except Exception as e:
+            print(f"Error en Google Sheets: {e}")
+            sincronizado = False
+        for trabajo, _ in extraidos:
+            if sincronizado:
+                await asyncio.to_thread(self.cola.avanzar, trabajo["id"], ETAPA_TERMINADO)
+            else:
+                await asyncio.to_thread(self.cola.fallar, trabajo["id"], "No se pudo subir a Google Sheets")
+        if not sincronizado:
+            print("Aviso: No se pudo subir a Google Sheets, queda pendiente en la cola")
+        
+        return resultados, sincronizado
+
+def escribir_archivo(ruta, contenido: bytes):
+    # Escritura atómica: quien lea la ruta (ej: el worker de la cola) nunca ve un archivo a medias
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def obtener_pipeline():
+    """Devuelve el pipeline del proceso, creándolo la primera vez."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = InvoicePipeline()
+        return _pipeline
+
+def procesar_imagen_telegram(imagen_path):
+    """
+    Procesar imagen recibida.
+    
+    Args:
+        imagen_path: Ruta completa a la imagen
+        
+    Returns:
+        bool: True si todo el proceso fue exitoso (False también si el
+        recibo se guardó pero la subida a Sheets quedó pendiente)
+    """
+    print("PROCESADOR DE IMAGEN")
+    print("=" * 50)
+    print(f"Imagen: {imagen_path}")
+    print(f"Inicio: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+    print()
+    
+    pipeline = obtener_pipeline()
+    resultado, sincronizado = pipeline.procesar(imagen_path)
+    if not resultado:
         return False
     
     # RESUMEN FINAL
     print("\n" + "=" * 50)
-    print("PROCESO COMPLETADO EXITOSAMENTE")
+    print("PROCESO COMPLETADO EXITOSAMENTE" if sincronizado else "RECIBO GUARDADO, SUBIDA PENDIENTE")
     print("=" * 50)
     print(f"Imagen procesada: {os.path.basename(imagen_path)}")
     print(f"Total: {resultado.get('total', 'N/A')}")
     print(f"Fecha: {resultado.get('fecha', 'N/A')}")
     print(f"Receptor: {resultado.get('receptor', 'N/A')}")
-    print(f"JSON actualizado: docs/invoices/invoices.json")
-    print(f"Google Sheets sincronizado")
+    print(f"JSON actualizado: {pipeline.store.ruta}")
+    print("Google Sheets sincronizado" if sincronizado else "Google Sheets pendiente de sincronizar (queda en la cola)")
     print(f"Finalizacion: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
     
-    return True
+    return sincronizado
 
 def main():
     """Función principal del orquestador"""
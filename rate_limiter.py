@@ -0,0 +1,335 @@
+"""
+Planificador de cuotas compartido para OpenAI y Google Sheets.
+
+Cada servicio tiene cubetas de fichas (token buckets) que se recargan al
+ritmo de su cuota: solicitudes y tokens por minuto para OpenAI, escrituras
+por minuto para Sheets. Antes de cada llamada se espera a que haya fichas,
+así una ráfaga (30 recibos reenviados de golpe) se reparte dentro de la
+cuota en lugar de chocar con 429. Si igual llega un 429 (u otro error
+transitorio), la llamada se reintenta con backoff con jitter respetando
+Retry-After, y la cubeta del servicio se vacía para frenar al resto.
+
+Las escrituras en Sheets (append_rows) no son idempotentes: solo se
+reintentan con 429 o si la conexión no llegó a establecerse, nunca con un
+5xx, donde la fila puede haberse agregado igual.
+
+Hay dos carriles: el interactivo (bot, API) y el de backfill (ingestas,
+batch). El backfill no puede usar la fracción RATE_RESERVA_INTERACTIVA de
+cada cubeta, que queda libre para los recibos que alguien está esperando.
+
+    with carril(CARRIL_BACKFILL):
+        ...  # todo lo que se llame desde aquí (incluidas tareas asyncio) usa ese carril
+
+Configuración (.env):
+    OPENAI_SOLICITUDES_POR_MINUTO=500
+    OPENAI_TOKENS_POR_MINUTO=30000
+    SHEETS_ESCRITURAS_POR_MINUTO=60
+    RATE_RESERVA_INTERACTIVA=0.25
+    RATE_MAX_REINTENTOS=6
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+
+# Cargar variables de entorno (la configuración se lee al importar)
+load_dotenv()
+
+OPENAI_SOLICITUDES_POR_MINUTO = float(os.getenv("OPENAI_SOLICITUDES_POR_MINUTO", "500"))
+OPENAI_TOKENS_POR_MINUTO = float(os.getenv("OPENAI_TOKENS_POR_MINUTO", "30000"))
+SHEETS_ESCRITURAS_POR_MINUTO = float(os.getenv("SHEETS_ESCRITURAS_POR_MINUTO", "60"))
+RATE_RESERVA_INTERACTIVA = float(os.getenv("RATE_RESERVA_INTERACTIVA", "0.25"))
+RATE_MAX_REINTENTOS = int(os.getenv("RATE_MAX_REINTENTOS", "6"))
+
+CARRIL_INTERACTIVO = "interactivo"
+CARRIL_BACKFILL = "backfill"
+
+_carril_actual = contextvars.ContextVar("carril", default=CARRIL_INTERACTIVO)
+
+# Códigos HTTP que vale la pena reintentar
+CODIGOS_TRANSITORIOS = (429, 500, 502, 503, 504)
+# Para escrituras no idempotentes: solo el rechazo explícito por cuota
+CODIGOS_SIN_APLICAR = (429,)
+
+
+@contextmanager
+def carril(nombre: str):
+    """Ejecuta el bloque en el carril indicado (interactivo o backfill)."""
+    token = _carril_actual.set(nombre)
+    try:
+        yield
+    finally:
+        _carril_actual.reset(token)
+
+
+def carril_actual() -> str:
+    return _carril_actual.get()
+
+
+def codigo_estado(error):
+    """Código HTTP de un error de openai (status_code) o de gspread (response.status_code)."""
+    codigo = getattr(error, "status_code", None)
+    if codigo is None:
+        codigo = getattr(getattr(error, "response", None), "status_code", None)
+    return codigo
+
+
+def conexion_no_establecida(error) -> bool:
+    """
+    True si el error de requests ocurrió antes de enviar el request (timeout
+    al conectar, DNS, conexión rechazada): el servidor no pudo aplicarlo.
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        causa = error.args[0] if error.args else None
+        return isinstance(causa, NewConnectionError) or isinstance(getattr(causa, "reason", None), NewConnectionError)
+    return False
+
+
+def retry_after(error):
+    """
+    Segundos indicados por el servidor en Retry-After / retry-after-ms, o None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        milisegundos = headers.get("retry-after-ms")
+        if milisegundos:
+            return float(milisegundos) / 1000
+        valor = headers.get("retry-after")
+        if not valor:
+            return None
+        try:
+            return float(valor)
+        except ValueError:
+            fecha = parsedate_to_datetime(valor)
+            return max(0.0, (fecha - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Cubeta de fichas que se recarga a `por_minuto` fichas por minuto.
+    No es thread-safe: la protege el LimitadorServicio que la contiene.
+    """
+
+    def __init__(self, por_minuto: float, capacidad: float = None):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = capacidad or por_minuto
+        self.disponible = self.capacidad
+        self._actualizado = time.monotonic()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self.disponible = min(self.capacidad, self.disponible + (ahora - self._actualizado) * self.tasa)
+        self._actualizado = ahora
+
+    def espera(self, cantidad: float, reserva: float = 0.0) -> float:
+        """
+        Segundos hasta que haya `cantidad` fichas dejando `reserva` sin tocar.
+        """
+        self._recargar()
+        # Un pedido más grande que la cubeta se limita para que algún día entre: con la
+        # reserva incluida nunca puede exigir más que la capacidad (disponible no la supera)
+        necesarias = max(0.0, min(cantidad, self.capacidad - reserva)) + reserva
+        if self.disponible >= necesarias:
+            return 0.0
+        return (necesarias - self.disponible) / self.tasa
+
+    def tomar(self, cantidad: float):
+        self.disponible -= min(cantidad, self.capacidad)
+
+    def vaciar(self, segundos: float):
+        """Deja la cubeta en deuda: la próxima ficha aparece recién dentro de `segundos`."""
+        self._recargar()
+        self.disponible = min(self.disponible, 1 - segundos * self.tasa)
+
+
+class LimitadorServicio:
+    """
+    Cuotas de un servicio (una cubeta de solicitudes y opcionalmente una de
+    tokens) más reintentos para sus llamadas. Seguro entre hilos y tareas.
+    """
+
+    def __init__(self, nombre: str, solicitudes_por_minuto: float, tokens_por_minuto: float = None,
+                 transitorios=(), max_reintentos: int = RATE_MAX_REINTENTOS,
+                 codigos_transitorios=CODIGOS_TRANSITORIOS, es_transitorio=None):
+        """
+        Args:
+            nombre: Nombre del servicio, para los mensajes
+            solicitudes_por_minuto: Cuota de solicitudes
+            tokens_por_minuto: Cuota de tokens (None si el servicio no la tiene)
+            transitorios: Excepciones sin código HTTP que también se reintentan (ej: errores de conexión)
+            max_reintentos: Reintentos por llamada antes de propagar el error
+            codigos_transitorios: Códigos HTTP que se reintentan
+            es_transitorio: Función opcional error -> bool para reintentar otros errores
+        """
+        self.nombre = nombre
+        self.solicitudes = TokenBucket(solicitudes_por_minuto)
+        self.tokens = TokenBucket(tokens_por_minuto) if tokens_por_minuto else None
+        self.transitorios = tuple(transitorios)
+        self.max_reintentos = max_reintentos
+        self.codigos_transitorios = tuple(codigos_transitorios)
+        self.es_transitorio = es_transitorio
+        self._lock = threading.Lock()
+        self._metricas = {"llamadas": 0, "esperas": 0, "segundos_esperando": 0.0, "reintentos": 0, "rate_limits": 0}
+
+    def _intentar(self, tokens: float) -> float:
+        """Toma las fichas si alcanzan (devuelve 0) o devuelve cuánto esperar."""
+        backfill = _carril_actual.get() == CARRIL_BACKFILL
+        cubetas = [(self.solicitudes, 1)]
+        if self.tokens and tokens:
+            cubetas.append((self.tokens, tokens))
+        with self._lock:
+            espera = max(
+                cubeta.espera(cantidad, RATE_RESERVA_INTERACTIVA * cubeta.capacidad if backfill else 0.0)
+                for cubeta, cantidad in cubetas
+            )
+            if espera <= 0:
+                for cubeta, cantidad in cubetas:
+                    cubeta.tomar(cantidad)
+                self._metricas["llamadas"] += 1
+            return espera
+
+    def _registrar_espera(self, segundos: float):
+        with self._lock:
+            self._metricas["esperas"] += 1
+            self._metricas["segundos_esperando"] += segundos
+
+    def adquirir(self, tokens: float = 0):
+        """Bloquea hasta que la cuota permita una llamada de `tokens` tokens."""
+        while True:
+            espera = self._intentar(tokens)
+            if espera <= 0:
+                return
+            self._registrar_espera(espera)
+            time.sleep(espera)
+
+    async def aadquirir(self, tokens: float = 0):
+        """Versión asíncrona de adquirir: espera sin bloquear el event loop."""
+        while True:
+            espera = self._intentar(tokens)
+            if espera <= 0:
+                return
+            self._registrar_espera(espera)
+            await asyncio.sleep(espera)
+
+    def _espera_reintento(self, error, intento: int):
+        """
+        Segundos a esperar antes de reintentar, o None si el error no es transitorio
+        o se agotaron los reintentos.
+        """
+        codigo = codigo_estado(error)
+        transitorio = (
+            codigo in self.codigos_transitorios
+            or isinstance(error, self.transitorios)
+            or (self.es_transitorio is not None and self.es_transitorio(error))
+        )
+        if not transitorio:
+            return None
+        if intento >= self.max_reintentos:
+            return None
+
+        indicado = retry_after(error)
+        if indicado is not None:
+            espera = indicado + random.uniform(0, 0.1 * indicado + 0.5)
+        else:
+            # Backoff exponencial con jitter ("equal jitter"), tope 64s
+            tope = min(2 ** intento, 64)
+            espera = tope / 2 + random.uniform(0, tope / 2)
+
+        with self._lock:
+            self._metricas["reintentos"] += 1
+            if codigo == 429:
+                self._metricas["rate_limits"] += 1
+                # Frenar también a las demás llamadas del servicio
+                self.solicitudes.vaciar(espera)
+        print(f"{self.nombre}: error transitorio ({codigo or type(error).__name__}), reintentando en {espera:.1f}s...")
+        return espera
+
+    def ejecutar(self, funcion, *args, tokens: float = 0, **kwargs):
+        """
+        Llama a `funcion` dentro de la cuota, reintentando errores transitorios.
+        """
+        for intento in range(self.max_reintentos + 1):
+            self.adquirir(tokens)
+            try:
+                return funcion(*args, **kwargs)
+            except Exception as e:
+                espera = self._espera_reintento(e, intento)
+                if espera is None:
+                    raise
+                time.sleep(espera)
+
+    async def aejecutar(self, funcion, *args, tokens: float = 0, **kwargs):
+        """
+        Versión asíncrona de ejecutar: `funcion` devuelve un awaitable.
+        """
+        for intento in range(self.max_reintentos + 1):
+            await self.aadquirir(tokens)
+            try:
+                return await funcion(*args, **kwargs)
+            except Exception as e:
+                espera = self._espera_reintento(e, intento)
+                if espera is None:
+                    raise
+                await asyncio.sleep(espera)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._metricas)
+            m["solicitudes_disponibles"] = round(max(0.0, self.solicitudes.disponible), 1)
+            if self.tokens:
+                m["tokens_disponibles"] = round(max(0.0, self.tokens.disponible), 1)
+        m["segundos_esperando"] = round(m["segundos_esperando"], 2)
+        return m
+
+
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+
+def _crear_limitador(servicio: str):
+    if servicio == "openai":
+        import openai
+        return LimitadorServicio(
+            "OpenAI", OPENAI_SOLICITUDES_POR_MINUTO, OPENAI_TOKENS_POR_MINUTO,
+            transitorios=(openai.APIConnectionError,),
+        )
+    if servicio == "sheets":
+        # append_rows no es idempotente: un 5xx puede haber escrito las filas igual
+        return LimitadorServicio(
+            "Google Sheets", SHEETS_ESCRITURAS_POR_MINUTO,
+            codigos_transitorios=CODIGOS_SIN_APLICAR, es_transitorio=conexion_no_establecida,
+        )
+    raise ValueError(f"Servicio desconocido: {servicio}")
+
+
+def obtener_limitador(servicio: str) -> LimitadorServicio:
+    """
+    Limitador compartido del proceso para "openai" o "sheets".
+    """
+    with _limitadores_lock:
+        if servicio not in _limitadores:
+            _limitadores[servicio] = _crear_limitador(servicio)
+        return _limitadores[servicio]
+
+
+def metricas() -> dict:
+    """Llamadas, esperas y reintentos de cada servicio usado en el proceso."""
+    with _limitadores_lock:
+        limitadores = dict(_limitadores)
+    return {servicio: limitador.metricas() for servicio, limitador in limitadores.items()}
@@ -0,0 +1,101 @@
+"""
+Sesión de Google Sheets compartida por todo el proceso.
+
+Antes cada sincronización volvía a leer credentials.json, ejecutaba
+gspread.authorize, abría la hoja con open_by_key y descargaba toda la hoja
+(get_all_values) solo para saber si tenía encabezados. Acá el cliente y las
+hojas se cachean, el token se refresca solo cuando vence y el estado de los
+encabezados se comprueba una vez con row_values(1), así que un append en
+régimen normal cuesta un único request.
+"""
+
+import threading
+
+import gspread
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+
+SCOPES = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+
+class SheetsSession:
+    """
+    Cliente autorizado de gspread y hojas abiertas, reutilizables entre llamadas.
+    """
+
+    def __init__(self, credentials_path: str = "credentials.json"):
+        self.credentials_path = credentials_path
+        self._lock = threading.RLock()
+        self._creds = None
+        self._client = None
+        self._hojas = {}
+        self._con_encabezados = set()
+
+    def cliente(self):
+        """Devuelve el cliente autorizado, refrescando el token si venció."""
+        with self._lock:
+            if self._client is None:
+                self._creds = Credentials.from_service_account_file(self.credentials_path, scopes=SCOPES)
+                self._client = gspread.authorize(self._creds)
+            elif self._creds.expired:
+                self._creds.refresh(Request())
+            return self._client
+
+    def hoja(self, sheet_id: str):
+        """Devuelve la primera hoja del documento, abriéndola solo la primera vez."""
+        with self._lock:
+            sheet = self._hojas.get(sheet_id)
+            if sheet is None:
+                sheet = self.cliente().open_by_key(sheet_id).sheet1
+                self._hojas[sheet_id] = sheet
+                print(f"Hoja abierta: {sheet.title}")
+            else:
+                # Mantener el token vigente aunque la hoja ya esté abierta
+                self.cliente()
+            return sheet
+
+    def asegurar_encabezados(self, sheet_id: str, encabezados):
+        """
+        Escribe los encabezados si la hoja está vacía. Se consulta una sola
+        vez por hoja y con row_values(1) en lugar de descargar toda la hoja.
+        """
+        with self._lock:
+            if sheet_id in self._con_encabezados:
+                return
+            sheet = self.hoja(sheet_id)
+            if not sheet.row_values(1):
+                sheet.append_row(encabezados)
+                print("Encabezados agregados")
+            self._con_encabezados.add(sheet_id)
+
+    def invalidar(self, sheet_id: str = None):
+        """
+        Descarta la hoja cacheada (o todo, si no se indica) para que la
+        próxima llamada la vuelva a abrir. Usar después de un error que no
+        sea de cuota.
+        """
+        with self._lock:
+            if sheet_id is None:
+                self._client = None
+                self._creds = None
+                self._hojas.clear()
+                self._con_encabezados.clear()
+            else:
+                self._hojas.pop(sheet_id, None)
+                self._con_encabezados.discard(sheet_id)
+
+
+_sesiones = {}
+_sesiones_lock = threading.Lock()
+
+
+def obtener_sesion(credentials_path: str = "credentials.json") -> SheetsSession:
+    """
+    Devuelve la sesión del proceso para el archivo de credenciales indicado.
+    """
+    with _sesiones_lock:
+        sesion = _sesiones.get(credentials_path)
+        if sesion is None:
+            sesion = SheetsSession(credentials_path)
+            _sesiones[credentials_path] = sesion
+        return sesion
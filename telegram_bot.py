@@ -0,0 +1,530 @@
+"""
+Bot de Telegram para procesar recibos automáticamente.
+
+Este archivo contiene toda la lógica del bot de Telegram que escucha mensajes,
+procesa imágenes de recibos y guarda los datos extraídos.
+
+Modos:
+    - Long polling: python telegram_bot.py [TOKEN] (o telegram-bot.py)
+    - Webhook: la app FastAPI de main.py recibe los updates en
+      /api/v1/telegram/webhook cuando TELEGRAM_WEBHOOK_URL está configurada,
+      y comparte el pipeline y el worker de la cola con /upload/file.
+
+TELEGRAM_API_BASE_URL / TELEGRAM_API_BASE_FILE_URL apuntan el bot a otro
+servidor de la Bot API (uno local, o un stub para reproducir updates grabados).
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from telegram import Update
+from telegram.constants import ChatAction
+from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from dotenv import load_dotenv
+
+from cola_recibos import drenar
+from extraction_cache import obtener_cache
+from helpers.image_preprocess import metricas as metricas_imagenes
+from helpers.local_ocr import metricas as metricas_ocr
+from invoice_reader import metricas_enrutamiento, metricas_parseo
+from invoice_store import obtener_store
+from orchestrator import obtener_pipeline
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configurar logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+    handlers=[
+        logging.FileHandler('telegram_bot.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo por recibo (o por lote de fotos, que se extraen a la vez)
+ORCHESTRATOR_TIMEOUT = float(os.getenv("ORCHESTRATOR_TIMEOUT", "120"))
+# Fotos del mismo chat que llegan con menos de esta separación se procesan juntas
+TELEGRAM_VENTANA_LOTE = float(os.getenv("TELEGRAM_VENTANA_LOTE", "1.5"))
+# Un lote no espera más que esto desde su primera foto, ni junta más de TELEGRAM_MAX_LOTE
+TELEGRAM_ESPERA_MAXIMA_LOTE = float(os.getenv("TELEGRAM_ESPERA_MAXIMA_LOTE", "10"))
+TELEGRAM_MAX_LOTE = int(os.getenv("TELEGRAM_MAX_LOTE", "20"))
+# Píxeles mínimos (ancho x alto) para leer bien un recibo: se descarga el PhotoSize
+# más chico que los alcanza, y uno más grande solo si la extracción no valida
+TELEGRAM_MIN_PIXELES = int(os.getenv("TELEGRAM_MIN_PIXELES", "500000"))
+# Servidor de la Bot API (vacío usa api.telegram.org); el token se agrega al final
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "")
+TELEGRAM_API_BASE_FILE_URL = os.getenv("TELEGRAM_API_BASE_FILE_URL", "")
+# Correr el worker de la cola persistente dentro del bot (0 si corre aparte con cola_recibos.py)
+COLA_WORKER_EN_BOT = os.getenv("COLA_WORKER_EN_BOT", "1") not in ("0", "false", "no")
+
+def tamanos_a_probar(photo_sizes, min_pixeles: int = TELEGRAM_MIN_PIXELES):
+    """
+    Ordena los PhotoSize de una foto para descargarlos: primero el más chico
+    con al menos min_pixeles, después los más grandes en orden creciente.
+    Si ninguno alcanza el mínimo, solo el más grande.
+    """
+    ordenados = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    for indice, size in enumerate(ordenados):
+        if size.width * size.height >= min_pixeles:
+            return ordenados[indice:]
+    return ordenados[-1:]
+
+class TelegramBot:
+    """
+    Bot de Telegram para recibir imágenes de recibos y procesarlas automáticamente.
+    """
+    
+    def __init__(self, token: str, webhook: bool = False):
+        """
+        Args:
+            token: Token del bot de Telegram
+            webhook: Si es True no se crea el updater de long polling; los
+                updates llegan por procesar_update (ver app/api/telegram.py)
+        """
+        self.token = token
+        # concurrent_updates: varias fotos se procesan a la vez en lugar de en fila
+        builder = Application.builder().token(token).concurrent_updates(True)
+        if TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(TELEGRAM_API_BASE_URL)
+        if TELEGRAM_API_BASE_FILE_URL:
+            builder = builder.base_file_url(TELEGRAM_API_BASE_FILE_URL)
+        if webhook:
+            builder = builder.updater(None)
+        self.app = builder.build()
+        # Lotes de fotos pendientes por chat (ver agregar_al_lote)
+        self.lotes = {}
+        self.tareas_lotes = set()
+        # Descargas de fotos: cuántas, bytes y reintentos con un tamaño más grande
+        self.descargas = {"fotos": 0, "bytes": 0, "ampliaciones": 0}
+        
+        # Configurar handlers
+        self.app.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))
+        self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
+        self.app.add_handler(MessageHandler(filters.Document.ALL, self.handle_document))
+        
+    async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Maneja las fotos recibidas en el chat.
+        
+        La foto se descarga en memoria y se suma al lote del chat; el lote (un
+        álbum o varias fotos seguidas) se procesa junto y se responde con un
+        único resumen (ver procesar_lote). El archivo en docs/invoices se
+        escribe en segundo plano mientras se extraen los datos.
+        """
+        user = update.effective_user
+        chat_id = update.effective_chat.id
+        
+        logger.info(f"Foto recibida de {user.username} ({user.id}) en chat {chat_id}")
+        
+        try:
+            # Tamaño más chico que alcanza para leer el recibo (o la imagen enviada como documento)
+            if update.message.photo:
+                tamanos = tamanos_a_probar(update.message.photo)
+                file_id = tamanos[0].file_id
+            else:
+                tamanos = []
+                file_id = update.message.document.file_id
+            
+            # Crear nombre único para el archivo (las fotos de un álbum llegan en el mismo segundo)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"recibo_telegram_{timestamp}_{user.id}_{update.message.message_id}.jpg"
+            file_path = os.path.join("docs/invoices", filename)
+            
+            # Descargar a memoria: la extracción no espera al disco
+            contenido = await self.descargar(context, file_id)
+            
+            logger.info(f"Imagen descargada ({len(contenido)} bytes), se archivará en: {file_path}")
+            
+            ampliar = self._ampliador(context, tamanos[1:]) if len(tamanos) > 1 else None
+            self.agregar_al_lote(chat_id, file_path, update.message, contenido, ampliar)
+                
+        except Exception as e:
+            logger.error(f"Error procesando foto: {e}")
+            await update.message.reply_text(
+                f"❌ Error procesando la imagen: {str(e)}"
+            )
+    
+    async def descargar(self, context: ContextTypes.DEFAULT_TYPE, file_id: str) -> bytes:
+        file = await context.bot.get_file(file_id)
+        contenido = bytes(await file.download_as_bytearray())
+        self.descargas["fotos"] += 1
+        self.descargas["bytes"] += len(contenido)
+        return contenido
+    
+    def _ampliador(self, context: ContextTypes.DEFAULT_TYPE, tamanos: list):
+        """
+        Corrutina que descarga el siguiente PhotoSize más grande en cada
+        llamada (None cuando no quedan), para reintentar una extracción que
+        no pasó la validación.
+        """
+        pendientes = list(tamanos)
+        
+        async def ampliar():
+            if not pendientes:
+                return None
+            size = pendientes.pop(0)
+            logger.info(f"Extracción no válida, descargando la foto en {size.width}x{size.height}")
+            self.descargas["ampliaciones"] += 1
+            return await self.descargar(context, size.file_id)
+        
+        return ampliar
+    
+    def agregar_al_lote(self, chat_id: int, file_path: str, message, contenido: bytes = None, ampliar=None):
+        """
+        Suma una imagen al lote pendiente del chat y reprograma su envío.
+        
+        El lote se procesa cuando pasan TELEGRAM_VENTANA_LOTE segundos sin
+        fotos nuevas del chat (las de un álbum, media_group_id, llegan juntas),
+        o a los TELEGRAM_ESPERA_MAXIMA_LOTE segundos de la primera foto.
+        """
+        loop = asyncio.get_running_loop()
+        lote = self.lotes.get(chat_id)
+        if lote is None:
+            lote = {"imagenes": [], "contenidos": [], "ampliadores": [], "mensajes": [],
+                    "inicio": loop.time(), "tarea": None}
+            self.lotes[chat_id] = lote
+        lote["imagenes"].append(file_path)
+        lote["contenidos"].append(contenido)
+        lote["ampliadores"].append(ampliar)
+        lote["mensajes"].append(message)
+        
+        if lote["tarea"]:
+            lote["tarea"].cancel()
+        restante = lote["inicio"] + TELEGRAM_ESPERA_MAXIMA_LOTE - loop.time()
+        if len(lote["imagenes"]) >= TELEGRAM_MAX_LOTE:
+            espera = 0
+        else:
+            espera = max(0, min(TELEGRAM_VENTANA_LOTE, restante))
+        lote["tarea"] = asyncio.create_task(self._procesar_lote_despues(chat_id, lote, espera))
+        self.tareas_lotes.add(lote["tarea"])
+        lote["tarea"].add_done_callback(self.tareas_lotes.discard)
+    
+    async def _procesar_lote_despues(self, chat_id: int, lote: dict, espera: float):
+        await asyncio.sleep(espera)
+        # Desde acá las fotos nuevas del chat abren otro lote
+        if self.lotes.get(chat_id) is lote:
+            del self.lotes[chat_id]
+        lote["tarea"] = None
+        await self.procesar_lote(lote["imagenes"], lote["mensajes"], lote["contenidos"], lote["ampliadores"])
+    
+    async def procesar_lote(self, imagenes: list, mensajes: list, contenidos: list = None, ampliadores: list = None):
+        """
+        Procesa las imágenes de un lote (extracción concurrente, un solo
+        guardado y una sola sincronización) y responde con un resumen.
+        """
+        ultimo = mensajes[-1]
+        try:
+            await ultimo.chat.send_action(ChatAction.TYPING)
+            resultados, sincronizado = await self.llamar_orchestrator_lote(imagenes, contenidos, ampliadores)
+            
+            lineas = []
+            for numero, datos in enumerate(resultados, 1):
+                if datos:
+                    lineas.append(f"✅ {numero}. ${datos.get('total', '?')} - {datos.get('receptor') or 'sin receptor'}")
+                else:
+                    lineas.append(f"❌ {numero}. No se pudo leer el recibo")
+            procesados = sum(1 for datos in resultados if datos)
+            
+            if procesados == 0:
+                encabezado = "❌ Error procesando " + ("el recibo." if len(imagenes) == 1 else "los recibos.")
+                pie = "Revisa los logs para más detalles."
+            else:
+                encabezado = f"✅ {procesados} de {len(imagenes)} recibos procesados!"
+                if sincronizado:
+                    pie = "📊 Los datos han sido agregados a Google Sheets automáticamente."
+                else:
+                    pie = "⏳ Los datos quedaron guardados; la subida a Google Sheets se reintentará."
+            await ultimo.reply_text(encabezado + "\n\n" + "\n".join(lineas) + "\n\n" + pie)
+            
+        except Exception as e:
+            logger.error(f"Error procesando lote: {e}")
+            await ultimo.reply_text(f"❌ Error procesando las imágenes: {str(e)}")
+    
+    async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Maneja los mensajes de texto recibidos.
+        """
+        user = update.effective_user
+        chat_id = update.effective_chat.id
+        text = update.message.text
+        
+        logger.info(f"Mensaje de texto de {user.username} ({user.id}): {text}")
+        
+        # Respuestas automáticas
+        if text.lower() in ['hola', 'hi', 'hello']:
+            await update.message.reply_text(
+                "¡Hola! 👋\n\n"
+                "Soy tu asistente de recibos. Envíame una foto de tu recibo "
+                "y yo extraeré automáticamente:\n"
+                "💰 Total\n"
+                "📅 Fecha\n"
+                "👤 Receptor\n\n"
+                "💳 Cuenta Origen\n"
+                "🔑 Id Transaccion\n"
+                "¡Pruébalo enviando una imagen!"
+            )
+        elif text.lower() in ['ayuda', 'help']:
+            await update.message.reply_text(
+                "🤖 **Comandos disponibles:**\n\n"
+                "📸 Envía una **foto** de tu recibo\n"
+                "📄 Envía un **documento** (imagen)\n"
+                "💬 Escribe 'hola' para saludar\n"
+                "❓ Escribe 'ayuda' para ver este mensaje\n"
+                "📊 Escribe 'estado' para ver estadísticas\n\n"
+                "¡Todo se procesa automáticamente!"
+            )
+        elif text.lower() == 'estado':
+            stats = await self.get_stats()
+            await update.message.reply_text(stats)
+        else:
+            await update.message.reply_text(
+                "👋 ¡Hola! Para procesar un recibo, envíame una foto del mismo.\n"
+                "Escribe 'ayuda' si necesitas más información."
+            )
+    
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Maneja documentos/archivos recibidos.
+        """
+        user = update.effective_user
+        document = update.message.document
+        
+        logger.info(f"Documento recibido de {user.username}: {document.file_name}")
+        
+        # Verificar si es una imagen
+        if document.mime_type and document.mime_type.startswith('image/'):
+            await self.handle_photo(update, context)
+        else:
+            await update.message.reply_text(
+                "📄 Solo puedo procesar imágenes de recibos.\n"
+                "Por favor envía una foto o imagen."
+            )
+    
+    async def llamar_orchestrator_lote(self, imagenes: list, contenidos: list = None, ampliadores: list = None):
+        """
+        Procesa un lote de imágenes con el pipeline asíncrono del orchestrator.
+        
+        Corre en el mismo event loop del bot: el cliente de OpenAI y la
+        sesión de Sheets quedan cargados entre fotos y las imágenes del lote
+        se extraen a la vez (hasta OPENAI_MAX_CONCURRENCIA llamadas al modelo).
+        
+        Returns:
+            Tupla (resultados, sincronizado) como InvoicePipeline.aprocesar_lote
+        """
+        try:
+            resultados, sincronizado = await asyncio.wait_for(
+                obtener_pipeline().aprocesar_lote(imagenes, contenidos, ampliadores),
+                timeout=ORCHESTRATOR_TIMEOUT
+            )
+            
+            for file_path, datos in zip(imagenes, resultados):
+                if datos:
+                    logger.info(f"Orchestrator ejecutado exitosamente para: {file_path}")
+                else:
+                    logger.error(f"Error en orchestrator procesando: {file_path}")
+            return resultados, sincronizado
+                
+        except asyncio.TimeoutError:
+            logger.error("Timeout ejecutando orchestrator")
+        except Exception as e:
+            logger.error(f"Error llamando al orchestrator: {e}")
+        return [None] * len(imagenes), False
+    
+    async def get_stats(self):
+        """
+        Obtiene estadísticas del sistema.
+        """
+        try:
+            store = obtener_store()
+            stats = "📊 **Estadísticas del Sistema**\n\n"
+            
+            if store.estadisticas is not None:
+                # Índice incremental: no recorre imágenes ni registros
+                resumen = store.estadisticas.resumen()
+                stats += f"📄 Recibos registrados: {resumen['registros']} (hoy: {resumen['hoy']})\n"
+                if resumen["ultimo_procesado"]:
+                    ultimo = datetime.fromtimestamp(resumen["ultimo_procesado"]).strftime('%d/%m/%Y %H:%M')
+                    stats += f"🕑 Último recibo: {ultimo}\n"
+                if resumen["pendientes"]:
+                    stats += (
+                        f"⏳ Pendientes de subir a Sheets: {resumen['pendientes']} "
+                        f"(hace {resumen['retraso_sync_segundos'] // 60} min)\n"
+                    )
+                else:
+                    stats += "✅ Todo subido a Google Sheets\n"
+                for titulo, clave in (("💳 Por cuenta", "cuentas"), ("👤 Principales receptores", "receptores")):
+                    if resumen[clave]:
+                        detalle = ", ".join(
+                            f"{fila['clave']} {fila['cantidad']} (${fila['total']:,.2f})" for fila in resumen[clave]
+                        )
+                        stats += f"{titulo}: {detalle}\n"
+            else:
+                stats += f"📄 Registros en JSON: {store.count()}\n"
+            
+            cache = obtener_cache()
+            if cache:
+                cache_stats = cache.stats()
+                stats += (
+                    f"♻️ Cache de extracciones: {cache_stats['hits']} hits / "
+                    f"{cache_stats['misses']} misses ({cache_stats['entradas']} entradas)\n"
+                )
+            
+            imagenes_stats = metricas_imagenes()
+            if imagenes_stats["imagenes"]:
+                stats += (
+                    f"📉 Imágenes enviadas al modelo: -{imagenes_stats['ahorro_pct']}% bytes, "
+                    f"{imagenes_stats['ms_modelo_promedio']} ms promedio por llamada\n"
+                )
+            
+            parseo = metricas_parseo()
+            if parseo["respuestas"]:
+                stats += (
+                    f"🧩 Respuestas del modelo: {parseo['json_directo']} JSON directo, "
+                    f"{parseo['json_tolerante']} tolerante, {parseo['reparaciones_exitosas']}/{parseo['reparaciones']} reparadas, "
+                    f"{parseo['fallos_parseo']} perdidas\n"
+                )
+            
+            enrutamiento = metricas_enrutamiento()
+            if enrutamiento["recibos"]:
+                stats += (
+                    f"🔀 Escalados al modelo grande: {100 * enrutamiento['tasa_escalamiento']:.0f}% "
+                    f"de {enrutamiento['recibos']} recibos, costo estimado US$ {enrutamiento['costo_usd']:.4f}\n"
+                )
+            
+            ocr_stats = metricas_ocr()
+            if ocr_stats["intentos"]:
+                stats += (
+                    f"🔎 OCR local: {ocr_stats['aciertos']}/{ocr_stats['intentos']} recibos sin OpenAI, "
+                    f"{ocr_stats['ms_promedio']} ms promedio\n"
+                )
+
+            if self.descargas["fotos"]:
+                stats += (
+                    f"📥 Descargas: {self.descargas['fotos']} fotos, "
+                    f"{self.descargas['bytes'] // self.descargas['fotos'] // 1024} KB promedio, "
+                    f"{self.descargas['ampliaciones']} reintentos con un tamaño mayor\n"
+                )
+
+            stats += f"🕒 Última actualización: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"
+            
+            return stats
+            
+        except Exception as e:
+            return f"❌ Error obteniendo estadísticas: {e}"
+    
+    async def start_bot(self):
+        """
+        Inicia el bot de Telegram.
+        """
+        logger.info("Iniciando bot de Telegram...")
+        await self.app.initialize()
+        await self.app.start()
+        await self.app.updater.start_polling()
+        
+        logger.info("Bot de Telegram iniciado. Escuchando mensajes...")
+        
+        # Worker de la cola persistente: completa los recibos que quedaron a medio camino
+        worker = asyncio.create_task(drenar(obtener_pipeline())) if COLA_WORKER_EN_BOT else None
+        
+        try:
+            # Mantener el bot ejecutándose
+            await asyncio.Future()  # Run forever
+        except KeyboardInterrupt:
+            logger.info("Deteniendo bot...")
+        finally:
+            if worker:
+                worker.cancel()
+            await self.app.updater.stop()
+            await self.app.stop()
+            await self.app.shutdown()
+
+    async def iniciar_webhook(self, url: str = None, secret_token: str = None):
+        """
+        Inicia el bot en modo webhook (sin long polling).
+        
+        Args:
+            url: URL pública de la ruta del webhook; si se indica se registra
+                en Telegram con set_webhook
+            secret_token: Se envía de vuelta en el header
+                X-Telegram-Bot-Api-Secret-Token de cada update
+        """
+        logger.info("Iniciando bot de Telegram en modo webhook...")
+        await self.app.initialize()
+        await self.app.start()
+        if url:
+            await self.app.bot.set_webhook(url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+            logger.info(f"Webhook registrado en: {url}")
+    
+    async def procesar_update(self, datos: dict):
+        """
+        Procesa un update recibido por el webhook (el JSON que envía Telegram).
+        """
+        update = Update.de_json(datos, self.app.bot)
+        await self.app.process_update(update)
+    
+    async def detener_webhook(self):
+        """
+        Detiene el bot en modo webhook, esperando los lotes de fotos pendientes.
+        """
+        if self.tareas_lotes:
+            await asyncio.gather(*self.tareas_lotes, return_exceptions=True)
+        await self.app.stop()
+        await self.app.shutdown()
+
+async def run_telegram_bot(token: str):
+    """
+    Función principal para ejecutar el bot de Telegram.
+    
+    Args:
+        token: Token del bot de Telegram
+    """
+    bot = TelegramBot(token)
+    
+    print("🤖 INICIANDO BOT DE TELEGRAM")
+    print("=" * 40)
+    print("📱 El bot está escuchando mensajes...")
+    print("📸 Envía fotos de recibos para procesarlos automáticamente")
+    print("💬 Escribe 'ayuda' para ver comandos disponibles")
+    print("🛑 Presiona Ctrl+C para detener")
+    print()
+    
+    await bot.start_bot()
+
+# Configuración del bot - Token desde variable de entorno
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+
+if __name__ == "__main__":
+    import sys
+    
+    # Priorizar token desde línea de comandos, sino usar el del archivo
+    if len(sys.argv) >= 2:
+        token = sys.argv[1]
+        print(f"🔑 Usando token desde línea de comandos")
+    else:
+        token = BOT_TOKEN
+        if not token:
+            print("❌ Error: Token no configurado")
+            print()
+            print("Opciones para configurar el token:")
+            print("1. Crea un archivo .env con TELEGRAM_BOT_TOKEN=tu_token")
+            print("2. Ejecuta: python telegram_bot.py TU_BOT_TOKEN")
+            print()
+            print("Para obtener un token:")
+            print("1. Busca @BotFather en Telegram")
+            print("2. Envía /newbot")
+            print("3. Sigue las instrucciones")
+            print("4. Copia el token que te proporciona")
+            print("5. Agrégalo al archivo .env")
+            sys.exit(1)
+        else:
+            print(f"🔑 Usando token desde variable de entorno")
+    
+    try:
+        asyncio.run(run_telegram_bot(token))
+    except KeyboardInterrupt:
+        print("\n🛑 Bot de Telegram detenido")
+        sys.exit(0)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Los módulos del proyecto viven en la raíz del repo (no es un paquete instalable)
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+FIXTURES = os.path.join(RAIZ, "tests", "fixtures")
@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+
+import batch_extraccion
+import invoice_reader
+from conftest import FIXTURES
+from extraction_cache import ExtractionCache, hash_imagen
+from invoice_store import JsonlInvoiceStore
+
+RESULTADOS = os.path.join(FIXTURES, "batch", "resultados.jsonl")
+MANIFEST = os.path.join(FIXTURES, "batch", "manifest.json")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = JsonlInvoiceStore(str(tmp_path / "invoices.jsonl"))
+    monkeypatch.setattr(batch_extraccion, "obtener_store", lambda: store)
+    monkeypatch.setattr(batch_extraccion, "obtener_cache", lambda: None)
+    yield store
+    store.close()
+
+
+def test_fusionar_resultados_grabados(store, monkeypatch):
+    def reparar_falla(texto):
+        raise ConnectionError("API caída")
+
+    monkeypatch.setattr(invoice_reader, "reparar_respuesta", reparar_falla)
+
+    agregados, errores = batch_extraccion.fusionar_resultados(RESULTADOS, MANIFEST)
+
+    # La reparación que falla y el 500 cuentan como errores sin cortar la fusión
+    assert (agregados, errores) == (2, 2)
+    invoices = {i["receptor"]: i for i in store.iter_invoices()}
+    assert invoices["Juan Pérez"]["total"] == "15,000.50"
+    assert invoices["Juan Pérez"]["archivo_imagen"] == "uploads/recibo_mp.jpg"
+    assert invoices["Kiosco Sol"]["total"] == "2,500.00"
+    with open(MANIFEST, encoding="utf-8") as f:
+        assert {i["hash_imagen"] for i in invoices.values()} <= set(json.load(f))
+
+
+def test_fusionar_dos_veces_no_duplica(store, monkeypatch):
+    monkeypatch.setattr(invoice_reader, "reparar_respuesta", lambda texto: {"total": "300", "receptor": "Reparado"})
+
+    assert batch_extraccion.fusionar_resultados(RESULTADOS, MANIFEST) == (3, 1)
+    assert batch_extraccion.fusionar_resultados(RESULTADOS, MANIFEST) == (0, 1)
+    assert store.count() == 3
+
+
+def test_preparar_batch_reparte_en_partes(store, tmp_path, monkeypatch):
+    imagenes = tmp_path / "imagenes"
+    imagenes.mkdir()
+    for numero in range(5):
+        (imagenes / f"recibo_{numero}.jpg").write_bytes(f"imagen {numero}".encode())
+    monkeypatch.setattr(invoice_reader, "_solicitud_extraccion", lambda imagen_bytes: {"model": "gpt-4o-mini"})
+
+    salida = str(tmp_path / "batch.jsonl")
+    partes = batch_extraccion.preparar_batch([str(imagenes)], salida, max_solicitudes=2)
+
+    assert partes == [salida, str(tmp_path / "batch.parte2.jsonl"), str(tmp_path / "batch.parte3.jsonl")]
+    custom_ids = []
+    for parte in partes:
+        with open(parte, encoding="utf-8") as f:
+            custom_ids.extend(json.loads(linea)["custom_id"] for linea in f)
+    with open(salida + ".manifest.json", encoding="utf-8") as f:
+        assert sorted(custom_ids) == sorted(json.load(f))
+    assert len(custom_ids) == 5
+
+    # Por bytes: cada línea ocupa más que la mitad del máximo, una por parte
+    with open(salida, "rb") as f:
+        tamano_linea = len(f.readline())
+    partes = batch_extraccion.preparar_batch([str(imagenes)], salida, max_bytes=tamano_linea + 10)
+    assert len(partes) == 5
+
+
+def test_enviar_batch_reabre_el_archivo_en_cada_intento(tmp_path, monkeypatch):
+    archivo = tmp_path / "batch.jsonl"
+    archivo.write_bytes(b'{"custom_id": "x"}\n')
+    subidos = []
+
+    class Limitador:
+        def ejecutar(self, funcion, *args, **kwargs):
+            # Primer intento falla después de leer el archivo, como un 503 a mitad de subida
+            try:
+                return funcion(*args, **kwargs)
+            except ConnectionError:
+                return funcion(*args, **kwargs)
+
+    class Files:
+        def create(self, file, purpose):
+            subidos.append(file.read())
+            if len(subidos) == 1:
+                raise ConnectionError("503")
+            return type("Archivo", (), {"id": "file-1"})()
+
+    class Batches:
+        def create(self, **kwargs):
+            return type("Batch", (), {"id": "batch-1", "status": "validating"})()
+
+    cliente = type("Cliente", (), {"files": Files(), "batches": Batches()})()
+    monkeypatch.setattr(invoice_reader, "obtener_cliente", lambda: cliente)
+    monkeypatch.setattr(batch_extraccion, "obtener_limitador", lambda servicio: Limitador())
+
+    assert batch_extraccion.enviar_batch(str(archivo)) == "batch-1"
+    assert subidos == [b'{"custom_id": "x"}\n'] * 2
+
+
+def test_fusion_cachea_el_id_del_registro(store, tmp_path, monkeypatch):
+    imagen = b"jpeg del lote"
+    custom_id = hash_imagen(imagen)
+    manifest = tmp_path / "batch.manifest.json"
+    manifest.write_text(json.dumps({custom_id: "uploads/recibo.jpg"}), encoding="utf-8")
+    contenido = json.dumps({"total": "1,500.00", "receptor": "Kiosco"})
+    resultados = tmp_path / "resultados.jsonl"
+    resultados.write_text(json.dumps({
+        "custom_id": custom_id, "error": None,
+        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": contenido}}]}},
+    }) + "\n", encoding="utf-8")
+    cache = ExtractionCache(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(batch_extraccion, "obtener_cache", lambda: cache)
+    monkeypatch.setattr(invoice_reader, "obtener_cache", lambda: cache)
+
+    assert batch_extraccion.fusionar_resultados(str(resultados), str(manifest)) == (1, 0)
+    # La misma imagen llega después por Telegram: hit de la cache con el id ya guardado
+    datos = invoice_reader.leer_recibo("telegram.jpg", imagen)
+    assert datos["id"] == next(store.iter_invoices())["id"]
+    cache.close()
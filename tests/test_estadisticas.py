@@ -0,0 +1,85 @@
+from estadisticas import IndiceEstadisticas, ruta_indice
+from invoice_store import JsonlInvoiceStore, SqliteInvoiceStore
+
+
+def _abrir(backend, ruta):
+    store = backend(ruta)
+    store.estadisticas = IndiceEstadisticas(ruta_indice(ruta))
+    # Igual que obtener_store: reconstruir la primera vez, si no ponerse al día
+    if not store.estadisticas.inicializado():
+        store.estadisticas.reconstruir(store)
+    else:
+        store.estadisticas.ponerse_al_dia(store)
+        store.estadisticas.recontar_pendientes(store)
+    return store
+
+
+def _invoice(numero, cuenta="Galicia"):
+    return {"id": f"i{numero}", "total": "1.000,50", "cuenta_origen": cuenta,
+            "fecha_procesamiento": "17/10/2026 10:00:00"}
+
+
+def test_una_actualizacion_fallida_se_recupera_en_la_siguiente(tmp_path, monkeypatch):
+    store = _abrir(JsonlInvoiceStore, str(tmp_path / "invoices.jsonl"))
+    original = IndiceEstadisticas.ponerse_al_dia
+
+    def falla(self, store, lote=1000):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(IndiceEstadisticas, "ponerse_al_dia", falla)
+    store.append(_invoice(1))
+    assert store.estadisticas.resumen()["registros"] == 0
+
+    monkeypatch.setattr(IndiceEstadisticas, "ponerse_al_dia", original)
+    store.append(_invoice(2))
+    resumen = store.estadisticas.resumen()
+    assert resumen["registros"] == 2
+    assert resumen["pendientes"] == 2
+    assert resumen["cuentas"] == [{"clave": "Galicia", "cantidad": 2, "total": 2001.0}]
+    store.close()
+
+
+def test_dos_procesos_no_cuentan_dos_veces(tmp_path):
+    for backend, nombre in ((JsonlInvoiceStore, "invoices.jsonl"), (SqliteInvoiceStore, "invoices.db")):
+        ruta = str(tmp_path / nombre)
+        bot, worker = _abrir(backend, ruta), _abrir(backend, ruta)
+        bot.append(_invoice(1))
+        worker.append_many([_invoice(2), _invoice(3)])
+        bot.append(_invoice(4))
+        worker.mark_synced(["i1", "i2"])
+        # Un tercer proceso que abre el store no suma nada de nuevo
+        otro = _abrir(backend, ruta)
+        for store in (bot, worker, otro):
+            resumen = store.estadisticas.resumen()
+            assert (resumen["registros"], resumen["pendientes"]) == (4, 2)
+            store.close()
+
+
+def test_store_compactado_por_fuera_se_reconstruye(tmp_path):
+    ruta = str(tmp_path / "invoices.jsonl")
+    store = _abrir(JsonlInvoiceStore, ruta)
+    store.append_many([_invoice(1), _invoice(2), _invoice(1)])
+    assert store.estadisticas.resumen()["registros"] == 3
+    store.close()
+
+    JsonlInvoiceStore(ruta).compact()
+    # Los offsets quedaron atrás del final del archivo: la marca se descarta y se recorre de nuevo
+    store = _abrir(JsonlInvoiceStore, ruta)
+    assert store.estadisticas.resumen()["registros"] == 2
+    store.append(_invoice(3))
+    assert store.estadisticas.resumen()["registros"] == 3
+    store.close()
+
+
+def test_cada_backend_tiene_su_indice(tmp_path):
+    # La marca es un seq en SQLite y un offset en el JSONL: no pueden compartir índice
+    jsonl = JsonlInvoiceStore(str(tmp_path / "invoices.jsonl"))
+    jsonl.append_many([_invoice(numero) for numero in range(3)])
+    jsonl.close()
+    sqlite = _abrir(SqliteInvoiceStore, str(tmp_path / "invoices.db"))
+    sqlite.append_many([_invoice(numero) for numero in range(5)])
+    sqlite.close()
+
+    jsonl = _abrir(JsonlInvoiceStore, str(tmp_path / "invoices.jsonl"))
+    assert jsonl.estadisticas.resumen()["registros"] == 3
+    jsonl.close()
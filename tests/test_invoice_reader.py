@@ -0,0 +1,42 @@
+import asyncio
+
+import invoice_reader
+from cola_recibos import ColaRecibos
+from extraction_cache import ExtractionCache
+from invoice_store import JsonlInvoiceStore
+from orchestrator import InvoicePipeline
+
+
+def test_imagen_repetida_no_duplica_el_registro(tmp_path, monkeypatch):
+    llamadas = []
+
+    def extraer(imagen_bytes):
+        llamadas.append(imagen_bytes)
+        return {"total": "1,500.00", "receptor": "Kiosco", "id_transaccion": "123456"}
+
+    cache = ExtractionCache(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(invoice_reader, "_extraer_por_niveles", extraer)
+    monkeypatch.setattr(invoice_reader, "obtener_cache", lambda: cache)
+    store = JsonlInvoiceStore(str(tmp_path / "invoices.jsonl"))
+    pipeline = InvoicePipeline(store=store, cola=ColaRecibos(str(tmp_path / "cola.db")))
+
+    primero = invoice_reader.leer_recibo("telegram.jpg", b"jpeg")
+    assert pipeline.guardar(primero)
+    # La misma imagen por la API de uploads: hit de la cache, mismo id
+    segundo = invoice_reader.leer_recibo("upload.jpg", b"jpeg")
+    assert len(llamadas) == 1
+    assert segundo["id"] == primero["id"]
+    assert pipeline.guardar(segundo)
+    assert store.count() == 1
+
+    # También en un lote (álbum con la misma foto dos veces)
+    async def lote():
+        rutas = [str(tmp_path / "a.jpg"), str(tmp_path / "b.jpg")]
+        return await pipeline.aprocesar_lote(rutas, [b"jpeg", b"jpeg"])
+
+    monkeypatch.setattr(pipeline, "sincronizar", lambda: True)
+    resultados, _ = asyncio.run(lote())
+    assert all(resultados)
+    assert store.count() == 1
+    store.close()
+    cache.close()
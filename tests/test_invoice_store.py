@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+import invoice_store
+from invoice_store import JsonlInvoiceStore, migrar_desde_json
+
+
+def _legacy(tmp_path, cantidad=3):
+    ruta = tmp_path / "invoices.json"
+    ruta.write_text(json.dumps([{"total": str(i)} for i in range(cantidad)]), encoding="utf-8")
+    return str(ruta)
+
+
+def test_migracion_marca_lo_heredado_como_subido(tmp_path):
+    store = JsonlInvoiceStore(str(tmp_path / "invoices.jsonl"))
+    assert migrar_desde_json(_legacy(tmp_path), store) == 3
+    assert store.count() == 3
+    assert list(store.unsynced()) == []
+    store.close()
+
+
+def test_migracion_con_pendientes_vuelve_a_subir(tmp_path):
+    store = JsonlInvoiceStore(str(tmp_path / "invoices.jsonl"))
+    migrar_desde_json(_legacy(tmp_path), store, sincronizado=False)
+    assert store.count_unsynced() == 3
+    store.close()
+
+
+def test_obtener_store_no_deja_pendiente_el_historial(tmp_path, monkeypatch):
+    monkeypatch.setattr(invoice_store, "ESTADISTICAS_HABILITADAS", False)
+    legacy = _legacy(tmp_path)
+    store = invoice_store.obtener_store(legacy)
+    try:
+        assert store.count() == 3
+        assert store.count_unsynced() == 0
+    finally:
+        invoice_store._stores.pop(store.ruta, None)
+        store.close()
+
+
+def test_get_indexado_ve_lo_agregado_despues(tmp_path):
+    ruta = str(tmp_path / "invoices.jsonl")
+    store = JsonlInvoiceStore(ruta)
+    store.append_many([{"id": "a", "total": "1"}, {"id": "b", "total": "2"}])
+    assert store.get("b")["total"] == "2"
+    assert store.get("c") is None
+    # Otro proceso agrega al mismo archivo: el índice solo lee la cola nueva
+    otro = JsonlInvoiceStore(ruta)
+    otro.append({"id": "c", "total": "3"})
+    otro.append({"id": "a", "total": "4"})
+    otro.close()
+    assert store.get("c")["total"] == "3"
+    assert store.get("a")["total"] == "4"
+    store.compact()
+    assert store.get("a")["total"] == "4"
+    assert store.get("b")["total"] == "2"
+    store.close()
+
+
+def test_compactar_rechaza_sqlite(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "invoices.db")
+    monkeypatch.setattr("sys.argv", ["invoice_store.py", "compactar", ruta])
+    with pytest.raises(SystemExit) as salida:
+        invoice_store.main()
+    assert salida.value.code == 1
+    # No se escribió un JSONL encima de la base
+    assert not (tmp_path / "invoices.db").exists()
+
+
+def test_invoice_store_es_abstracto():
+    with pytest.raises(TypeError):
+        invoice_store.InvoiceStore()
+
+
+def test_count_coincide_con_iter_invoices(tmp_path):
+    ruta = tmp_path / "invoices.jsonl"
+    # Línea vacía, escritura cortada y una última línea sin salto
+    ruta.write_text('{"id": "a"}\n\n{"id": "b", "tot\n{"id": "c"}\n{"id": "d"}', encoding="utf-8")
+    store = JsonlInvoiceStore(str(ruta))
+    assert store.count() == len(list(store.iter_invoices())) == 3
+    store.close()
+
+
+def test_linea_sin_id_no_frena_la_marca_de_sincronizacion(tmp_path):
+    ruta = tmp_path / "invoices.jsonl"
+    ruta.write_text('{"total": "1"}\n{"id": "a"}\n', encoding="utf-8")
+    store = JsonlInvoiceStore(str(ruta))
+    store.mark_synced(["a"])
+    assert store._marca_sync == ruta.stat().st_size
+    store.append({"id": "b"})
+    assert [invoice["id"] for invoice in store.unsynced()] == ["b"]
+    store.close()
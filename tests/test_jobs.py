@@ -0,0 +1,34 @@
+import asyncio
+
+from app.jobs import ESTADO_TERMINADO, JobQueue
+
+
+def test_los_trabajos_en_espera_no_retienen_el_contenido(tmp_path):
+    recibidos = {}
+    escritos = []
+
+    async def procesar(file_path, contenido):
+        recibidos[file_path] = contenido
+        await asyncio.sleep(0.01)
+        return {"ok": True}
+
+    def a_disco(ruta, contenido):
+        escritos.append(ruta)
+        with open(ruta, "wb") as f:
+            f.write(contenido)
+
+    async def correr():
+        cola = JobQueue(procesar, max_workers=1, a_disco=a_disco)
+        rutas = [str(tmp_path / f"{n}.jpg") for n in range(3)]
+        jobs = [cola.encolar(ruta, f"img{n}".encode()) for n, ruta in enumerate(rutas)]
+        while cola._tareas:
+            await asyncio.sleep(0.01)
+        return rutas, [cola.obtener(job["id"]) for job in jobs]
+
+    rutas, jobs = asyncio.run(correr())
+    assert all(job["status"] == ESTADO_TERMINADO for job in jobs)
+    # El primero tenía turno y se procesa desde memoria; los otros esperaron en disco
+    assert recibidos[rutas[0]] == b"img0"
+    assert escritos == rutas[1:]
+    assert recibidos[rutas[1]] is None and recibidos[rutas[2]] is None
+    assert (tmp_path / "2.jpg").read_bytes() == b"img2"
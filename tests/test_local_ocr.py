@@ -0,0 +1,40 @@
+import os
+
+from conftest import FIXTURES
+from helpers.local_ocr import aplicar_plantillas
+
+
+def _texto(nombre):
+    with open(os.path.join(FIXTURES, "ocr", nombre), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_mercado_pago():
+    # El primer "$" es un aviso del celular: el total sale del bloque del comprobante
+    assert aplicar_plantillas(_texto("mercado_pago.txt")) == {
+        "total": "15,250.50",
+        "fecha": "17/10/2025",
+        "receptor": "Ana Gómez",
+        "cuenta_origen": "Mercado Pago",
+        "transaction_type": "transferencia",
+        "id_transaccion": "98765432101",
+        "remitente": "Juan Pérez",
+    }
+
+
+def test_uala():
+    # La comisión aparece antes que el monto
+    assert aplicar_plantillas(_texto("uala.txt")) == {
+        "total": "3,200.00",
+        "fecha": "05/10/2025",
+        "receptor": "Carlos Díaz",
+        "cuenta_origen": "Ualá",
+        "transaction_type": "transferencia",
+        "id_transaccion": "UALA-7F3K92",
+        "remitente": "María López",
+    }
+
+
+def test_sin_etiqueta_de_total_sigue_al_modelo():
+    texto = _texto("uala.txt").replace("Monto\n", "")
+    assert aplicar_plantillas(texto) is None
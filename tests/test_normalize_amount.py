@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from helpers.normalize_amount import _normalize_amount_string, normalize_amounts
+
+FIJOS = [
+    "", "-", "-0", "0", ".", ",", ".,", "12.", "1,234.", "1.2.3", "1,2.3,4", "abc", None,
+    "$ 1.234,56", "-$1,234.56", "$-5", "1 234,5", "0,005", "-0,004", "999.995", "1.234", "1,234,56",
+    "٣٤٥,٦٧", "²3", "1" * 30, 1234.5, -0.5, 1e20, 7,
+]
+SIMBOLOS = ["", "$", "$ ", "ARS ", "USD", " ", "€"]
+
+
+def monto_aleatorio(rng: random.Random) -> str:
+    """Monto con separadores mezclados, símbolos, negativos, redondeos y ruido de OCR."""
+    entero = str(rng.randint(0, 10 ** rng.randint(0, 12)))
+    miles, decimal = rng.choice([(".", ","), (",", "."), ("", ","), ("", "."), (" ", ",")])
+    if miles and rng.random() < 0.7:
+        grupos = []
+        while len(entero) > 3:
+            grupos.insert(0, entero[-3:])
+            entero = entero[:-3]
+        entero = miles.join([entero] + grupos)
+    texto = entero
+    if rng.random() < 0.7:
+        texto += decimal + "".join(rng.choice("0123456789") for _ in range(rng.randint(0, 4)))
+    if rng.random() < 0.2:
+        texto = "-" + texto
+    texto = rng.choice(SIMBOLOS) + texto
+    if rng.random() < 0.05:
+        posicion = rng.randint(0, len(texto))
+        texto = texto[:posicion] + rng.choice("-.,xO ") + texto[posicion:]
+    return texto
+
+
+def _verificar(valores):
+    esperados = [_normalize_amount_string(valor) for valor in valores]
+    assert normalize_amounts(valores) == esperados
+    assert normalize_amounts(valores, como_centavos=True) == [
+        int(esperado.replace(",", "").replace(".", "")) for esperado in esperados
+    ]
+
+
+def test_casos_limite_igual_que_la_version_con_decimal():
+    _verificar(FIJOS)
+
+
+@pytest.mark.parametrize("semilla", [1234, 7, 2024])
+def test_montos_aleatorios_igual_que_la_version_con_decimal(semilla):
+    rng = random.Random(semilla)
+    _verificar([monto_aleatorio(rng) for _ in range(20_000)])
+
+
+def test_repetidos_dan_el_mismo_resultado():
+    assert normalize_amounts(["$ 1.234,56"] * 3 + ["-0"]) == ["1,234.56"] * 3 + ["0.00"]
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+from cola_recibos import ColaRecibos
+from invoice_store import JsonlInvoiceStore
+import invoice_reader
+import orchestrator
+from orchestrator import InvoicePipeline
+
+
+def test_un_fallo_al_archivar_queda_en_el_trabajo(tmp_path):
+    cola = ColaRecibos(str(tmp_path / "cola.db"))
+    pipeline = InvoicePipeline(store=JsonlInvoiceStore(str(tmp_path / "invoices.jsonl")), cola=cola)
+    # El directorio destino es un archivo: la escritura falla
+    (tmp_path / "docs").write_text("")
+    trabajo = cola.encolar(str(tmp_path / "docs" / "recibo.jpg"), reclamar=True)
+
+    async def archivar():
+        await pipeline.archivar(trabajo["archivo"], b"jpeg", trabajo["id"])
+
+    asyncio.run(archivar())
+    guardado = cola.obtener(trabajo["id"])
+    assert guardado["error_archivo"]
+    assert guardado["etapa"] == trabajo["etapa"]
+    assert cola.estado()["sin_archivo"] == 1
+    cola.close()
+
+
+def test_sincronizacion_fallida_no_se_informa_como_exitosa(tmp_path, monkeypatch, capsys):
+    class Lector:
+        def leer_recibo(self, imagen_path):
+            return {"id": "a", "total": "100"}
+
+    imagen = tmp_path / "recibo.jpg"
+    imagen.write_bytes(b"jpeg")
+    cola = ColaRecibos(str(tmp_path / "cola.db"))
+    pipeline = InvoicePipeline(reader=Lector(), store=JsonlInvoiceStore(str(tmp_path / "invoices.jsonl")),
+                               cola=cola, sheet_id="hoja")
+    monkeypatch.setattr(pipeline, "sincronizar", lambda: False)
+
+    resultado, sincronizado = pipeline.procesar(str(imagen))
+    assert resultado["total"] == "100"
+    assert not sincronizado
+
+    monkeypatch.setattr(orchestrator, "obtener_pipeline", lambda: pipeline)
+    assert orchestrator.procesar_imagen_telegram(str(imagen)) is False
+    salida = capsys.readouterr().out
+    assert "pendiente de sincronizar" in salida
+    assert "Google Sheets sincronizado" not in salida
+    cola.close()
+
+
+def test_probar_una_foto_mas_grande_antes_que_el_modelo_grande(tmp_path, monkeypatch):
+    validos = {("grande", "gpt-4o")}
+    llamadas = []
+
+    async def crear_respuesta(solicitud):
+        foto = solicitud["messages"][0]["content"][1]["image_url"]["url"]
+        llamadas.append((foto, solicitud["model"]))
+        datos = {"total": "100", "fecha": "17/10/2026"}
+        if (foto, solicitud["model"]) in validos:
+            datos["cuenta_origen"] = "Galicia"
+        mensaje = type("Mensaje", (), {"content": json.dumps(datos)})()
+        return type("Respuesta", (), {"choices": [type("Opcion", (), {"message": mensaje})()]})()
+
+    monkeypatch.setattr(invoice_reader, "MODELOS_EXTRACCION", ["gpt-4o-mini", "gpt-4o"])
+    monkeypatch.setattr(invoice_reader, "_acrear_respuesta", crear_respuesta)
+    monkeypatch.setattr(invoice_reader, "_imagen_data_url", lambda imagen_bytes: imagen_bytes.decode())
+    monkeypatch.setattr(invoice_reader, "extraer_local", lambda imagen_bytes: None)
+    monkeypatch.setattr(invoice_reader, "obtener_cache", lambda: None)
+    cola = ColaRecibos(str(tmp_path / "cola.db"))
+    pipeline = InvoicePipeline(store=JsonlInvoiceStore(str(tmp_path / "invoices.jsonl")), cola=cola)
+    tamanos = [b"mediana", b"grande"]
+
+    async def ampliar():
+        return tamanos.pop(0) if tamanos else None
+
+    async def extraer():
+        trabajo = cola.encolar(str(tmp_path / "recibo.jpg"), reclamar=True)
+        datos = await pipeline._aextraer_trabajo(trabajo, b"chica", ampliar)
+        await asyncio.gather(*pipeline._archivando.values())
+        return datos
+
+    datos = asyncio.run(extraer())
+    assert datos["cuenta_origen"] == "Galicia"
+    # Cada tamaño con el modelo rápido; el grande una vez, con la foto más grande
+    assert llamadas == [("chica", "gpt-4o-mini"), ("mediana", "gpt-4o-mini"),
+                        ("grande", "gpt-4o-mini"), ("grande", "gpt-4o")]
+    cola.close()
@@ -0,0 +1,46 @@
+import requests
+from urllib3.exceptions import NewConnectionError
+
+import rate_limiter
+from rate_limiter import CARRIL_BACKFILL, CODIGOS_SIN_APLICAR, LimitadorServicio, TokenBucket, carril
+
+
+class ErrorHttp(Exception):
+    def __init__(self, codigo):
+        super().__init__(codigo)
+        self.response = type("Respuesta", (), {"status_code": codigo, "headers": {}})()
+
+
+def test_reserva_no_bloquea_una_cubeta_chica():
+    # Con 1 escritura por minuto la reserva interactiva no puede exigir más que la capacidad
+    cubeta = TokenBucket(1)
+    assert cubeta.espera(1, reserva=0.25) == 0.0
+
+
+def test_backfill_respeta_la_reserva():
+    limitador = LimitadorServicio("prueba", 60)
+    with carril(CARRIL_BACKFILL):
+        while limitador._intentar(0) == 0:
+            pass
+    # Lo que queda es la reserva del carril interactivo
+    assert limitador.solicitudes.disponible >= rate_limiter.RATE_RESERVA_INTERACTIVA * 60 - 1
+    assert limitador._intentar(0) == 0
+
+
+def test_escrituras_no_idempotentes_no_se_reintentan_con_5xx():
+    limitador = LimitadorServicio(
+        "Sheets", 60, codigos_transitorios=CODIGOS_SIN_APLICAR,
+        es_transitorio=rate_limiter.conexion_no_establecida,
+    )
+    assert limitador._espera_reintento(ErrorHttp(503), 0) is None
+    assert limitador._espera_reintento(ErrorHttp(429), 0) is not None
+
+    rechazada = requests.exceptions.ConnectionError(NewConnectionError(None, "Connection refused"))
+    assert limitador._espera_reintento(rechazada, 0) is not None
+    cortada = requests.exceptions.ConnectionError("Connection reset by peer")
+    assert limitador._espera_reintento(cortada, 0) is None
+
+
+def test_openai_reintenta_5xx():
+    limitador = LimitadorServicio("OpenAI", 60)
+    assert limitador._espera_reintento(ErrorHttp(503), 0) is not None
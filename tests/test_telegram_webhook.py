@@ -0,0 +1,136 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+from conftest import FIXTURES
+
+with open(os.path.join(FIXTURES, "telegram", "updates.json"), encoding="utf-8") as f:
+    UPDATES = json.load(f)
+
+
+def _stub_bot_api():
+    """Bot API mínima: registra cada llamada y sirve bytes falsos para los archivos."""
+    stub = FastAPI()
+    stub.state.llamadas = []
+
+    @stub.post("/bot{token}/{metodo}")
+    async def api(token: str, metodo: str, request: Request):
+        datos = dict(await request.form()) or {}
+        if not datos and await request.body():
+            datos = await request.json()
+        stub.state.llamadas.append((metodo, datos))
+        if metodo == "getMe":
+            resultado = {"id": 1, "is_bot": True, "first_name": "stub", "username": "stub_bot"}
+        elif metodo == "getFile":
+            resultado = {"file_id": datos["file_id"], "file_unique_id": "u", "file_path": f"photos/{datos['file_id']}.jpg"}
+        elif metodo == "sendMessage":
+            resultado = {"message_id": 900, "date": 0, "chat": {"id": int(datos["chat_id"]), "type": "private"},
+                         "text": datos.get("text")}
+        else:
+            resultado = True
+        return {"ok": True, "result": resultado}
+
+    @stub.get("/file/bot{token}/photos/{nombre}")
+    async def archivo(token: str, nombre: str):
+        return Response(b"jpeg:" + nombre.encode())
+
+    return stub
+
+
+@pytest.fixture(scope="module")
+def bot_api():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    stub = _stub_bot_api()
+    servidor = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=puerto, log_level="warning"))
+    hilo = threading.Thread(target=servidor.run, daemon=True)
+    hilo.start()
+    while not servidor.started:
+        time.sleep(0.01)
+    yield stub, f"http://127.0.0.1:{puerto}"
+    servidor.should_exit = True
+    hilo.join()
+
+
+class PipelineFalso:
+    def __init__(self):
+        self.lotes = []
+
+    async def aprocesar_lote(self, imagenes, contenidos=None, ampliadores=None):
+        self.lotes.append((imagenes, contenidos))
+        return [{"total": "1,500.00", "receptor": "Kiosco"} for _ in imagenes], True
+
+
+@pytest.fixture
+def app_webhook(bot_api, tmp_path, monkeypatch):
+    stub, url = bot_api
+    stub.state.llamadas.clear()
+    # Las fotos se archivan en docs/invoices relativo al directorio actual
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "123:abc")
+
+    import main
+    import telegram_bot
+
+    pipeline = PipelineFalso()
+    monkeypatch.setattr(telegram_bot, "TELEGRAM_API_BASE_URL", url + "/bot")
+    monkeypatch.setattr(telegram_bot, "TELEGRAM_API_BASE_FILE_URL", url + "/file/bot")
+    monkeypatch.setattr(telegram_bot, "TELEGRAM_VENTANA_LOTE", 0.2)
+    monkeypatch.setattr(telegram_bot, "COLA_WORKER_EN_BOT", False)
+    monkeypatch.setattr(telegram_bot, "obtener_pipeline", lambda: pipeline)
+    monkeypatch.setattr(main, "TELEGRAM_WEBHOOK_URL", "https://ejemplo.test/api/v1/telegram/webhook")
+    monkeypatch.setattr(main, "TELEGRAM_WEBHOOK_SECRET", "")
+    return main.app, stub, pipeline
+
+
+def _metodos(stub, metodo):
+    return [datos for nombre, datos in stub.state.llamadas if nombre == metodo]
+
+
+def test_sin_secret_configurado_se_genera_uno(app_webhook):
+    app, stub, _ = app_webhook
+    with TestClient(app) as cliente:
+        (registro,) = _metodos(stub, "setWebhook")
+        secret = registro["secret_token"]
+        assert secret and secret == app.state.telegram_webhook_secret
+
+        assert cliente.post("/api/v1/telegram/webhook", json=UPDATES[0]).status_code == 403
+        assert cliente.post("/api/v1/telegram/webhook", json=UPDATES[0],
+                            headers={"X-Telegram-Bot-Api-Secret-Token": "adivinado"}).status_code == 403
+        assert _metodos(stub, "sendMessage") == []
+
+        respuesta = cliente.post("/api/v1/telegram/webhook", json=UPDATES[0],
+                                 headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+        assert respuesta.json() == {"ok": True}
+    (mensaje,) = _metodos(stub, "sendMessage")
+    assert "Comandos disponibles" in mensaje["text"]
+
+
+def test_album_grabado_se_procesa_en_un_lote(app_webhook):
+    app, stub, pipeline = app_webhook
+    with TestClient(app) as cliente:
+        secret = app.state.telegram_webhook_secret
+        for update in UPDATES[1:]:
+            respuesta = cliente.post("/api/v1/telegram/webhook", json=update,
+                                     headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+            assert respuesta.status_code == 200
+    # Al cerrar la app se esperan los lotes pendientes
+
+    # Se descarga el tamaño más chico que alcanza TELEGRAM_MIN_PIXELES, no el más grande disponible
+    assert [datos["file_id"] for datos in _metodos(stub, "getFile")] == [
+        "AgACAgEAAxkBAAIBnGjy-x1280", "AgACAgEAAxkBAAIBnWjy-x1280",
+    ]
+    ((imagenes, contenidos),) = pipeline.lotes
+    assert len(imagenes) == 2
+    assert contenidos == [b"jpeg:AgACAgEAAxkBAAIBnGjy-x1280.jpg", b"jpeg:AgACAgEAAxkBAAIBnWjy-x1280.jpg"]
+    (resumen,) = _metodos(stub, "sendMessage")
+    assert resumen["text"].startswith("✅ 2 de 2 recibos procesados!")